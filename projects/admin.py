@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from qr.models import PhotoUploadBatch, related_count
 from .models import Project
 
 
@@ -7,6 +8,7 @@ from .models import Project
 class ProjectAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'qr_batches_count', 'photo_batches_count', 'created_at')
     list_filter = ('created_at', 'user')
+    list_select_related = ('user',)
     search_fields = ('name', 'description', 'user__username', 'user__email')
     readonly_fields = ('created_at',)
     
@@ -19,10 +21,17 @@ class ProjectAdmin(admin.ModelAdmin):
         })
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            photo_batches_total=related_count(PhotoUploadBatch, 'project'),
+        )
+    
     def qr_batches_count(self, obj):
-        return obj.qr_cards.count()
+        return obj.card_total
     qr_batches_count.short_description = 'QR Cards'
+    qr_batches_count.admin_order_field = 'card_total'
     
     def photo_batches_count(self, obj):
-        return obj.photo_batches.count()
+        return obj.photo_batches_total
     photo_batches_count.short_description = 'Photo Batches'
+    photo_batches_count.admin_order_field = 'photo_batches_total'
@@ -1,11 +1,51 @@
 from django.db import models
 from django.conf import settings
 
-class Project(models.Model):
+
+class CounterFieldsMixin:
+    """
+    Counter columns only ever change through F() updates (qr.counters), so a
+    plain save() of an existing row leaves them out instead of writing back a
+    stale in-memory value.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Project(CounterFieldsMixin, models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='projects')
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Maintained by qr.counters: cards, their photos and cards per QRCard status
+    card_total = models.PositiveIntegerField(default=0, editable=False)
+    photo_total = models.PositiveIntegerField(default=0, editable=False)
+    cards_distributed = models.PositiveIntegerField(default=0, editable=False)
+    cards_scanned = models.PositiveIntegerField(default=0, editable=False)
+    cards_info_provided = models.PositiveIntegerField(default=0, editable=False)
+    cards_photos_uploaded = models.PositiveIntegerField(default=0, editable=False)
+    cards_completed = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = (
+        'card_total', 'photo_total',
+        'cards_distributed', 'cards_scanned', 'cards_info_provided', 'cards_photos_uploaded', 'cards_completed',
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # As loaded, so saves that leave what clients see alone skip invalidating their cards (qr.signals)
+        instance._loaded_client_fields = (instance.__dict__.get('name'), instance.__dict__.get('description'))
+        return instance
+
     def __str__(self):
         return self.name
@@ -1,5 +1,12 @@
+from datetime import date, timedelta
+
+from django.conf import settings
 from django.shortcuts import render
-from rest_framework import viewsets, permissions
+from django.utils import timezone
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from qr.funnel import project_funnel
 from .models import Project
 from .serializers import ProjectSerializer
 
@@ -14,3 +21,24 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def funnel(self, request, pk=None):
+        """Scan-to-delivery funnel per day between ?from= and ?to= (ISO dates, default the last 30 days)"""
+        project = self.get_object()
+        
+        first_param = request.query_params.get('from')
+        last_param = request.query_params.get('to')
+        try:
+            last_day = date.fromisoformat(last_param) if last_param else timezone.localdate()
+            first_day = date.fromisoformat(first_param) if first_param else last_day - timedelta(days=29)
+        except ValueError:
+            return Response({'error': 'from and to must be dates (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        max_days = getattr(settings, 'FUNNEL_MAX_DAYS', 366)
+        if first_day > last_day:
+            return Response({'error': 'from must not be after to'}, status=status.HTTP_400_BAD_REQUEST)
+        if (last_day - first_day).days >= max_days:
+            return Response({'error': f'At most {max_days} days per request'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(project_funnel(project, first_day, last_day))
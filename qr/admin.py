@@ -9,18 +9,21 @@ from .models import QRCard, QRCardBatch, QRCardPhoto, PhotoUploadBatch, RawPhoto
 class QRCardBatchAdmin(admin.ModelAdmin):
     list_display = ('name', 'project', 'created_at', 'qr_cards_count')
     list_filter = ('created_at', 'project')
+    list_select_related = ('project',)
     search_fields = ('name', 'project__name')
     readonly_fields = ('created_at',)
     
     def qr_cards_count(self, obj):
-        return obj.qrcards.count()
+        return obj.card_total
     qr_cards_count.short_description = 'QR Cards'
+    qr_cards_count.admin_order_field = 'card_total'
 
 
 @admin.register(QRCard)
 class QRCardAdmin(admin.ModelAdmin):
     list_display = ('short_code', 'status', 'client_name', 'client_email', 'photo_count', 'qr_code_thumbnail', 'project', 'created_at')
     list_filter = ('status', 'created_at', 'project')
+    list_select_related = ('project',)
     search_fields = ('code', 'short_code', 'client_name', 'client_email')
     readonly_fields = ('code', 'short_code', 'access_pin', 'qr_code_display', 'qr_url_display', 'created_at', 'scanned_at', 'info_provided_at', 'photos_uploaded_at', 'completed_at')
     
@@ -43,8 +46,9 @@ class QRCardAdmin(admin.ModelAdmin):
     )
     
     def photo_count(self, obj):
-        return obj.photos.count()
+        return obj.photo_total
     photo_count.short_description = 'Photos'
+    photo_count.admin_order_field = 'photo_total'
     
     def qr_code_thumbnail(self, obj):
         """Display a small QR code thumbnail in the list view"""
@@ -84,6 +88,7 @@ class QRCardAdmin(admin.ModelAdmin):
 class QRCardPhotoAdmin(admin.ModelAdmin):
     list_display = ('id', 'qr_card_info', 'original_filename', 'file_size_mb', 'uploaded_at', 'image_preview')
     list_filter = ('uploaded_at', 'qr_card__project')
+    list_select_related = ('qr_card',)
     search_fields = ('original_filename', 'qr_card__short_code', 'qr_card__client_name')
     readonly_fields = ('file_size', 'file_size_mb', 'uploaded_at', 'image_preview')
     
@@ -112,6 +117,7 @@ class QRCardPhotoAdmin(admin.ModelAdmin):
 class PhotoUploadBatchAdmin(admin.ModelAdmin):
     list_display = ('name', 'project', 'status', 'total_photos', 'processed_photos', 'qr_codes_found', 'progress_percentage', 'created_at')
     list_filter = ('status', 'created_at', 'project')
+    list_select_related = ('project',)
     search_fields = ('name', 'project__name')
     readonly_fields = ('created_at', 'completed_at', 'progress_percentage')
     
@@ -129,6 +135,7 @@ class PhotoUploadBatchAdmin(admin.ModelAdmin):
 class RawPhotoUploadAdmin(admin.ModelAdmin):
     list_display = ('id', 'batch_info', 'original_filename', 'file_size_mb', 'has_qr_code', 'assigned_qr_card_info', 'is_processed', 'uploaded_at', 'image_preview')
     list_filter = ('has_qr_code', 'is_processed', 'uploaded_at', 'batch__project')
+    list_select_related = ('batch', 'assigned_qr_card')
     search_fields = ('original_filename', 'batch__name', 'assigned_qr_card__short_code')
     readonly_fields = ('file_size', 'file_size_mb', 'uploaded_at', 'image_preview')
     
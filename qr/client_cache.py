@@ -0,0 +1,86 @@
+"""
+Cache of the client (tourist) view of a QR card.
+
+Tourists reload their card page many times from many devices. The serialized
+QRCardClientSerializer payload is cached per card code together with the
+card's PIN, so a repeat visit is one cache read: no PIN lookup, project load
+or photo serialization.
+
+Entries are dropped whenever something they show changes: the card itself
+(status, client info), its photos (new uploads, derivatives) or its project.
+That happens through the signals in qr.signals, plus explicit calls where
+rows are written without signals (bulk_create, update()). Each invalidation
+is repeated after the transaction commits, so a request racing the write
+can't re-cache the old row. Cards still in 'distributed' are never cached,
+because their first view has to record the scan.
+
+Each entry also carries an ETag of the payload and the time it was cached.
+The fill time serves as Last-Modified: any change drops the entry, so the
+next fill is always later than the change. A tourist's poll with a current
+If-None-Match is answered with a 304 straight from the cache.
+
+A cache outage only costs the hit: every cache error is logged and the
+request falls through to the database.
+
+Settings (optional):
+- CLIENT_CARD_CACHE_TIMEOUT (default 300 seconds). Keep it below
+  AWS_QUERYSTRING_EXPIRE when S3 URLs are signed, since photo URLs are cached.
+"""
+import hmac
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .conditional import payload_etag
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'qr:client-card:'
+
+
+def client_card_key(code):
+    return f'{KEY_PREFIX}{code}'
+
+
+def get_client_card(code, pin):
+    """The cached {'data', 'etag', 'cached_at'} for a card if there is one and the PIN matches, else None"""
+    try:
+        entry = cache.get(client_card_key(code))
+    except Exception as e:
+        logger.warning(f"Client card cache read failed: {str(e)}")
+        return None
+    if entry is None or not hmac.compare_digest(str(entry['pin']), str(pin)):
+        return None
+    return entry
+
+
+def set_client_card(qr_card, data):
+    """Cache a freshly serialized payload; returns the entry either way"""
+    entry = {'pin': qr_card.access_pin, 'data': data, 'etag': payload_etag(data), 'cached_at': timezone.now()}
+    if qr_card.status == 'distributed':
+        return entry
+    timeout = getattr(settings, 'CLIENT_CARD_CACHE_TIMEOUT', 300)
+    try:
+        cache.set(client_card_key(qr_card.code), entry, timeout)
+    except Exception as e:
+        logger.warning(f"Client card cache write failed: {str(e)}")
+    return entry
+
+
+def invalidate_client_cards(codes):
+    """Drop the cached payloads for these card codes, now and once the current transaction commits"""
+    keys = [client_card_key(code) for code in codes]
+    if not keys:
+        return
+
+    def delete():
+        try:
+            cache.delete_many(keys)
+        except Exception as e:
+            logger.warning(f"Client card cache invalidation failed: {str(e)}")
+
+    delete()
+    transaction.on_commit(delete)
@@ -0,0 +1,44 @@
+"""
+Conditional GET for endpoints the frontend polls.
+
+Each endpoint derives a version for its payload from something cheap to read:
+the updated_at columns of a batch and its photos, or the ETag stored with a
+cached client card. A request whose If-None-Match / If-Modified-Since still
+matches gets a 304 before anything is loaded or serialized.
+"""
+import hashlib
+import json
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """Weak ETag over the given version parts"""
+    digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'W/"{digest}"'
+
+
+def payload_etag(data):
+    return make_etag(json.dumps(data, sort_keys=True, default=str))
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """A 304 response if the client's copy is current, else None"""
+    request = getattr(request, '_request', request)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag=None, last_modified=None):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Let browsers keep the copy, but revalidate it on every poll
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
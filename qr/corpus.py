@@ -0,0 +1,173 @@
+"""
+Synthetic photo corpus for QR detection benchmarks.
+
+Photos are composed from the same QR payloads the card PDFs carry
+(`{FRONTEND_URL}/client/<code>?pin=<pin>`), pasted onto a noisy scene with
+varying card size, rotation, blur, JPEG quality and lighting. A session is one
+photo of the card followed by a few photos without a code, which mirrors how
+photographers shoot and lets the benchmark check the assignment logic too.
+
+The corpus directory holds the JPEGs plus a manifest.json of
+{filename: {"payload", "card_code", "pin", "params"}}, in shooting order.
+"""
+import json
+import os
+import random
+import uuid
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+MANIFEST_NAME = 'manifest.json'
+
+# Ranges the generator samples from for every card photo
+VARIATIONS = {
+    'card_fraction': (0.08, 0.45),  # card width relative to the photo width
+    'rotation': (-35.0, 35.0),      # degrees
+    'blur': (0.0, 2.5),             # gaussian radius in px
+    'quality': (45, 95),            # JPEG quality
+    'brightness': (0.45, 1.4),
+    'contrast': (0.6, 1.3),
+}
+
+
+def build_qr_url(code, pin):
+    """The URL encoded on printed cards (see generate_qr_pdf_task)"""
+    return f"{settings.FRONTEND_URL}/client/{code}?pin={pin}"
+
+
+def parse_qr_url(qr_url):
+    """Returns (code, pin) from a card URL"""
+    path, _, query = qr_url.partition('?')
+    code = path.split('/client/')[-1]
+    pin = query.split('pin=')[-1] if 'pin=' in query else ''
+    return code, pin
+
+
+def random_payloads(amount, rng):
+    """Generate card codes and PINs the same way generate_qr_pdf_task does"""
+    payloads = []
+    for _ in range(amount):
+        code = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        pin = str(rng.randint(1000, 9999))
+        payloads.append((code, pin))
+    return payloads
+
+
+def render_card(qr_url, code, pin, width):
+    """Render a printed card: white stock with the QR code, short code and PIN"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=1,
+    )
+    qr.add_data(qr_url)
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+
+    margin = width // 10
+    qr_size = width - 2 * margin
+    card = Image.new('RGB', (width, int(width * 1.3)), 'white')
+    card.paste(qr_img.resize((qr_size, qr_size), Image.NEAREST), (margin, margin))
+    draw = ImageDraw.Draw(card)
+    draw.text((margin, margin + qr_size + margin // 2), f"{code[:8]}...  PIN: {pin}", fill='black')
+    return card
+
+
+def render_scene(size, rng):
+    """A background that is busy enough to give the detectors some false leads"""
+    width, height = size
+    top = tuple(rng.randint(40, 220) for _ in range(3))
+    bottom = tuple(rng.randint(40, 220) for _ in range(3))
+    gradient = Image.linear_gradient('L').resize(size)
+    scene = Image.composite(Image.new('RGB', size, bottom), Image.new('RGB', size, top), gradient)
+
+    draw = ImageDraw.Draw(scene)
+    for _ in range(rng.randint(8, 25)):
+        x0, y0 = rng.randint(0, width), rng.randint(0, height)
+        x1, y1 = x0 + rng.randint(20, width // 3), y0 + rng.randint(20, height // 3)
+        fill = tuple(rng.randint(0, 255) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=fill)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=fill)
+    return scene.filter(ImageFilter.GaussianBlur(1))
+
+
+def sample_params(rng):
+    """Pick one value from every VARIATIONS range"""
+    params = {}
+    for key, (low, high) in VARIATIONS.items():
+        if isinstance(low, int):
+            params[key] = rng.randint(low, high)
+        else:
+            params[key] = round(rng.uniform(low, high), 3)
+    return params
+
+
+def compose_photo(size, rng, card=None, params=None):
+    """Compose one photo, optionally holding a card, and return its JPEG bytes"""
+    params = params or sample_params(rng)
+    photo = render_scene(size, rng)
+
+    if card is not None:
+        card_width = max(60, int(size[0] * params['card_fraction']))
+        card = card.resize((card_width, int(card_width * card.height / card.width)), Image.BILINEAR)
+        card = card.convert('RGBA').rotate(params['rotation'], expand=True, resample=Image.BICUBIC)
+        x = rng.randint(0, max(0, size[0] - card.width))
+        y = rng.randint(0, max(0, size[1] - card.height))
+        photo.paste(card, (x, y), card)
+
+    photo = photo.filter(ImageFilter.GaussianBlur(params['blur']))
+    photo = ImageEnhance.Brightness(photo).enhance(params['brightness'])
+    photo = ImageEnhance.Contrast(photo).enhance(params['contrast'])
+
+    buffer = BytesIO()
+    photo.save(buffer, format='JPEG', quality=params['quality'])
+    return buffer.getvalue(), params
+
+
+def generate_corpus(output_dir, payloads, photos_per_card=3, size=(2400, 1600), seed=0):
+    """Write a corpus of sessions (card photo + `photos_per_card` plain photos) and its manifest"""
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = {}
+    index = 0
+    for code, pin in payloads:
+        qr_url = build_qr_url(code, pin)
+        card = render_card(qr_url, code, pin, width=600)
+        for shot in range(photos_per_card + 1):
+            index += 1
+            has_card = shot == 0
+            data, params = compose_photo(size, rng, card=card if has_card else None)
+            filename = f"{index:05d}_{'qr' if has_card else 'photo'}.jpg"
+            with open(os.path.join(output_dir, filename), 'wb') as f:
+                f.write(data)
+            manifest[filename] = {
+                'payload': qr_url if has_card else None,
+                'card_code': code,
+                'pin': pin,
+                'params': params if has_card else {},
+            }
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(corpus_dir):
+    """Returns the corpus manifest as an ordered dict of {filename: entry}, or None"""
+    path = os.path.join(corpus_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    # Older hand-written manifests map filenames straight to payloads
+    return {
+        filename: entry if isinstance(entry, dict) else {'payload': entry}
+        for filename, entry in manifest.items()
+    }
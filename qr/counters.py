@@ -0,0 +1,123 @@
+"""
+Denormalized counters.
+
+Lists, the admin and user_stats read counts from columns instead of running
+COUNT(*) per row:
+- QRCard.photo_total - photos on the card
+- QRCardBatch.card_total - cards generated in the batch
+- Project.card_total, Project.photo_total and Project.cards_<status> for each
+  QRCard status
+
+The columns only change through F() updates issued where rows are created,
+deleted or change status, so two increments never overwrite each other, and
+CounterFieldsMixin keeps them out of ordinary saves. Single-row saves and
+deletes are counted by the receivers in qr.signals; bulk_create and update()
+send no signals, so those call in here directly.
+
+Status changes made by the app go through change_card_status(): a
+conditional UPDATE from the status the card was loaded with, so of two
+concurrent writers only the one that actually moved the card moves the
+per-status counters. Other saves (the admin, the generic API update) count
+a transition from the status their instance was loaded with, which a
+concurrent change may already have left; like moving a card to another
+project or batch, and raw SQL, that drift is not prevented. The
+reconcile_counters management command recounts everything in bulk and
+repairs it.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import F, QuerySet
+from django.db.models.functions import Greatest
+
+from projects.models import Project
+from .client_cache import invalidate_client_cards
+from .models import QRCard, QRCardBatch
+
+
+def status_field(status):
+    """Project column counting the cards in this status"""
+    return f'cards_{status}'
+
+
+def deleted_via(origin, model):
+    """Whether a delete() started from `model` rather than cascading from a parent"""
+    return isinstance(origin, model) or (isinstance(origin, QuerySet) and origin.model is model)
+
+
+def increment(queryset, **deltas):
+    """Add the deltas to counter columns in one UPDATE; decrements stop at zero"""
+    updates = {}
+    for field, delta in deltas.items():
+        if delta > 0:
+            updates[field] = F(field) + delta
+        elif delta < 0:
+            updates[field] = Greatest(F(field) + delta, 0)
+    if updates:
+        queryset.update(**updates)
+
+
+def count_cards(cards, sign):
+    by_project = defaultdict(Counter)
+    photos_by_project = Counter()
+    by_batch = Counter()
+    for card in cards:
+        by_project[card.project_id][card.status] += 1
+        photos_by_project[card.project_id] += card.photo_total
+        if card.batch_id:
+            by_batch[card.batch_id] += 1
+
+    for project_id, statuses in by_project.items():
+        deltas = {status_field(status): sign * count for status, count in statuses.items()}
+        increment(
+            Project.objects.filter(pk=project_id),
+            card_total=sign * sum(statuses.values()), photo_total=sign * photos_by_project[project_id], **deltas
+        )
+    for batch_id, count in by_batch.items():
+        increment(QRCardBatch.objects.filter(pk=batch_id), card_total=sign * count)
+
+
+def cards_added(cards):
+    """Count new cards: one UPDATE per project and per batch they belong to"""
+    count_cards(cards, 1)
+
+
+def cards_removed(cards):
+    """Uncount deleted cards, together with the photos they carried"""
+    count_cards(cards, -1)
+
+
+def card_status_changed(project_id, old_status, new_status):
+    if old_status != new_status:
+        increment(Project.objects.filter(pk=project_id), **{status_field(old_status): -1, status_field(new_status): 1})
+
+
+def change_card_status(qr_card, new_status, from_statuses, **fields):
+    """
+    Move a card to `new_status`, setting `fields` as well, if its current
+    status is one of `from_statuses`. Returns whether this call moved it; if
+    not, the instance is refreshed with the status (and `fields`) that won.
+    """
+    while qr_card.status in from_statuses:
+        old_status = qr_card.status
+        if QRCard.objects.filter(pk=qr_card.pk, status=old_status).update(status=new_status, **fields):
+            qr_card.status = new_status
+            for field, value in fields.items():
+                setattr(qr_card, field, value)
+            qr_card._loaded_status = new_status
+            card_status_changed(qr_card.project_id, old_status, new_status)
+            # update() sends no post_save
+            invalidate_client_cards([qr_card.code])
+            return True
+        # Someone else changed the status first
+        qr_card.refresh_from_db(fields=['status', *fields])
+        qr_card._loaded_status = qr_card.status
+    return False
+
+
+def photos_added(qr_card_id, count=1):
+    increment(QRCard.objects.filter(pk=qr_card_id), photo_total=count)
+    increment(Project.objects.filter(qrcards=qr_card_id), photo_total=count)
+
+
+def photos_removed(qr_card_id, count=1):
+    photos_added(qr_card_id, -count)
@@ -0,0 +1,194 @@
+"""
+Pluggable QR decoder engines.
+
+Every engine takes a grayscale image (numpy array) and returns the list of
+payloads it could decode. `decode_qr_payloads` runs the configured engines in
+order and stops at the first one that finds something, so cheap engines should
+come first and slow, robust ones only run on misses.
+
+The order is resolved from (first match wins):
+- settings.QR_DECODER_ENGINES, a list of engine names
+- the JSON file written by `manage.py benchmark_qr_decoders --save`
+  (settings.QR_DECODER_ORDER_FILE)
+- DEFAULT_ENGINE_ORDER
+"""
+import json
+import logging
+import os
+from functools import lru_cache
+
+import cv2
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENGINE_ORDER = ['pyzbar', 'opencv', 'opencv_multi']
+
+
+class DecoderEngine:
+    """Base class for QR decoder engines"""
+    name = None
+
+    def is_available(self):
+        """Returns True if the engine's dependencies are installed"""
+        return True
+
+    def decode(self, gray):
+        """Returns a list of decoded payload strings for a grayscale image"""
+        raise NotImplementedError
+
+
+class PyzbarEngine(DecoderEngine):
+    """zbar via pyzbar - fast, but needs the zbar shared library"""
+    name = 'pyzbar'
+
+    def is_available(self):
+        try:
+            from pyzbar import pyzbar  # noqa: F401
+            return True
+        except Exception as import_err:
+            logger.warning(f"pyzbar unavailable (likely missing zbar): {import_err}")
+            return False
+
+    def decode(self, gray):
+        from pyzbar import pyzbar
+        qr_codes = pyzbar.decode(gray, symbols=[pyzbar.ZBarSymbol.QRCODE])
+        return [qr.data.decode('utf-8') for qr in qr_codes if qr.data]
+
+
+class OpenCVEngine(DecoderEngine):
+    """OpenCV QRCodeDetector, single code per image"""
+    name = 'opencv'
+
+    def __init__(self):
+        self.detector = cv2.QRCodeDetector()
+
+    def decode(self, gray):
+        data, points, _ = self.detector.detectAndDecode(gray)
+        if points is not None and data:
+            return [data]
+        return []
+
+
+class OpenCVMultiEngine(DecoderEngine):
+    """OpenCV QRCodeDetector.detectAndDecodeMulti, finds several codes per image"""
+    name = 'opencv_multi'
+
+    def __init__(self):
+        self.detector = cv2.QRCodeDetector()
+
+    def decode(self, gray):
+        found, decoded, points, _ = self.detector.detectAndDecodeMulti(gray)
+        if not found:
+            return []
+        return [data for data in decoded if data]
+
+
+class WeChatEngine(DecoderEngine):
+    """OpenCV WeChat detector (opencv-contrib) - slowest, most robust on small or blurry codes"""
+    name = 'wechat'
+
+    def __init__(self):
+        self._detector = None
+
+    def is_available(self):
+        return hasattr(cv2, 'wechat_qrcode_WeChatQRCode')
+
+    @property
+    def detector(self):
+        if self._detector is None:
+            # Without the CNN model files the detector still works using the
+            # traditional localisation, just with lower recall.
+            model_dir = getattr(settings, 'QR_WECHAT_MODEL_DIR', None)
+            if model_dir:
+                self._detector = cv2.wechat_qrcode_WeChatQRCode(
+                    os.path.join(model_dir, 'detect.prototxt'),
+                    os.path.join(model_dir, 'detect.caffemodel'),
+                    os.path.join(model_dir, 'sr.prototxt'),
+                    os.path.join(model_dir, 'sr.caffemodel'),
+                )
+            else:
+                self._detector = cv2.wechat_qrcode_WeChatQRCode()
+        return self._detector
+
+    def decode(self, gray):
+        decoded, _ = self.detector.detectAndDecode(gray)
+        return [data for data in decoded if data]
+
+
+ENGINES = {
+    engine.name: engine
+    for engine in (PyzbarEngine, OpenCVEngine, OpenCVMultiEngine, WeChatEngine)
+}
+
+
+def get_order_file_path():
+    """Returns the path of the JSON file holding the benchmarked engine order"""
+    return getattr(
+        settings, 'QR_DECODER_ORDER_FILE',
+        os.path.join(settings.BASE_DIR, 'qr_decoder_order.json')
+    )
+
+
+def load_saved_engine_order():
+    """Returns the engine order saved by the benchmark command, or None"""
+    path = get_order_file_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f).get('order') or None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read QR decoder order from {path}: {e}")
+        return None
+
+
+def save_engine_order(order, results=None):
+    """Persist an engine order (and the benchmark results behind it)"""
+    path = get_order_file_path()
+    with open(path, 'w') as f:
+        json.dump({'order': list(order), 'results': results or {}}, f, indent=2)
+    get_engines.cache_clear()
+    return path
+
+
+def build_engines(names):
+    """Instantiate the named engines, skipping unknown or unavailable ones"""
+    engines = []
+    for name in names:
+        engine_class = ENGINES.get(name)
+        if engine_class is None:
+            logger.warning(f"Unknown QR decoder engine: {name}")
+            continue
+        engine = engine_class()
+        if engine.is_available():
+            engines.append(engine)
+    return engines
+
+
+@lru_cache(maxsize=1)
+def get_engines():
+    """Returns the configured engines in the order they should be tried"""
+    order = (
+        getattr(settings, 'QR_DECODER_ENGINES', None)
+        or load_saved_engine_order()
+        or DEFAULT_ENGINE_ORDER
+    )
+    engines = build_engines(order)
+    if not engines:
+        # OpenCV is a hard dependency, so this always leaves something to try
+        engines = build_engines(['opencv'])
+    return engines
+
+
+def decode_qr_payloads(gray, engines=None):
+    """Run engines in order and return the payloads from the first one that finds any"""
+    for engine in engines if engines is not None else get_engines():
+        try:
+            payloads = engine.decode(gray)
+        except Exception as e:
+            logger.error(f"QR decoder engine {engine.name} failed: {str(e)}")
+            continue
+        if payloads:
+            return payloads
+    return []
@@ -0,0 +1,76 @@
+"""
+Thumbnail and web-preview derivatives for QRCardPhoto.
+
+Originals are 8-15MB camera JPEGs; the client gallery only needs a small
+thumbnail and a ~2048px preview. Both are EXIF-oriented, stripped of metadata
+and stored next to the original as `<name>_thumb.<ext>` / `<name>_preview.<ext>`.
+WebP is used when Pillow supports it, JPEG otherwise.
+"""
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+from .photo_cache import open_photo_file
+
+THUMBNAIL_SIZE = 400
+PREVIEW_SIZE = 2048
+QUALITY = {'WEBP': 80, 'JPEG': 85}
+
+
+def derivative_format():
+    return 'WEBP' if features.check('webp') else 'JPEG'
+
+
+def derivative_name(original_name, suffix, image_format):
+    """Storage name for a derivative, in the same directory as the original"""
+    stem, _ = os.path.splitext(original_name)
+    ext = 'webp' if image_format == 'WEBP' else 'jpg'
+    return f"{stem}_{suffix}.{ext}"
+
+
+def encode(image, image_format):
+    options = {'quality': QUALITY[image_format]}
+    if image_format == 'JPEG':
+        options.update(optimize=True, progressive=True)
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def render_derivatives(source_file):
+    """Returns (preview, thumbnail) Pillow images for an open original"""
+    image = Image.open(source_file)
+    # Let libjpeg downscale while decoding; far cheaper than resizing a full 24MP frame
+    image.draft('RGB', (PREVIEW_SIZE, PREVIEW_SIZE))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    preview = image.copy()
+    preview.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE), Image.LANCZOS)
+    thumbnail = preview.copy()
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    return preview, thumbnail
+
+
+def generate_derivatives(photo):
+    """Create and store the preview and thumbnail for a QRCardPhoto, then mark it processed"""
+    image_format = derivative_format()
+    storage = photo.image.storage
+
+    with open_photo_file(photo.image) as source_file:
+        preview, thumbnail = render_derivatives(source_file)
+
+    photo.preview.name = storage.save(
+        derivative_name(photo.image.name, 'preview', image_format),
+        ContentFile(encode(preview, image_format))
+    )
+    photo.thumbnail.name = storage.save(
+        derivative_name(photo.image.name, 'thumb', image_format),
+        ContentFile(encode(thumbnail, image_format))
+    )
+    photo.is_processed = True
+    photo.save(update_fields=['preview', 'thumbnail', 'is_processed'])
+    return photo
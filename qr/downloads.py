@@ -0,0 +1,91 @@
+"""
+Streaming ZIP archives of photo originals.
+
+Photos are already compressed, so entries are STORED and the archive is built
+on the fly: each object is read from storage chunk by chunk and written
+straight into the response. Nothing touches a temp file and memory stays at
+roughly one chunk however many photos a card has. Sizes and CRCs go into data
+descriptors after each entry, which every mainstream unzip tool understands.
+"""
+import io
+import os
+import zipfile
+
+from django.utils import timezone
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class StreamSink(io.RawIOBase):
+    """Write-only, unseekable buffer that zipfile writes into and we drain"""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def iter_storage_chunks(name, storage, chunk_size=CHUNK_SIZE):
+    """Yield an object's bytes from storage without buffering the whole file"""
+    bucket = getattr(storage, 'bucket', None)
+    if bucket is not None:
+        # S3Boto3Storage's File spools the whole object to a temp file on first
+        # read, so stream the GetObject body directly instead.
+        key = storage._normalize_name(name) if hasattr(storage, '_normalize_name') else name
+        body = bucket.Object(key).get()['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+        return
+
+    with storage.open(name, 'rb') as f:
+        yield from f.chunks(chunk_size)
+
+
+def unique_arcname(filename, used):
+    """Keep archive names unique when several photos share a filename"""
+    arcname = os.path.basename(filename) or 'photo'
+    stem, ext = os.path.splitext(arcname)
+    counter = 1
+    while arcname in used:
+        counter += 1
+        arcname = f"{stem} ({counter}){ext}"
+    used.add(arcname)
+    return arcname
+
+
+def stream_photos_zip(photos, chunk_size=CHUNK_SIZE):
+    """Yield a STORED zip archive of the given QRCardPhotos' originals"""
+    sink = StreamSink()
+    used_names = set()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for photo in photos:
+            taken = timezone.localtime(photo.taken_at or photo.uploaded_at)
+            zinfo = zipfile.ZipInfo(
+                unique_arcname(photo.original_filename, used_names),
+                date_time=taken.timetuple()[:6]
+            )
+            zinfo.compress_type = zipfile.ZIP_STORED
+            zinfo.file_size = photo.file_size
+
+            # Zip64 headers are needed up front for entries that may pass 4GB
+            with archive.open(zinfo, mode='w', force_zip64=photo.file_size > zipfile.ZIP64_LIMIT // 2) as entry:
+                for chunk in iter_storage_chunks(photo.image.name, photo.image.storage, chunk_size):
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
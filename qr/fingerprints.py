@@ -0,0 +1,156 @@
+"""
+Content and perceptual fingerprints for raw photo deduplication.
+
+Photographers often re-upload overlapping card dumps. Each raw photo gets a
+SHA-256 of its bytes (exact duplicates) and a 64-bit difference hash of its
+pixels (near duplicates: re-encodes, resizes, burst shots). Fingerprints are
+indexed per project in PhotoFingerprint, so an exact duplicate is neither
+stored nor decoded again: it keeps its row (and place in the shooting
+sequence) but points at the original's file and reuses its decode result.
+Near duplicates are flagged.
+
+Near-duplicate lookups split the hash into four 16-bit bands: two hashes within
+NEAR_DUPLICATE_DISTANCE (<= 3) bits of each other must share at least one band
+exactly, so only photos in a shared band need a full Hamming comparison.
+"""
+import hashlib
+
+from django.db import IntegrityError
+from PIL import Image, ImageOps
+
+from .models import PhotoFingerprint
+
+NEAR_DUPLICATE_DISTANCE = 3
+BANDS = 4
+BAND_BITS = 64 // BANDS
+
+
+def content_hash(file_obj):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(1024 * 1024), b''):
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def perceptual_hash(file_obj):
+    """64-bit difference hash (dHash) as 16 hex characters"""
+    file_obj.seek(0)
+    image = Image.open(file_obj)
+    # Decode at a fraction of full resolution; dHash only needs a 9x8 thumbnail
+    image.draft('L', (64, 64))
+    image = ImageOps.exif_transpose(image).convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = image.tobytes()
+    file_obj.seek(0)
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def bands(phash):
+    value = int(phash, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(band, (value >> (band * BAND_BITS)) & mask) for band in range(BANDS)]
+
+
+class NearDuplicateIndex:
+    """In-memory banded index of a project's perceptual hashes"""
+
+    def __init__(self, fingerprints=()):
+        self._bands = {}
+        for raw_photo_id, phash in fingerprints:
+            self.add(raw_photo_id, phash)
+
+    @classmethod
+    def for_project(cls, project):
+        return cls(
+            PhotoFingerprint.objects.filter(project=project)
+            .exclude(perceptual_hash='')
+            .values_list('raw_photo_id', 'perceptual_hash')
+            .iterator(chunk_size=5000)
+        )
+
+    def add(self, raw_photo_id, phash):
+        for key in bands(phash):
+            self._bands.setdefault(key, []).append((raw_photo_id, phash))
+
+    def find(self, phash, exclude_id=None, max_distance=NEAR_DUPLICATE_DISTANCE):
+        """Returns the id of the closest indexed photo within max_distance, or None"""
+        best = None
+        for key in bands(phash):
+            for raw_photo_id, other in self._bands.get(key, ()):
+                if raw_photo_id == exclude_id:
+                    continue
+                distance = hamming_distance(phash, other)
+                if distance <= max_distance and (best is None or distance < best[0]):
+                    best = (distance, raw_photo_id)
+        return best[1] if best else None
+
+
+def find_exact_duplicate(project, sha256):
+    """Returns the id of a raw photo in the project with this content hash, or None"""
+    return PhotoFingerprint.objects.filter(
+        project=project, content_hash=sha256
+    ).values_list('raw_photo_id', flat=True).first()
+
+
+def find_exact_duplicates(project, hashes):
+    """Maps each content hash the project already has to its raw photo id, in one query"""
+    return dict(PhotoFingerprint.objects.filter(
+        project=project, content_hash__in=set(hashes)
+    ).values_list('content_hash', 'raw_photo_id'))
+
+
+def register_fingerprint(raw_photo, project, sha256, phash, near_index=None):
+    """
+    Record a raw photo's fingerprint and flag it if it duplicates an earlier one.
+    Sets content_hash/perceptual_hash/duplicate_of/near_duplicate_of on the
+    instance (the caller saves it) and returns True for exact duplicates.
+    """
+    raw_photo.content_hash = sha256
+    raw_photo.perceptual_hash = phash
+
+    try:
+        fingerprint, created = PhotoFingerprint.objects.get_or_create(
+            project=project,
+            content_hash=sha256,
+            defaults={'raw_photo': raw_photo, 'perceptual_hash': phash}
+        )
+    except IntegrityError:
+        # This raw photo already owns a fingerprint (re-analysis)
+        fingerprint = PhotoFingerprint.objects.get(raw_photo=raw_photo)
+        created = False
+
+    if not created and fingerprint.raw_photo_id != raw_photo.id:
+        raw_photo.duplicate_of_id = fingerprint.raw_photo_id
+        return True
+
+    if phash and fingerprint.perceptual_hash != phash:
+        # Registered before the perceptual hash was known (streamed uploads)
+        PhotoFingerprint.objects.filter(pk=fingerprint.pk).update(perceptual_hash=phash)
+
+    if near_index is not None and phash:
+        raw_photo.near_duplicate_of_id = near_index.find(phash, exclude_id=raw_photo.id)
+        near_index.add(raw_photo.id, phash)
+    return False
+
+
+def fingerprint_file(file_obj):
+    """Returns (sha256, phash) for an open image file; phash is '' if it can't be decoded"""
+    sha256 = content_hash(file_obj)
+    try:
+        phash = perceptual_hash(file_obj)
+    except Exception:
+        phash = ''
+    return sha256, phash
@@ -0,0 +1,105 @@
+"""
+Scan-to-delivery funnel per project per day.
+
+A card enters a funnel stage on the day its timestamp is set: scanned_at,
+info_provided_at, photos_uploaded_at and completed_at. Counting that live
+means grouping every card of a project, so ProjectFunnelDaily keeps one
+precomputed row per project and day instead. The funnel endpoint reads at
+most one row per requested day, however many cards the project has.
+
+refresh_funnels() recomputes the rollups for recent days with one grouped
+query per stage. The queries use the stage timestamp indexes, so their cost
+follows recent activity rather than table size. Stage timestamps are always
+set to the current time, so older days only change when cards are deleted.
+The qr.tasks.refresh_project_funnels beat task runs it every
+FUNNEL_REFRESH_INTERVAL seconds. Its first run, with no rollups yet, builds
+every day. Deletions lower the counts of days the recent refresh no longer
+visits, so a second beat entry rebuilds every day nightly (03:00).
+
+Settings (optional):
+- FUNNEL_REFRESH_INTERVAL (default 900 seconds) - beat schedule, see settings
+- FUNNEL_LOOKBACK_DAYS (default 2) - days recomputed by each refresh
+- FUNNEL_MAX_DAYS (default 366) - longest range the endpoint serves
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ProjectFunnelDaily, QRCard
+
+STAGES = ('scanned', 'info_provided', 'photos_uploaded', 'completed')
+
+
+def refresh_funnels(since=None):
+    """
+    Recompute the rollups for days from `since` (a date) on, or for every
+    day if it is None; returns the number of rows written
+    """
+    start = timezone.make_aware(datetime.combine(since, time.min)) if since else None
+    counts = defaultdict(Counter)
+    for stage in STAGES:
+        field = f'{stage}_at'
+        cards = QRCard.objects.filter(**{f'{field}__isnull': False})
+        if start:
+            cards = cards.filter(**{f'{field}__gte': start})
+        rows = cards.order_by().values('project_id', day=TruncDate(field)).annotate(cards=Count('id'))
+        for row in rows:
+            counts[row['project_id'], row['day']][stage] = row['cards']
+
+    refreshed_at = timezone.now()
+    rollups = [
+        ProjectFunnelDaily(project_id=project_id, day=day, **{stage: stages[stage] for stage in STAGES})
+        for (project_id, day), stages in counts.items()
+    ]
+    with transaction.atomic():
+        ProjectFunnelDaily.objects.bulk_create(
+            rollups, batch_size=1000, update_conflicts=True,
+            unique_fields=['project', 'day'], update_fields=[*STAGES, 'updated_at'],
+        )
+        # Days in the window whose cards all went away
+        stale = ProjectFunnelDaily.objects.filter(updated_at__lt=refreshed_at)
+        if since:
+            stale = stale.filter(day__gte=since)
+        stale.delete()
+    return len(rollups)
+
+
+def refresh_recent_funnels():
+    if not ProjectFunnelDaily.objects.exists():
+        return refresh_funnels()
+    lookback = getattr(settings, 'FUNNEL_LOOKBACK_DAYS', 2)
+    return refresh_funnels(timezone.localdate() - timedelta(days=lookback - 1))
+
+
+def project_funnel(project, first_day, last_day):
+    """Daily and total stage counts of a project between two dates, read from the rollups only"""
+    rollups = {
+        rollup.day: rollup
+        for rollup in ProjectFunnelDaily.objects.filter(project=project, day__range=(first_day, last_day))
+    }
+
+    days = []
+    totals = Counter()
+    day = first_day
+    while day <= last_day:
+        rollup = rollups.get(day)
+        stages = {stage: getattr(rollup, stage) if rollup else 0 for stage in STAGES}
+        totals.update(stages)
+        days.append({'day': day, **stages})
+        day += timedelta(days=1)
+
+    return {
+        'project': project.id,
+        'from': first_day,
+        'to': last_day,
+        # All-time top of the funnel, from the project counters (qr.counters)
+        'cards': project.card_total,
+        'totals': {stage: totals[stage] for stage in STAGES},
+        'days': days,
+        'refreshed_at': max((rollup.updated_at for rollup in rollups.values()), default=None),
+    }
@@ -0,0 +1,130 @@
+import os
+import resource
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from projects.models import Project
+from qr import counters
+from qr.corpus import load_manifest
+from qr.models import QRCard, QRCardPhoto, PhotoUploadBatch, RawPhotoUpload
+from qr.tasks import analyze_photo_batch_for_qr_codes
+
+
+class Command(BaseCommand):
+    help = 'Run analyze_photo_batch_for_qr_codes end-to-end on a local corpus and report throughput and accuracy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help='Directory written by generate_qr_corpus')
+        parser.add_argument('--project', type=int, help='Run against an existing project (its cards must match the corpus)')
+        parser.add_argument('--limit', type=int, help='Only use the first N photos of the corpus')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark rows and files afterwards')
+
+    def handle(self, *args, **options):
+        if getattr(settings, 'USE_S3', False):
+            raise CommandError('The analysis benchmark runs against local storage; unset USE_S3.')
+
+        manifest = load_manifest(options['corpus'])
+        if manifest is None:
+            raise CommandError(f"No manifest.json in {options['corpus']}")
+        entries = list(manifest.items())[:options['limit']]
+
+        owner = None
+        if options['project']:
+            try:
+                project = Project.objects.get(id=options['project'])
+            except Project.DoesNotExist:
+                raise CommandError(f"Project {options['project']} not found")
+        else:
+            owner = get_user_model().objects.create(username=f"qr-benchmark-{uuid.uuid4().hex[:8]}")
+            project = Project.objects.create(user=owner, name='QR analysis benchmark')
+            codes = {entry['card_code']: entry['pin'] for _, entry in entries if entry.get('card_code')}
+            cards = QRCard.objects.bulk_create([
+                QRCard(project=project, code=code, access_pin=pin) for code, pin in codes.items()
+            ])
+            counters.cards_added(cards)
+
+        # Photos copied into cards by this run have ids above this one
+        last_photo_id = QRCardPhoto.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        batch = PhotoUploadBatch.objects.create(project=project, name='QR analysis benchmark')
+        self.stdout.write(f'Uploading {len(entries)} photos to local storage...')
+        taken_at = timezone.now() - timedelta(days=1)
+        for index, (filename, _) in enumerate(entries):
+            with open(os.path.join(options['corpus'], filename), 'rb') as f:
+                data = f.read()
+            raw_photo = RawPhotoUpload(
+                batch=batch,
+                original_filename=filename,
+                file_size=len(data),
+                taken_at=taken_at + timedelta(seconds=index),
+            )
+            raw_photo.image.save(filename, ContentFile(data), save=True)
+
+        try:
+            self.stdout.write('Analyzing...')
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = analyze_photo_batch_for_qr_codes(batch.id)
+            elapsed = time.perf_counter() - start
+            _, peak_traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            if not result.get('success'):
+                raise CommandError(f"Analysis failed: {result.get('error')}")
+
+            self.report(batch, manifest, elapsed, peak_traced)
+        finally:
+            if not options['keep']:
+                self.cleanup(batch, owner, last_photo_id)
+
+    def report(self, batch, manifest, elapsed, peak_traced):
+        expected_codes = 0
+        detected = 0
+        mis_assigned = 0
+        unassigned = 0
+        raw_photos = batch.raw_photos.select_related('assigned_qr_card')
+        for raw_photo in raw_photos:
+            entry = manifest[raw_photo.original_filename]
+            if entry.get('payload'):
+                expected_codes += 1
+                if raw_photo.qr_code_data == entry['payload']:
+                    detected += 1
+
+            assigned_code = raw_photo.assigned_qr_card.code if raw_photo.assigned_qr_card else None
+            if assigned_code is None:
+                unassigned += 1
+            elif assigned_code != entry.get('card_code'):
+                mis_assigned += 1
+
+        total = len(raw_photos)
+        # ru_maxrss is KiB on Linux
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        self.stdout.write(self.style.SUCCESS(f'Photos analyzed:    {total} in {elapsed:.2f}s'))
+        self.stdout.write(f'Throughput:         {total / elapsed:.2f} photos/sec')
+        self.stdout.write(f'QR recall:          {detected}/{expected_codes} ({detected / max(expected_codes, 1):.1%})')
+        self.stdout.write(f'Mis-assignments:    {mis_assigned}')
+        self.stdout.write(f'Unassigned photos:  {unassigned}')
+        self.stdout.write(f'Peak traced memory: {peak_traced / (1024 * 1024):.1f} MB')
+        self.stdout.write(f'Peak RSS:           {peak_rss_mb:.1f} MB')
+
+    def cleanup(self, batch, owner, last_photo_id):
+        """Remove the benchmark's files as well as its rows"""
+        for raw_photo in batch.raw_photos.all():
+            raw_photo.image.delete(save=False)
+        photos = QRCardPhoto.objects.filter(qr_card__project=batch.project, id__gt=last_photo_id)
+        for photo in photos:
+            for field in (photo.image, photo.thumbnail, photo.preview):
+                if field:
+                    field.delete(save=False)
+        photos.delete()
+        batch.delete()
+        if owner is not None:
+            owner.delete()
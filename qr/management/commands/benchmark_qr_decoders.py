@@ -0,0 +1,113 @@
+import os
+import time
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from qr.corpus import load_manifest
+from qr.decoders import ENGINES, build_engines, save_engine_order
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark QR decoder engines on a local image corpus and pick the order they are tried in'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help='Directory of test photos (optionally with a manifest.json of expected payloads)')
+        parser.add_argument('--engines', nargs='+', default=list(ENGINES), help='Engines to benchmark')
+        parser.add_argument('--repeat', type=int, default=1, help='Decode each image this many times per engine')
+        parser.add_argument('--save', action='store_true', help='Save the chosen order to QR_DECODER_ORDER_FILE')
+
+    def handle(self, *args, **options):
+        corpus_dir = options['corpus']
+        if not os.path.isdir(corpus_dir):
+            raise CommandError(f'Corpus directory not found: {corpus_dir}')
+
+        engines = build_engines(options['engines'])
+        if not engines:
+            raise CommandError('None of the requested engines are available')
+
+        manifest = load_manifest(corpus_dir)
+        expected = {name: entry['payload'] for name, entry in manifest.items()} if manifest is not None else None
+        filenames = sorted(
+            name for name in os.listdir(corpus_dir)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not filenames:
+            raise CommandError(f'No images found in {corpus_dir}')
+
+        # Decode the JPEGs once up front so only the QR decoding is timed
+        images = {}
+        for filename in filenames:
+            with open(os.path.join(corpus_dir, filename), 'rb') as f:
+                image = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_GRAYSCALE)
+            if image is not None:
+                images[filename] = image
+
+        # Without a manifest every image is assumed to contain a code
+        targets = {
+            name for name in images
+            if expected is None or expected.get(name)
+        }
+        self.stdout.write(f'Benchmarking {len(engines)} engines on {len(images)} images ({len(targets)} with QR codes)')
+
+        results = {}
+        hits_by_engine = {}
+        for engine in engines:
+            hits = set()
+            false_positives = 0
+            elapsed = 0.0
+            for filename, gray in images.items():
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    try:
+                        payloads = engine.decode(gray)
+                    except Exception:
+                        payloads = []
+                    elapsed += time.perf_counter() - start
+
+                want = expected.get(filename) if expected is not None else None
+                if expected is None:
+                    if payloads:
+                        hits.add(filename)
+                elif want and want in payloads:
+                    hits.add(filename)
+                elif payloads:
+                    false_positives += 1
+
+            ms_per_image = elapsed * 1000 / (len(images) * options['repeat'])
+            recall = len(hits) / len(targets) if targets else 0.0
+            hits_by_engine[engine.name] = hits
+            results[engine.name] = {
+                'ms_per_image': round(ms_per_image, 2),
+                'recall': round(recall, 4),
+                'false_positives': false_positives,
+            }
+            self.stdout.write(
+                f'  {engine.name:<14} {ms_per_image:8.2f} ms/img  recall {recall:6.1%}  false positives {false_positives}'
+            )
+
+        order = self.choose_order(results, hits_by_engine)
+        cascade_recall = len(set().union(*(hits_by_engine[name] for name in order))) / len(targets) if targets else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'Chosen order: {", ".join(order)} (combined recall {cascade_recall:.1%})'
+        ))
+
+        if options['save']:
+            path = save_engine_order(order, results)
+            self.stdout.write(self.style.SUCCESS(f'Saved decoder order to {path}'))
+
+    def choose_order(self, results, hits_by_engine):
+        """Fastest first; later engines are only kept if they recover images the earlier ones missed"""
+        by_speed = sorted(results, key=lambda name: results[name]['ms_per_image'])
+        order = []
+        covered = set()
+        for name in by_speed:
+            new_hits = hits_by_engine[name] - covered
+            if new_hits:
+                order.append(name)
+                covered |= new_hits
+        # Never leave the worker without a decoder
+        return order or by_speed[:1]
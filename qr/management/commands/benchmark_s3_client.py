@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from qr.s3 import build_s3_client, get_s3_client, reset_s3_client
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark S3 request latency with a fresh client per request vs the shared pooled client'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--head', metavar='KEY', help='Also time a HEAD request for this object key (needs network access)')
+
+    def handle(self, *args, **options):
+        bucket = getattr(settings, 'AWS_STORAGE_BUCKET_NAME', None) or 'benchmark-bucket'
+        key = options['head']
+
+        def request(client):
+            client.generate_presigned_url(
+                'put_object',
+                Params={'Bucket': bucket, 'Key': 'benchmark/photo.jpg', 'ContentType': 'image/jpeg'},
+                ExpiresIn=3600
+            )
+            if key:
+                try:
+                    client.head_object(Bucket=bucket, Key=key)
+                except ClientError:
+                    pass
+
+        # Before: what generate_upload_urls/confirm_uploads used to do per request
+        fresh = self.measure(lambda: request(build_s3_client()), options['iterations'])
+
+        # After: warm the shared client once, as the first request in a process would
+        reset_s3_client()
+        request(get_s3_client())
+        pooled = self.measure(lambda: request(get_s3_client()), options['iterations'])
+
+        self.report('Fresh client per request', fresh)
+        self.report('Shared pooled client', pooled)
+        speedup = statistics.mean(fresh) / statistics.mean(pooled) if statistics.mean(pooled) else 0
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {speedup:.1f}x'))
+
+    def measure(self, func, iterations):
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def report(self, label, timings):
+        ordered = sorted(timings)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        self.stdout.write(
+            f'{label:<26} mean {statistics.mean(timings):7.2f} ms  '
+            f'p50 {statistics.median(timings):7.2f} ms  p95 {p95:7.2f} ms'
+        )
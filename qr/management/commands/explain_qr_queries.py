@@ -0,0 +1,158 @@
+import random
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from projects.models import Project
+from qr.models import PhotoUploadBatch, QRCard, QRCardPhoto, RawPhotoUpload
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Seed a large dataset, EXPLAIN the hot qr queries and check that each plan uses its index (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=20)
+        parser.add_argument('--cards', type=int, default=20000, help='QR cards across all projects')
+        parser.add_argument('--batches', type=int, default=100, help='Photo batches across all projects')
+        parser.add_argument('--photos', type=int, default=100000, help='Raw photos across all batches')
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        if options['analyze'] and connection.vendor != 'postgresql':
+            raise CommandError('--analyze needs PostgreSQL')
+
+        missing = []
+        try:
+            with transaction.atomic():
+                project, batch, card = self.seed(options)
+                self.update_statistics()
+                for label, queryset, index in self.queries(project, batch, card):
+                    plan = queryset.explain(analyze=True) if options['analyze'] else queryset.explain()
+                    used = index in plan
+                    style = self.style.SUCCESS if used else self.style.WARNING
+                    self.stdout.write(style(f"{label}: {'uses' if used else 'does NOT use'} {index}"))
+                    self.stdout.write(f'  {plan}'.replace('\n', '\n  '))
+                    if not used:
+                        missing.append(label)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        if missing:
+            self.stdout.write(self.style.WARNING(f"{len(missing)} queries not using their index: {', '.join(missing)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('All queries use their indexes'))
+
+    def seed(self, options):
+        self.stdout.write(
+            f"Seeding {options['projects']} projects, {options['cards']} cards, "
+            f"{options['batches']} batches and {options['photos']} photos..."
+        )
+        rng = random.Random(0)
+        owner = get_user_model().objects.create(username=f'qr-explain-{uuid.uuid4().hex[:8]}')
+        projects = Project.objects.bulk_create(
+            Project(user=owner, name=f'Explain {i}') for i in range(options['projects'])
+        )
+        statuses = [value for value, _ in QRCard.STATUS_CHOICES]
+        cards = QRCard.objects.bulk_create(
+            (
+                QRCard(project=projects[i % len(projects)], code=str(uuid.uuid4()), access_pin='1234', status=rng.choice(statuses))
+                for i in range(options['cards'])
+            ),
+            batch_size=1000
+        )
+        batches = PhotoUploadBatch.objects.bulk_create(
+            PhotoUploadBatch(project=projects[i % len(projects)], status='completed') for i in range(options['batches'])
+        )
+
+        start = timezone.now() - timedelta(days=30)
+        RawPhotoUpload.objects.bulk_create(
+            (
+                RawPhotoUpload(
+                    batch=batches[i % len(batches)],
+                    image=f'raw_photos/explain/{i}.jpg',
+                    original_filename=f'IMG_{i:06d}.jpg',
+                    file_size=8 * 1024 * 1024,
+                    taken_at=start + timedelta(seconds=i) if rng.random() > 0.05 else None,
+                    decoded_at=timezone.now(),
+                    # Most of a large dataset has already been analysed
+                    is_processed=rng.random() > 0.02,
+                    assigned_qr_card=cards[i % len(cards)] if rng.random() > 0.5 else None,
+                )
+                for i in range(options['photos'])
+            ),
+            batch_size=1000
+        )
+        QRCardPhoto.objects.bulk_create(
+            (
+                QRCardPhoto(qr_card=cards[i % len(cards)], image=f'qr_photos/explain/{i}.jpg', original_filename=f'IMG_{i:06d}.jpg', file_size=1)
+                for i in range(options['photos'] // 2)
+            ),
+            batch_size=1000
+        )
+        return projects[0], batches[0], cards[0]
+
+    def update_statistics(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                for model in (QRCard, QRCardPhoto, PhotoUploadBatch, RawPhotoUpload):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+            elif connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+
+    def queries(self, project, batch, card):
+        # .exists() drops the default ordering, hence order_by() on the existence checks
+        shooting_order = (F('taken_at').asc(nulls_last=True), 'uploaded_at', 'id')
+        return [
+            (
+                'QR cards in a project',
+                QRCard.objects.filter(project=project).order_by('-created_at', 'id')[:50],
+                'qrcard_project_page',
+            ),
+            (
+                'QR cards in a project by status',
+                QRCard.objects.filter(project=project, status='scanned').order_by('-created_at', 'id')[:50],
+                'qrcard_project_status_page',
+            ),
+            (
+                'Photo batches in a project',
+                PhotoUploadBatch.objects.filter(project=project).order_by('-created_at', 'id')[:50],
+                'photobatch_project_page',
+            ),
+            (
+                'Batch photos in shooting order',
+                RawPhotoUpload.objects.filter(batch=batch).order_by(*shooting_order)[:100],
+                'rawphoto_batch_page',
+            ),
+            (
+                'Unprocessed batch photos',
+                RawPhotoUpload.objects.filter(batch=batch, is_processed=False).order_by(*shooting_order)[:100],
+                'rawphoto_batch_unprocessed',
+            ),
+            (
+                'Pending uploads (start_analysis_when_uploaded)',
+                RawPhotoUpload.objects.filter(batch=batch, processing_error__isnull=True)
+                .filter(Q(image='') | Q(decoded_at__isnull=True)).order_by()[:1],
+                'rawphoto_batch_pending',
+            ),
+            (
+                'Cards that received batch photos (update_qr_card_statuses)',
+                RawPhotoUpload.objects.filter(batch=batch, assigned_qr_card__isnull=False)
+                .order_by().values('assigned_qr_card').distinct(),
+                'rawphoto_batch_assigned',
+            ),
+            (
+                'Photo already copied to card (create_qr_card_photo_from_raw)',
+                QRCardPhoto.objects.filter(qr_card=card, original_filename='IMG_000000.jpg').order_by()[:1],
+                'qrcardphoto_card_filename',
+            ),
+        ]
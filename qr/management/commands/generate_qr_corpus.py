@@ -0,0 +1,43 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from qr.corpus import generate_corpus, parse_qr_url, random_payloads
+from qr.models import QRCard
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic photo corpus for QR detection benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory to write the photos and manifest.json to')
+        parser.add_argument('--cards', type=int, default=50, help='Number of card sessions')
+        parser.add_argument('--photos-per-card', type=int, default=3, help='Photos without a code after each card photo')
+        parser.add_argument('--width', type=int, default=2400)
+        parser.add_argument('--height', type=int, default=1600)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--project', type=int, help='Use the QR payloads of this project\'s cards instead of random ones')
+
+    def handle(self, *args, **options):
+        if options['project']:
+            qr_urls = list(
+                QRCard.objects.filter(project_id=options['project'], qr_url__isnull=False)
+                .order_by('created_at')
+                .values_list('qr_url', flat=True)[:options['cards']]
+            )
+            if not qr_urls:
+                raise CommandError(f"Project {options['project']} has no QR cards")
+            payloads = [parse_qr_url(qr_url) for qr_url in qr_urls]
+        else:
+            payloads = random_payloads(options['cards'], random.Random(options['seed']))
+
+        manifest = generate_corpus(
+            options['output'],
+            payloads,
+            photos_per_card=options['photos_per_card'],
+            size=(options['width'], options['height']),
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(manifest)} photos for {len(payloads)} cards to {options['output']}"
+        ))
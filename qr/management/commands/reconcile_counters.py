@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from projects.models import Project
+from qr.counters import status_field
+from qr.models import PhotoUploadBatch, QRCard, QRCardBatch, QRCardPhoto, RawPhotoUpload, related_count
+
+
+class Command(BaseCommand):
+    help = 'Recount the denormalized counters (qr.counters) and repair any that drifted, one UPDATE per column'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted rows without repairing them')
+
+    def handle(self, *args, **options):
+        repaired = 0
+        for label, queryset, field, actual in self.counters():
+            drifted = queryset.exclude(**{field: actual})
+            updates = {field: actual}
+            if any(f.name == 'updated_at' for f in queryset.model._meta.fields):
+                # update() skips auto_now; polled ETags are derived from it
+                updates['updated_at'] = timezone.now()
+            count = drifted.count() if options['dry_run'] else drifted.update(**updates)
+            repaired += count
+            style = self.style.WARNING if count else self.style.SUCCESS
+            self.stdout.write(style(f'{label}.{field}: {count} drifted'))
+
+        verb = 'found' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'{repaired} counters {verb}'))
+
+    def counters(self):
+        """(label, rows, column, correct value) for every maintained counter"""
+        projects = Project.objects.all()
+        counters = [
+            ('QRCard', QRCard.objects.all(), 'photo_total', related_count(QRCardPhoto, 'qr_card')),
+            ('QRCardBatch', QRCardBatch.objects.all(), 'card_total', related_count(QRCard, 'batch')),
+            ('Project', projects, 'card_total', related_count(QRCard, 'project')),
+            ('Project', projects, 'photo_total', related_count(QRCardPhoto, 'qr_card__project')),
+        ]
+        for status, _ in QRCard.STATUS_CHOICES:
+            counters.append(('Project', projects, status_field(status), related_count(QRCard, 'project', status=status)))
+
+        # Batches still uploading or analyzing are being counted by their own requests and task
+        batches = PhotoUploadBatch.objects.filter(status__in=['completed', 'failed'])
+        processed = Q(is_processed=True) | Q(processing_error__isnull=False)
+        counters += [
+            ('PhotoUploadBatch', batches, 'total_photos', related_count(RawPhotoUpload, 'batch')),
+            ('PhotoUploadBatch', batches, 'processed_photos', related_count(RawPhotoUpload, 'batch', processed)),
+            ('PhotoUploadBatch', batches, 'qr_codes_found', related_count(RawPhotoUpload, 'batch', has_qr_code=True)),
+        ]
+        return counters
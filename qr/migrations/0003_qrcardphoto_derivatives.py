@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0002_rawphotoupload_s3_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qrcardphoto',
+            name='preview',
+            field=models.ImageField(blank=True, help_text='~2048px web preview', null=True, upload_to='qr_photos/%Y/%m/%d/'),
+        ),
+        migrations.AddField(
+            model_name='qrcardphoto',
+            name='thumbnail',
+            field=models.ImageField(blank=True, help_text='Small gallery thumbnail', null=True, upload_to='qr_photos/%Y/%m/%d/'),
+        ),
+    ]
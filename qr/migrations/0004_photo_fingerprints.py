@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_initial'),
+        ('qr', '0003_qrcardphoto_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawphotoupload',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of the file contents', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='rawphotoupload',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, help_text='Earlier upload with identical contents', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='exact_duplicates', to='qr.rawphotoupload'),
+        ),
+        migrations.AddField(
+            model_name='rawphotoupload',
+            name='near_duplicate_of',
+            field=models.ForeignKey(blank=True, help_text='Earlier upload that looks nearly identical', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='qr.rawphotoupload'),
+        ),
+        migrations.AddField(
+            model_name='rawphotoupload',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, help_text='64-bit difference hash of the image', max_length=16, null=True),
+        ),
+        migrations.CreateModel(
+            name='PhotoFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(help_text='SHA-256 of the file contents', max_length=64)),
+                ('perceptual_hash', models.CharField(blank=True, default='', help_text='64-bit difference hash of the image', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_fingerprints', to='projects.project')),
+                ('raw_photo', models.OneToOneField(help_text='First upload with these contents', on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='qr.rawphotoupload')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('project', 'content_hash'), name='unique_project_content_hash')],
+            },
+        ),
+    ]
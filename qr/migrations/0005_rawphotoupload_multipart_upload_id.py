@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0004_photo_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawphotoupload',
+            name='multipart_upload_id',
+            field=models.CharField(blank=True, help_text='S3 multipart upload in progress for large direct uploads', max_length=255, null=True),
+        ),
+    ]
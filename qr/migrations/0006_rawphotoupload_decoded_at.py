@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0005_rawphotoupload_multipart_upload_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawphotoupload',
+            name='decoded_at',
+            field=models.DateTimeField(blank=True, help_text='QR code decoded as soon as the upload arrived', null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_initial'),
+        ('qr', '0006_rawphotoupload_decoded_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photouploadbatch',
+            index=models.Index(fields=['project', '-created_at', 'id'], name='photobatch_project_page'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcard',
+            index=models.Index(fields=['project', '-created_at', 'id'], name='qrcard_project_page'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcard',
+            index=models.Index(fields=['batch', '-created_at', 'id'], name='qrcard_batch_page'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcardbatch',
+            index=models.Index(fields=['project', '-created_at', 'id'], name='qrcardbatch_project_page'),
+        ),
+        migrations.AddIndex(
+            model_name='rawphotoupload',
+            index=models.Index(fields=['batch', 'taken_at', 'uploaded_at', 'id'], name='rawphoto_batch_page'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# qr.search.TEXT_SEARCH_FIELDS at the time of this migration
+TEXT_SEARCH_FIELDS = ('client_email', 'client_name', 'location_name', 'session_notes')
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for field in TEXT_SEARCH_FIELDS:
+        # Same expression Django generates for icontains on PostgreSQL
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS qrcard_{field}_trgm '
+            f'ON qr_qrcard USING gin ((UPPER("{field}"::text)) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in TEXT_SEARCH_FIELDS:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS qrcard_{field}_trgm')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('qr', '0007_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_initial'),
+        ('qr', '0008_qrcard_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='qrcard',
+            index=models.Index(fields=['project', 'status', '-created_at', 'id'], name='qrcard_project_status_page'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcardphoto',
+            index=models.Index(fields=['qr_card', 'original_filename'], name='qrcardphoto_card_filename'),
+        ),
+        migrations.AddIndex(
+            model_name='rawphotoupload',
+            index=models.Index(condition=models.Q(('is_processed', False)), fields=['batch', 'taken_at', 'uploaded_at', 'id'], name='rawphoto_batch_unprocessed'),
+        ),
+        migrations.AddIndex(
+            model_name='rawphotoupload',
+            index=models.Index(condition=models.Q(('processing_error__isnull', True), models.Q(('image', ''), ('decoded_at__isnull', True), _connector='OR')), fields=['batch'], name='rawphoto_batch_pending'),
+        ),
+        migrations.AddIndex(
+            model_name='rawphotoupload',
+            index=models.Index(condition=models.Q(('assigned_qr_card__isnull', False)), fields=['batch', 'assigned_qr_card'], name='rawphoto_batch_assigned'),
+        ),
+    ]
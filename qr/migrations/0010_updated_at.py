@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0009_workload_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photouploadbatch',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Bumped on every change; ETag/Last-Modified for polling'),
+        ),
+        migrations.AddField(
+            model_name='rawphotoupload',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Bumped on every change; ETag/Last-Modified for polling'),
+        ),
+        migrations.AddIndex(
+            model_name='rawphotoupload',
+            index=models.Index(fields=['batch', 'updated_at'], name='rawphoto_batch_updated'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:49
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# QRCard.STATUS_CHOICES at the time of this migration
+CARD_STATUSES = ('distributed', 'scanned', 'info_provided', 'photos_uploaded', 'completed')
+
+
+def related_count(model, field_name, **filters):
+    counts = (
+        model.objects.filter(**{field_name: OuterRef('pk')}, **filters)
+        .order_by().values(field_name).annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def count_existing_rows(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    QRCard = apps.get_model('qr', 'QRCard')
+    QRCardBatch = apps.get_model('qr', 'QRCardBatch')
+    QRCardPhoto = apps.get_model('qr', 'QRCardPhoto')
+
+    QRCard.objects.update(photo_total=related_count(QRCardPhoto, 'qr_card'))
+    QRCardBatch.objects.update(card_total=related_count(QRCard, 'batch'))
+    Project.objects.update(
+        card_total=related_count(QRCard, 'project'),
+        photo_total=related_count(QRCardPhoto, 'qr_card__project'),
+        **{f'cards_{status}': related_count(QRCard, 'project', status=status) for status in CARD_STATUSES}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0010_updated_at'),
+        ('projects', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qrcard',
+            name='photo_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='qrcardbatch',
+            name='card_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
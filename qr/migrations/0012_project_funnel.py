@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_counters'),
+        ('qr', '0011_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectFunnelDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('scanned', models.PositiveIntegerField(default=0)),
+                ('info_provided', models.PositiveIntegerField(default=0)),
+                ('photos_uploaded', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='qrcard',
+            index=models.Index(fields=['scanned_at'], name='qrcard_scanned_at'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcard',
+            index=models.Index(fields=['info_provided_at'], name='qrcard_info_provided_at'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcard',
+            index=models.Index(fields=['photos_uploaded_at'], name='qrcard_photos_uploaded_at'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcard',
+            index=models.Index(fields=['completed_at'], name='qrcard_completed_at'),
+        ),
+        migrations.AddField(
+            model_name='projectfunneldaily',
+            name='project',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='funnel_days', to='projects.project'),
+        ),
+        migrations.AddConstraint(
+            model_name='projectfunneldaily',
+            constraint=models.UniqueConstraint(fields=('project', 'day'), name='unique_project_funnel_day'),
+        ),
+    ]
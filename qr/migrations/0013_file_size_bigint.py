@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0012_project_funnel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='qrcardphoto',
+            name='file_size',
+            field=models.PositiveBigIntegerField(help_text='File size in bytes'),
+        ),
+        migrations.AlterField(
+            model_name='rawphotoupload',
+            name='file_size',
+            field=models.PositiveBigIntegerField(help_text='File size in bytes'),
+        ),
+    ]
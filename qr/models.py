@@ -1,9 +1,24 @@
 from django.db import models
-from projects.models import Project
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from projects.models import CounterFieldsMixin, Project
 
 # Create your models here.
 
-class QRCardBatch(models.Model):
+def related_count(model, field_name, *conditions, **filters):
+    """
+    Annotation counting the `model` rows whose `field_name` points at the outer
+    row, optionally narrowed by Q `conditions` and `filters`. A correlated
+    subquery rather than Count(), so several counts can be annotated without
+    joining the relations into each other.
+    """
+    counts = (
+        model.objects.filter(*conditions, **{field_name: OuterRef('pk')}, **filters)
+        .order_by().values(field_name).annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+class QRCardBatch(CounterFieldsMixin, models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='qrcard_batches')
     name = models.CharField(max_length=255, default="QR Card Batch")
     pdf = models.FileField(upload_to='qrcards/')
@@ -12,10 +27,21 @@ class QRCardBatch(models.Model):
     per_page = models.PositiveIntegerField(default=12)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Maintained by qr.counters
+    card_total = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('card_total',)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order (qr.pagination)
+            models.Index(fields=['project', '-created_at', 'id'], name='qrcardbatch_project_page'),
+        ]
+
     def __str__(self):
         return f"QRCard Batch {self.name} for {self.project.name} ({self.amount} codes)"
 
-class QRCard(models.Model):
+class QRCard(CounterFieldsMixin, models.Model):
     # Basic QR card info
     batch = models.ForeignKey(QRCardBatch, on_delete=models.CASCADE, related_name='qrcards', null=True, blank=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='qrcards')
@@ -52,8 +78,34 @@ class QRCard(models.Model):
     photos_uploaded_at = models.DateTimeField(null=True, blank=True, help_text="When photos were uploaded")
     completed_at = models.DateTimeField(null=True, blank=True, help_text="When photos were delivered to client")
 
+    # Maintained by qr.counters
+    photo_total = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('photo_total',)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order (qr.pagination), per project and per batch
+            models.Index(fields=['project', '-created_at', 'id'], name='qrcard_project_page'),
+            models.Index(fields=['batch', '-created_at', 'id'], name='qrcard_batch_page'),
+            # Card list filtered by status
+            models.Index(fields=['project', 'status', '-created_at', 'id'], name='qrcard_project_status_page'),
+            # Recent stage changes, for the funnel rollups (qr.funnel)
+            models.Index(fields=['scanned_at'], name='qrcard_scanned_at'),
+            models.Index(fields=['info_provided_at'], name='qrcard_info_provided_at'),
+            models.Index(fields=['photos_uploaded_at'], name='qrcard_photos_uploaded_at'),
+            models.Index(fields=['completed_at'], name='qrcard_completed_at'),
+        ]
+
     def __str__(self):
         return f"QRCard {self.code} for {self.project.name} - {self.get_status_display()}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The status as loaded, so saving a transition can move the per-status counters
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
     
     @property
     def short_code(self):
@@ -68,7 +120,7 @@ class QRCard(models.Model):
     @property
     def photo_count(self):
         """Returns the number of photos uploaded for this QR card"""
-        return self.photos.count()
+        return self.photo_total
 
 
 class QRCardPhoto(models.Model):
@@ -77,16 +129,24 @@ class QRCardPhoto(models.Model):
     image = models.ImageField(upload_to='qr_photos/%Y/%m/%d/')
     original_filename = models.CharField(max_length=255, help_text="Original filename when uploaded")
     
+    # Derivatives generated by generate_photo_derivatives, stored next to the original
+    thumbnail = models.ImageField(upload_to='qr_photos/%Y/%m/%d/', blank=True, null=True, help_text="Small gallery thumbnail")
+    preview = models.ImageField(upload_to='qr_photos/%Y/%m/%d/', blank=True, null=True, help_text="~2048px web preview")
+    
     # Photo metadata
     taken_at = models.DateTimeField(null=True, blank=True, help_text="When the photo was taken (if available)")
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    file_size = models.PositiveIntegerField(help_text="File size in bytes")
+    file_size = models.PositiveBigIntegerField(help_text="File size in bytes")
     
     # Processing status
     is_processed = models.BooleanField(default=False, help_text="Whether photo has been processed/optimized")
     
     class Meta:
         ordering = ['uploaded_at']
+        indexes = [
+            # Duplicate check in create_qr_card_photo_from_raw
+            models.Index(fields=['qr_card', 'original_filename'], name='qrcardphoto_card_filename'),
+        ]
     
     def __str__(self):
         return f"Photo for {self.qr_card.short_code} - {self.original_filename}"
@@ -118,6 +178,7 @@ class PhotoUploadBatch(models.Model):
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, help_text="Bumped on every change; ETag/Last-Modified for polling")
     processing_started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
@@ -126,6 +187,9 @@ class PhotoUploadBatch(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['project', '-created_at', 'id'], name='photobatch_project_page'),
+        ]
     
     def __str__(self):
         return f"Photo Batch {self.name} for {self.project.name} ({self.total_photos} photos)"
@@ -144,12 +208,13 @@ class RawPhotoUpload(models.Model):
     image = models.ImageField(upload_to='raw_photos/%Y/%m/%d/')
     original_filename = models.CharField(max_length=255)
     s3_key = models.CharField(max_length=500, blank=True, null=True, help_text="S3 object key for direct uploads")
+    multipart_upload_id = models.CharField(max_length=255, blank=True, null=True, help_text="S3 multipart upload in progress for large direct uploads")
     
     # EXIF data
     taken_at = models.DateTimeField(null=True, blank=True, help_text="Extracted from EXIF data")
     camera_make = models.CharField(max_length=100, blank=True, null=True)
     camera_model = models.CharField(max_length=100, blank=True, null=True)
-    file_size = models.PositiveIntegerField(help_text="File size in bytes")
+    file_size = models.PositiveBigIntegerField(help_text="File size in bytes")
     
     # Processing status
     is_processed = models.BooleanField(default=False)
@@ -157,15 +222,45 @@ class RawPhotoUpload(models.Model):
     qr_code_data = models.TextField(blank=True, null=True, help_text="Decoded QR code content")
     assigned_qr_card = models.ForeignKey(QRCard, on_delete=models.SET_NULL, null=True, blank=True, related_name='raw_source_photos')
     
+    # Deduplication (see qr.fingerprints)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, help_text="SHA-256 of the file contents")
+    perceptual_hash = models.CharField(max_length=16, blank=True, null=True, help_text="64-bit difference hash of the image")
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='exact_duplicates', help_text="Earlier upload with identical contents")
+    near_duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='near_duplicates', help_text="Earlier upload that looks nearly identical")
+    
     # Error handling
     processing_error = models.TextField(blank=True, null=True)
     
     # Timestamps
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    decoded_at = models.DateTimeField(null=True, blank=True, help_text="QR code decoded as soon as the upload arrived")
     processed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, help_text="Bumped on every change; ETag/Last-Modified for polling")
     
     class Meta:
         ordering = ['taken_at', 'uploaded_at']
+        indexes = [
+            # Shooting order within a batch; NULL taken_at sorts last, as in the index
+            models.Index(fields=['batch', 'taken_at', 'uploaded_at', 'id'], name='rawphoto_batch_page'),
+            # Photos still waiting for analysis, in the same order
+            models.Index(
+                fields=['batch', 'taken_at', 'uploaded_at', 'id'], condition=models.Q(is_processed=False),
+                name='rawphoto_batch_unprocessed'
+            ),
+            # start_analysis_when_uploaded: uploads not yet arrived or decoded
+            models.Index(
+                fields=['batch'],
+                condition=models.Q(processing_error__isnull=True) & (models.Q(image='') | models.Q(decoded_at__isnull=True)),
+                name='rawphoto_batch_pending'
+            ),
+            # update_qr_card_statuses: cards that received photos from a batch
+            models.Index(
+                fields=['batch', 'assigned_qr_card'], condition=models.Q(assigned_qr_card__isnull=False),
+                name='rawphoto_batch_assigned'
+            ),
+            # Latest change in a batch, for the photos ETag
+            models.Index(fields=['batch', 'updated_at'], name='rawphoto_batch_updated'),
+        ]
     
     def __str__(self):
         return f"Raw Photo {self.original_filename} in {self.batch.name}"
@@ -174,3 +269,40 @@ class RawPhotoUpload(models.Model):
     def file_size_mb(self):
         """Returns file size in MB"""
         return round(self.file_size / (1024 * 1024), 2)
+
+
+class PhotoFingerprint(models.Model):
+    """Per-project index of raw photo fingerprints, used to skip duplicate uploads"""
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='photo_fingerprints')
+    content_hash = models.CharField(max_length=64, help_text="SHA-256 of the file contents")
+    perceptual_hash = models.CharField(max_length=16, blank=True, default='', help_text="64-bit difference hash of the image")
+    raw_photo = models.OneToOneField(RawPhotoUpload, on_delete=models.CASCADE, related_name='fingerprint', help_text="First upload with these contents")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'content_hash'], name='unique_project_content_hash'),
+        ]
+    
+    def __str__(self):
+        return f"Fingerprint {self.content_hash[:12]} in {self.project.name}"
+
+
+class ProjectFunnelDaily(models.Model):
+    """Cards of a project reaching each funnel stage on a day, precomputed by qr.funnel"""
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='funnel_days')
+    day = models.DateField()
+    scanned = models.PositiveIntegerField(default=0)
+    info_provided = models.PositiveIntegerField(default=0)
+    photos_uploaded = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            # Also the index behind the funnel endpoint's date range
+            models.UniqueConstraint(fields=['project', 'day'], name='unique_project_funnel_day'),
+        ]
+    
+    def __str__(self):
+        return f"Funnel for {self.project.name} on {self.day}"
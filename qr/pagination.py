@@ -0,0 +1,171 @@
+"""
+Keyset (cursor) pagination for list endpoints.
+
+OFFSET pagination gets slower the deeper you page, and DRF's CursorPagination
+only keys on the first ordering field (plus an offset for ties), which breaks
+down on nullable columns such as taken_at. KeysetPagination keys on every
+ordering field instead: the cursor holds the ordering values of the last row
+on the page, and the next page is "rows after that tuple". With an index that
+matches the ordering, every page is one index range scan of page_size rows, no
+matter how far in it is.
+
+The ordering must end in a unique field (id) so the position is unambiguous.
+Nullable fields sort their NULLs as if greater than any value (PostgreSQL's
+default), on every database.
+"""
+import base64
+import datetime
+import json
+
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE or 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    # Views may override with a `pagination_ordering` attribute
+    ordering = ('-created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        ordering = getattr(view, 'pagination_ordering', None) or self.ordering
+        self.fields = [
+            (name.lstrip('-'), name.startswith('-'), queryset.model._meta.get_field(name.lstrip('-')))
+            for name in ordering
+        ]
+
+        position, reverse = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position, reverse))
+        queryset = queryset.order_by(*self.order_by(reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    def order_by(self, reverse):
+        expressions = []
+        for name, descending, field in self.fields:
+            if descending != reverse:
+                expressions.append(F(name).desc(nulls_first=True) if field.null else F(name).desc())
+            else:
+                expressions.append(F(name).asc(nulls_last=True) if field.null else F(name).asc())
+        return expressions
+
+    def after(self, position, reverse):
+        """Rows strictly after `position` in (possibly reversed) ordering order"""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, descending, field), value in zip(self.fields, position):
+            condition |= equal & self.field_after(name, descending != reverse, field.null, value)
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+
+        # A plain range bound on the leading column lets the database start the
+        # index scan at the cursor instead of evaluating the OR chain row by row
+        name, descending, field = self.fields[0]
+        value = position[0]
+        if value is not None:
+            bound = Q(**{f'{name}__lte' if descending != reverse else f'{name}__gte': value})
+            if field.null and descending == reverse:
+                bound |= Q(**{f'{name}__isnull': True})
+            condition &= bound
+        return condition
+
+    @staticmethod
+    def field_after(name, descending, nullable, value):
+        if descending:
+            # NULLs come first
+            if value is None:
+                return Q(**{f'{name}__isnull': False})
+            return Q(**{f'{name}__lt': value})
+        # NULLs come last
+        if value is None:
+            return Q(pk__in=[])
+        after = Q(**{f'{name}__gt': value})
+        return after | Q(**{f'{name}__isnull': True}) if nullable else after
+
+    def position(self, row):
+        return [getattr(row, name) for name, _, _ in self.fields]
+
+    def encode_cursor(self, position, reverse):
+        values = [v.isoformat() if isinstance(v, (datetime.date, datetime.time)) else v for v in position]
+        payload = json.dumps({'p': values, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            values = payload['p']
+            if len(values) != len(self.fields):
+                raise ValueError('Cursor does not match ordering')
+            position = [
+                None if value is None else field.to_python(value)
+                for (_, _, field), value in zip(self.fields, values)
+            ]
+            return position, bool(payload.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class PhotoKeysetPagination(KeysetPagination):
+    """Photos in shooting order; taken_at is NULL when the file had no EXIF date"""
+    ordering = ('taken_at', 'uploaded_at', 'id')
+    page_size = 100
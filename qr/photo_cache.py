@@ -0,0 +1,241 @@
+"""
+Per-worker local disk cache for photo originals.
+
+Analysis reads every raw photo once to decode it, again to copy it into a
+QRCardPhoto and again for any later processing step. Reading through this
+cache means each original is fetched from S3 at most once per worker host.
+
+Entries are keyed by storage name and evicted least-recently-used once the
+cache grows past PHOTO_CACHE_MAX_BYTES. The directory may be shared by all
+worker processes on a host: recency is tracked with file mtimes and writes go
+through a temp file plus rename, so processes never see partial files.
+Hit/miss/eviction counters are per process.
+
+Settings (all optional):
+- PHOTO_CACHE_ENABLED (default True)
+- PHOTO_CACHE_DIR (default <tmp>/spotshot-photo-cache)
+- PHOTO_CACHE_MAX_BYTES (default 2 GiB)
+- PHOTO_CACHE_MMAP_THRESHOLD (default 4 MiB) - files at least this large are
+  served as a read-only mmap instead of being read into memory
+"""
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MMAP_THRESHOLD = 4 * 1024 * 1024
+
+# Evict down to this fraction of the limit so we don't rescan on every insert
+LOW_WATER_MARK = 0.9
+
+
+def local_path(name, storage):
+    """Path of the object if the storage keeps it on local disk already, else None"""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        return None
+    return path if os.path.exists(path) else None
+
+
+class PhotoCache:
+    """Size-bounded LRU cache of storage objects on local disk"""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, mmap_threshold=DEFAULT_MMAP_THRESHOLD):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._current_bytes = sum(size for _, _, size in self._scan())
+
+    def _entry_path(self, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        _, ext = os.path.splitext(name)
+        return os.path.join(self.directory, digest[:2], digest + ext.lower())
+
+    def _scan(self):
+        """Yield (mtime, path, size) for every cached file"""
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.startswith('.tmp'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+    def get_path(self, name, storage):
+        """Returns a local path holding the object, downloading it on a miss"""
+        # Local storage already has the file on disk
+        path = local_path(name, storage)
+        if path:
+            return path
+
+        path = self._entry_path(name)
+        try:
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            self.misses += 1
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=os.path.dirname(path))
+        try:
+            size = 0
+            with os.fdopen(fd, 'wb') as tmp_file, storage.open(name, 'rb') as source:
+                for chunk in source.chunks():
+                    tmp_file.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self._added(size, keep=path)
+        return path
+
+    def prime(self, name, storage, source_path):
+        """Seed the cache with a local file that was just written to storage under `name`"""
+        if local_path(name, storage):
+            return
+
+        path = self._entry_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f'.tmp{os.getpid()}-{threading.get_ident()}')
+        try:
+            # A hard link costs nothing when both live on the same filesystem
+            os.link(source_path, tmp_path)
+        except OSError:
+            shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+        self._added(os.path.getsize(path), keep=path)
+
+    @contextmanager
+    def open_file(self, name, storage):
+        """Yield the cached local file, opened for reading"""
+        with open(self.get_path(name, storage), 'rb') as f:
+            yield f
+
+    @contextmanager
+    def open_buffer(self, name, storage):
+        """Yield the object's bytes; large files are yielded as a read-only mmap"""
+        path = self.get_path(name, storage)
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size and size >= self.mmap_threshold:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    yield buffer
+            else:
+                yield f.read()
+
+    def _added(self, size, keep):
+        with self._lock:
+            self._current_bytes += size
+            over_limit = self._current_bytes > self.max_bytes
+        if over_limit:
+            self.evict(keep=keep)
+
+    def evict(self, keep=None):
+        """Remove least recently used files until the cache is under the low-water mark"""
+        with self._lock:
+            entries = sorted(self._scan())
+            total = sum(size for _, _, size in entries)
+            target = self.max_bytes * LOW_WATER_MARK
+            for _, path, size in entries:
+                if total <= target:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    # Safe on POSIX even if another process still has it open or mapped
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+            self._current_bytes = total
+
+    def stats(self):
+        """Counters for monitoring; hits/misses/evictions are per process"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class PassthroughCache:
+    """Stand-in used when PHOTO_CACHE_ENABLED is False"""
+
+    @contextmanager
+    def open_file(self, name, storage):
+        with storage.open(name, 'rb') as f:
+            yield f
+
+    def prime(self, name, storage, source_path):
+        pass
+
+    @contextmanager
+    def open_buffer(self, name, storage):
+        with storage.open(name, 'rb') as f:
+            yield f.read()
+
+    def stats(self):
+        return {'enabled': False}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_photo_cache():
+    """Returns the process-wide photo cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if getattr(settings, 'PHOTO_CACHE_ENABLED', True):
+                    _cache = PhotoCache(
+                        getattr(settings, 'PHOTO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'spotshot-photo-cache')),
+                        max_bytes=getattr(settings, 'PHOTO_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES),
+                        mmap_threshold=getattr(settings, 'PHOTO_CACHE_MMAP_THRESHOLD', DEFAULT_MMAP_THRESHOLD),
+                    )
+                else:
+                    _cache = PassthroughCache()
+    return _cache
+
+
+def open_photo_buffer(image_field):
+    """Read an ImageField's file through the cache"""
+    return get_photo_cache().open_buffer(image_field.name, image_field.storage)
+
+
+def open_photo_file(image_field):
+    """Open an ImageField's file for reading through the cache"""
+    return get_photo_cache().open_file(image_field.name, image_field.storage)
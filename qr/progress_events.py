@@ -0,0 +1,145 @@
+"""
+Push channel for batch progress.
+
+Analysis workers publish batch events to a Redis pub/sub channel per batch:
+- status: the batch moved to analyzing/completed/failed
+- progress: processed/total counts after each photo
+- photo: a photo was processed and possibly assigned to a QR card
+
+batch_event_stream() subscribes to that channel from an async view and turns
+the messages into Server-Sent Events. The photographer's browser then
+updates as cards are matched, without polling the progress endpoint.
+
+Pub/sub has no history. A stream therefore opens with a progress snapshot
+read from the database after subscribing, so nothing published in between
+is lost. A stream ends with the batch's final status event, or after
+PROGRESS_EVENTS_MAX_SECONDS with a last progress snapshot, so a stalled
+batch does not hold a connection forever; the browser's EventSource then
+reconnects and starts from a fresh snapshot. Publishing is best-effort: a
+Redis failure is logged and never fails the analysis.
+
+The stream is served by a separate ASGI process (`events` in the Procfile)
+that the proxy routes /api/photo-batches/<id>/events/ to. Everything else
+stays on the WSGI server: ASGIHandler spools the whole request body before
+calling the view, which would undo the streaming upload handler.
+
+Settings (optional):
+- PROGRESS_EVENTS_REDIS_URL (default CELERY_BROKER_URL)
+- PROGRESS_EVENTS_HEARTBEAT (default 15 seconds) - comment lines that keep
+  proxies from closing an idle stream
+- PROGRESS_EVENTS_MAX_SECONDS (default 300) - how long one stream stays open
+"""
+import json
+import logging
+import threading
+import time
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = ('completed', 'failed')
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def redis_url():
+    return getattr(settings, 'PROGRESS_EVENTS_REDIS_URL', None) or settings.CELERY_BROKER_URL
+
+
+def channel_name(batch_id):
+    return f'spotshot:batch:{batch_id}:events'
+
+
+def get_redis_client():
+    """Process-wide client for publishing; redis-py pools its connections"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(redis_url(), socket_connect_timeout=1, socket_timeout=1)
+    return _client
+
+
+def publish_batch_event(batch_id, event, data):
+    try:
+        message = json.dumps({'event': event, 'data': data}, cls=DjangoJSONEncoder)
+        get_redis_client().publish(channel_name(batch_id), message)
+    except Exception as e:
+        logger.warning(f"Could not publish {event} event for batch {batch_id}: {str(e)}")
+
+
+def publish_batch_status(batch):
+    publish_batch_event(batch.id, 'status', {
+        'status': batch.status,
+        'error_message': batch.error_message,
+    })
+
+
+def publish_batch_progress(batch):
+    publish_batch_event(batch.id, 'progress', batch_progress(batch))
+
+
+def publish_photo_processed(raw_photo):
+    card = raw_photo.assigned_qr_card
+    publish_batch_event(raw_photo.batch_id, 'photo', {
+        'id': raw_photo.id,
+        'has_qr_code': raw_photo.has_qr_code,
+        'processing_error': raw_photo.processing_error,
+        'assigned_qr_card': {'id': card.id, 'short_code': card.short_code} if card else None,
+    })
+
+
+def batch_progress(batch):
+    return {
+        'status': batch.status,
+        'total_photos': batch.total_photos,
+        'processed_photos': batch.processed_photos,
+        'qr_codes_found': batch.qr_codes_found,
+        'progress_percentage': batch.progress_percentage,
+    }
+
+
+def format_sse(event, data):
+    payload = data if isinstance(data, str) else json.dumps(data, cls=DjangoJSONEncoder)
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+async def batch_event_stream(batch_id, load_snapshot):
+    """
+    Yields SSE text for a batch until it reaches a final status or the stream
+    has been open PROGRESS_EVENTS_MAX_SECONDS. load_snapshot is an async
+    callable returning the current progress dict.
+    """
+    heartbeat = getattr(settings, 'PROGRESS_EVENTS_HEARTBEAT', 15)
+    deadline = time.monotonic() + getattr(settings, 'PROGRESS_EVENTS_MAX_SECONDS', 300)
+    client = redis.asyncio.Redis.from_url(redis_url())
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(channel_name(batch_id))
+
+        snapshot = await load_snapshot()
+        yield format_sse('progress', snapshot)
+        if snapshot['status'] in FINAL_STATUSES:
+            yield format_sse('status', {'status': snapshot['status']})
+            return
+
+        while (remaining := deadline - time.monotonic()) > 0:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(heartbeat, remaining))
+            if message is None:
+                yield ': keep-alive\n\n'
+                continue
+            event = json.loads(message['data'])
+            yield format_sse(event['event'], event['data'])
+            if event['event'] == 'status' and event['data'].get('status') in FINAL_STATUSES:
+                return
+
+        # Open long enough; the client reconnects if it still wants updates
+        yield format_sse('progress', await load_snapshot())
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
@@ -0,0 +1,34 @@
+"""
+QR card search.
+
+Codes are lowercase UUIDs and photographers type the 8-character short code,
+so a term that looks like one is matched as a prefix of `code`. On
+PostgreSQL that is a range scan of the varchar_pattern_ops index Django
+creates for the unique column. Free text is matched with icontains
+against the client and session columns. Django renders that as
+UPPER(col::text) LIKE UPPER('%term%'), and migration 0008 adds pg_trgm
+GIN indexes on exactly those expressions, so PostgreSQL answers it from
+the indexes instead of a sequential scan. SQLite runs the same queries
+unindexed.
+"""
+import re
+
+from django.db.models import Q
+
+TEXT_SEARCH_FIELDS = ('client_email', 'client_name', 'location_name', 'session_notes')
+
+CODE_PREFIX = re.compile(r'^[0-9a-f-]{4,36}$')
+
+
+def search_qr_cards(queryset, term):
+    """Filter a QRCard queryset by a search box term"""
+    term = term.strip()
+    if not term:
+        return queryset
+
+    condition = Q()
+    for field in TEXT_SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__icontains': term})
+    if CODE_PREFIX.match(term.lower()):
+        condition |= Q(code__startswith=term.lower())
+    return queryset.filter(condition)
@@ -6,8 +6,69 @@ class QRCardPhotoSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = QRCardPhoto
-        fields = ['id', 'image', 'original_filename', 'taken_at', 'uploaded_at', 'file_size', 'file_size_mb', 'is_processed']
-        read_only_fields = ['id', 'uploaded_at', 'file_size', 'file_size_mb']
+        fields = ['id', 'image', 'thumbnail', 'preview', 'original_filename', 'taken_at', 'uploaded_at', 'file_size', 'file_size_mb', 'is_processed']
+        read_only_fields = ['id', 'thumbnail', 'preview', 'uploaded_at', 'file_size', 'file_size_mb', 'is_processed']
+
+def query_param_set(request, name):
+    """Comma-separated query parameter as a set, e.g. ?fields=id,code"""
+    if request is None:
+        return set()
+    return {value.strip() for value in request.query_params.get(name, '').split(',') if value.strip()}
+
+class SparseFieldsetMixin:
+    """
+    `?fields=a,b` limits the top-level response to those fields and
+    `?expand=x` adds the nested serializers listed in Meta.expandable_fields.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Only the serializer the view returns, not nested ones
+        if self.root is not self and self.root is not self.parent:
+            return fields
+        request = self.context.get('request')
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        expanded = query_param_set(request, 'expand') & expandable.keys()
+        for name in expanded:
+            serializer_class, kwargs = expandable[name]
+            fields[name] = serializer_class(**kwargs)
+        wanted = query_param_set(request, 'fields')
+        if wanted:
+            for name in list(fields):
+                if name not in wanted and name not in expanded:
+                    fields.pop(name)
+        return fields
+
+class QRCardListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    List representation: no nested photos (see ?expand=photos) and
+    photo_count from the photo_total counter instead of a query per card.
+    """
+    short_code = serializers.ReadOnlyField()
+    has_client_info = serializers.ReadOnlyField()
+    photo_count = serializers.IntegerField(source='photo_total', read_only=True)
+    
+    # Model columns the list reads; everything else is deferred
+    model_fields = [
+        'id', 'batch', 'project', 'code', 'pdf', 'qr_url',
+        'access_pin', 'client_email', 'client_name', 'client_phone',
+        'location_name', 'status',
+        'created_at', 'scanned_at', 'info_provided_at', 'photos_uploaded_at', 'completed_at', 'photo_total',
+    ]
+    
+    class Meta:
+        model = QRCard
+        fields = [
+            'id', 'batch', 'project', 'code', 'short_code', 'pdf', 'qr_url',
+            'access_pin', 'client_email', 'client_name', 'client_phone',
+            'location_name', 'status',
+            'created_at', 'scanned_at', 'info_provided_at', 'photos_uploaded_at', 'completed_at',
+            'has_client_info', 'photo_count'
+        ]
+        read_only_fields = fields
+        expandable_fields = {
+            'photos': (QRCardPhotoSerializer, {'many': True, 'read_only': True}),
+        }
 
 class QRCardSerializer(serializers.ModelSerializer):
     short_code = serializers.ReadOnlyField()
@@ -26,7 +87,7 @@ class QRCardSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'pdf', 'qr_url', 'created_at', 'short_code', 'has_client_info', 'photo_count']
 
-class QRCardDetailSerializer(serializers.ModelSerializer):
+class QRCardDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Detailed serializer for QR card management by photographers"""
     short_code = serializers.ReadOnlyField()
     has_client_info = serializers.ReadOnlyField()
@@ -68,15 +129,12 @@ class QRCardClientSerializer(serializers.ModelSerializer):
         }
 
 class QRCardBatchSerializer(serializers.ModelSerializer):
-    qrcards_count = serializers.SerializerMethodField()
+    qrcards_count = serializers.IntegerField(source='card_total', read_only=True)
     
     class Meta:
         model = QRCardBatch
         fields = ['id', 'project', 'name', 'pdf', 'amount', 'size', 'per_page', 'created_at', 'qrcards_count']
         read_only_fields = ['id', 'pdf', 'created_at', 'qrcards_count']
-    
-    def get_qrcards_count(self, obj):
-        return obj.qrcards.count()
 
 class QRCardGenerationOptionsSerializer(serializers.Serializer):
     amount = serializers.IntegerField(min_value=1, max_value=1000, default=100)
@@ -108,9 +166,11 @@ class RawPhotoUploadSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'batch', 'image', 'original_filename', 'taken_at', 'camera_make', 
             'camera_model', 'file_size', 'file_size_mb', 'is_processed', 'has_qr_code', 
-            'qr_code_data', 'assigned_qr_card', 'processing_error', 'uploaded_at', 'processed_at'
+            'qr_code_data', 'assigned_qr_card', 'processing_error', 'uploaded_at', 'processed_at',
+            'duplicate_of', 'near_duplicate_of'
         ]
         read_only_fields = [
             'id', 'file_size', 'file_size_mb', 'is_processed', 'has_qr_code', 
-            'qr_code_data', 'assigned_qr_card', 'processing_error', 'uploaded_at', 'processed_at'
+            'qr_code_data', 'assigned_qr_card', 'processing_error', 'uploaded_at', 'processed_at',
+            'duplicate_of', 'near_duplicate_of'
         ]
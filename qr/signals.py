@@ -0,0 +1,66 @@
+"""
+Keeps derived state in step with the rows it is built from: the client card
+cache (qr.client_cache) and the denormalized counters (qr.counters)
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from projects.models import Project
+from . import counters
+from .client_cache import invalidate_client_cards
+from .models import QRCard, QRCardPhoto
+
+
+@receiver([post_save, post_delete], sender=QRCard)
+def qr_card_changed(sender, instance, **kwargs):
+    invalidate_client_cards([instance.code])
+
+
+@receiver([post_save, post_delete], sender=QRCardPhoto)
+def qr_card_photo_changed(sender, instance, **kwargs):
+    if QRCardPhoto.qr_card.is_cached(instance):
+        codes = [instance.qr_card.code]
+    else:
+        codes = QRCard.objects.filter(pk=instance.qr_card_id).values_list('code', flat=True)
+    invalidate_client_cards(list(codes))
+
+
+@receiver(post_save, sender=Project)
+def project_changed(sender, instance, created, **kwargs):
+    # The client payload shows the project name and description; saves that
+    # change neither keep every card's cached payload
+    client_fields = (instance.__dict__.get('name'), instance.__dict__.get('description'))
+    if not created and client_fields != getattr(instance, '_loaded_client_fields', None):
+        invalidate_client_cards(list(instance.qrcards.values_list('code', flat=True)))
+    instance._loaded_client_fields = client_fields
+
+
+@receiver(post_save, sender=QRCard)
+def count_qr_card_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        counters.cards_added([instance])
+    elif update_fields is None or 'status' in update_fields:
+        loaded_status = getattr(instance, '_loaded_status', None)
+        if loaded_status:
+            counters.card_status_changed(instance.project_id, loaded_status, instance.status)
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=QRCard)
+def count_qr_card_deleted(sender, instance, origin=None, **kwargs):
+    # A deleted project takes its counters with it
+    if not counters.deleted_via(origin, Project):
+        counters.cards_removed([instance])
+
+
+@receiver(post_save, sender=QRCardPhoto)
+def count_qr_card_photo_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.photos_added(instance.qr_card_id)
+
+
+@receiver(post_delete, sender=QRCardPhoto)
+def count_qr_card_photo_deleted(sender, instance, origin=None, **kwargs):
+    # Photos deleted along with their card are uncounted by cards_removed
+    if counters.deleted_via(origin, QRCardPhoto):
+        counters.photos_removed(instance.qr_card_id)
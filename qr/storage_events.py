@@ -0,0 +1,90 @@
+"""
+Bucket notification ingestion for direct uploads.
+
+S3 (directly or through SNS) and MinIO can POST an event for every object
+written to the bucket. Each ObjectCreated record whose key matches a
+registered RawPhotoUpload marks that upload as arrived and queues it for
+decoding right away, so nothing depends on the client calling
+confirm_uploads and a batch is analysed as soon as its last file lands.
+
+Deliveries are at-least-once and may carry several records: an upload is
+only claimed by the UPDATE that moves it out of the not-yet-uploaded
+state, so replays and duplicate records are no-ops.
+
+Uploads whose object never arrives (the client crashed or gave up) are failed
+after UPLOAD_EXPIRY_SECONDS (default 6 hours) by the expire_stale_uploads beat
+task, which then lets their batch move on.
+"""
+import json
+import logging
+from urllib.parse import unquote_plus
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import RawPhotoUpload
+from .tasks import decode_raw_photo
+
+logger = logging.getLogger(__name__)
+
+
+def parse_storage_event(payload):
+    """
+    Returns [(key, size)] for the ObjectCreated records in an S3/MinIO
+    notification, unwrapping SNS envelopes. Records for other buckets are
+    skipped.
+    """
+    if isinstance(payload, (str, bytes)):
+        payload = json.loads(payload)
+
+    if payload.get('Type') == 'SubscriptionConfirmation':
+        logger.warning(f"Storage event SNS subscription needs confirming: {payload.get('SubscribeURL')}")
+        return []
+    if payload.get('Type') == 'Notification':
+        payload = json.loads(payload.get('Message') or '{}')
+
+    bucket_name = getattr(settings, 'AWS_STORAGE_BUCKET_NAME', None)
+    objects = []
+    for record in payload.get('Records') or []:
+        if 'ObjectCreated:' not in record.get('eventName', ''):
+            continue
+        s3 = record.get('s3') or {}
+        if bucket_name and (s3.get('bucket') or {}).get('name') != bucket_name:
+            continue
+        obj = s3.get('object') or {}
+        if obj.get('key'):
+            # Keys arrive URL-encoded, with spaces as '+'
+            objects.append((unquote_plus(obj['key']), obj.get('size')))
+    return objects
+
+
+def ingest_storage_event(payload):
+    """Mark the uploads named in an event as arrived and queue them for decoding"""
+    objects = parse_storage_event(payload)
+    sizes = dict(objects)
+
+    claimed = []
+    for raw_photo_id, s3_key in RawPhotoUpload.objects.filter(
+        s3_key__in=sizes.keys(), image=''
+    ).values_list('id', 's3_key'):
+        updates = {
+            'image': F('s3_key'),
+            'multipart_upload_id': None,
+            'processing_error': None,
+            'updated_at': timezone.now(),
+        }
+        if sizes[s3_key] is not None:
+            updates['file_size'] = sizes[s3_key]
+        # Conditional so that concurrent or replayed deliveries claim each upload once
+        if RawPhotoUpload.objects.filter(id=raw_photo_id, image='').update(**updates):
+            claimed.append(raw_photo_id)
+
+    for raw_photo_id in claimed:
+        decode_raw_photo.delay(raw_photo_id)
+
+    return {
+        'records': len(objects),
+        'ingested': len(claimed),
+        'ignored': len(objects) - len(claimed),
+    }
@@ -4,10 +4,19 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from io import BytesIO
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from django.conf import settings
+from django.db.models import Q
 from django.utils import timezone
 from .models import QRCard, QRCardBatch, PhotoUploadBatch, RawPhotoUpload, QRCardPhoto
+from . import counters
+from .decoders import decode_qr_payloads
+from .derivatives import generate_derivatives
+from .fingerprints import NearDuplicateIndex, fingerprint_file, perceptual_hash, register_fingerprint
+from .funnel import refresh_funnels, refresh_recent_funnels
+from .photo_cache import get_photo_cache, open_photo_buffer, open_photo_file
+from .progress_events import publish_batch_progress, publish_batch_status, publish_photo_processed
+from .s3 import abort_multipart_uploads
 from projects.models import Project
 import uuid
 from PIL import Image, ExifTags
@@ -17,7 +26,7 @@ import random
 import cv2
 import numpy as np
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
 QR_SIZES = {
     'small': 50,   # mm
@@ -138,6 +147,7 @@ def generate_qr_pdf_task(project_id, amount=100, size='medium', per_page=12, bat
                 )
             )
         QRCard.objects.bulk_create(qr_cards)
+        counters.cards_added(qr_cards)
         
         return {
             'success': True,
@@ -156,6 +166,12 @@ def generate_qr_pdf_task(project_id, amount=100, size='medium', per_page=12, bat
             'error': str(e)
         }
 
+# What the batch analysis writes to each raw photo
+ANALYSIS_FIELDS = [
+    'has_qr_code', 'qr_code_data', 'assigned_qr_card', 'is_processed', 'processed_at',
+    'content_hash', 'perceptual_hash', 'duplicate_of', 'near_duplicate_of', 'updated_at',
+]
+
 @shared_task
 def analyze_photo_batch_for_qr_codes(batch_id):
     """
@@ -166,24 +182,39 @@ def analyze_photo_batch_for_qr_codes(batch_id):
         batch.status = 'analyzing'
         batch.processing_started_at = timezone.now()
         batch.save()
+        publish_batch_status(batch)
         
         logger = logging.getLogger(__name__)
         logger.info(f"Starting QR analysis for batch {batch_id}")
         
-        # Get all raw photos ordered by timestamp
-        raw_photos = batch.raw_photos.order_by('taken_at', 'uploaded_at')
-        total_photos = raw_photos.count()
+        # Get all raw photos ordered by timestamp. Uploads that already failed (never
+        # arrived, or could not be decoded) keep their error and count as processed
+        total_photos = batch.raw_photos.count()
+        raw_photos = batch.raw_photos.filter(processing_error__isnull=True).order_by('taken_at', 'uploaded_at')
         batch.total_photos = total_photos
         batch.save()
         
         current_qr_card = None
-        processed_count = 0
+        processed_count = total_photos - raw_photos.count()
         qr_codes_found = 0
         
+        # Perceptual hashes already seen in this project, for near-duplicate flags
+        near_index = NearDuplicateIndex.for_project(batch.project)
+        
         for raw_photo in raw_photos:
             try:
-                # Extract QR code from image
-                qr_data = extract_qr_code_from_image(raw_photo.image)
+                is_duplicate = fingerprint_raw_photo(raw_photo, batch.project, near_index)
+                original = raw_photo.duplicate_of if is_duplicate else None
+                
+                if original is not None and copy_decode_result(raw_photo, original):
+                    # Same bytes as a decoded photo - reuse its result instead of decoding again
+                    qr_data = raw_photo.qr_code_data if raw_photo.has_qr_code else None
+                elif raw_photo.decoded_at:
+                    # Already decoded by decode_raw_photo when the upload arrived
+                    qr_data = raw_photo.qr_code_data if raw_photo.has_qr_code else None
+                else:
+                    # Extract QR code from image
+                    qr_data = extract_qr_code_from_image(raw_photo.image)
                 
                 if qr_data:
                     # Found QR code - this starts a new photo session
@@ -209,25 +240,33 @@ def analyze_photo_batch_for_qr_codes(batch_id):
                 # Mark as processed
                 raw_photo.is_processed = True
                 raw_photo.processed_at = timezone.now()
-                raw_photo.save()
+                # Leaves decode_raw_photo's fields alone should it still be running for this photo
+                raw_photo.save(update_fields=ANALYSIS_FIELDS)
                 
-                # Copy to QRCardPhoto if assigned to a card
-                if raw_photo.assigned_qr_card:
+                # Copy to QRCardPhoto if assigned to a card, unless an identical
+                # upload was already copied to the same card
+                already_copied = original is not None and original.assigned_qr_card_id == raw_photo.assigned_qr_card_id
+                if raw_photo.assigned_qr_card and not already_copied:
                     create_qr_card_photo_from_raw(raw_photo)
                 
                 processed_count += 1
                 
                 # Update progress
                 batch.processed_photos = processed_count
+                batch.qr_codes_found = qr_codes_found
                 batch.save()
                 
             except Exception as e:
                 logger.error(f"Error processing photo {raw_photo.id}: {str(e)}")
                 raw_photo.processing_error = str(e)
-                raw_photo.save()
+                raw_photo.save(update_fields=['processing_error', 'updated_at'])
                 processed_count += 1
                 batch.processed_photos = processed_count
                 batch.save()
+            
+            # Push to photographers watching the batch (qr.progress_events)
+            publish_photo_processed(raw_photo)
+            publish_batch_progress(batch)
         
         # Complete the batch
         batch.status = 'completed'
@@ -237,15 +276,20 @@ def analyze_photo_batch_for_qr_codes(batch_id):
         
         # Update QR card statuses
         update_qr_card_statuses(batch)
+        publish_batch_progress(batch)
+        publish_batch_status(batch)
         
+        photo_cache_stats = get_photo_cache().stats()
         logger.info(f"Completed QR analysis for batch {batch_id}: {qr_codes_found} QR codes found, {processed_count} photos processed")
+        logger.info(f"Photo cache stats: {photo_cache_stats}")
         
         return {
             'success': True,
             'batch_id': batch_id,
             'total_photos': total_photos,
             'processed_photos': processed_count,
-            'qr_codes_found': qr_codes_found
+            'qr_codes_found': qr_codes_found,
+            'photo_cache': photo_cache_stats
         }
         
     except Exception as e:
@@ -258,6 +302,7 @@ def analyze_photo_batch_for_qr_codes(batch_id):
             batch.error_message = str(e)
             batch.completed_at = timezone.now()
             batch.save()
+            publish_batch_status(batch)
         except:
             pass
         
@@ -268,48 +313,204 @@ def analyze_photo_batch_for_qr_codes(batch_id):
         }
 
 
-def extract_qr_code_from_image(image_field):
-    """Extract QR code data from an image using OpenCV and pyzbar.
-    Falls back to OpenCV's QRCodeDetector if pyzbar (zbar) is unavailable.
+@shared_task
+def decode_raw_photo(raw_photo_id):
+    """
+    Fingerprint and decode a direct upload as soon as it reaches storage, then
+    start the batch analysis once nothing in the batch is still pending. The
+    batch pass only has to order photos and assign them to cards.
     """
     try:
-        try:
-            from pyzbar import pyzbar
-            use_pyzbar = True
-        except Exception as import_err:
-            logging.getLogger(__name__).warning(
-                f"pyzbar unavailable (likely missing zbar). Falling back to OpenCV QRCodeDetector. Details: {import_err}"
+        raw_photo = RawPhotoUpload.objects.select_related('batch__project').get(id=raw_photo_id)
+        
+        if raw_photo.decoded_at is None and raw_photo.image:
+            is_duplicate = fingerprint_raw_photo(raw_photo, raw_photo.batch.project)
+            
+            if not (is_duplicate and copy_decode_result(raw_photo, raw_photo.duplicate_of)):
+                qr_data = extract_qr_code_from_image(raw_photo.image)
+                raw_photo.has_qr_code = bool(qr_data)
+                raw_photo.qr_code_data = qr_data
+                if raw_photo.taken_at is None:
+                    raw_photo.taken_at = extract_exif_datetime(raw_photo.image)
+                raw_photo.decoded_at = timezone.now()
+            # Only the decode's own fields, and only for a row nothing decoded yet: the
+            # batch analysis may already have processed and assigned it
+            RawPhotoUpload.objects.filter(id=raw_photo.id, decoded_at__isnull=True).update(
+                has_qr_code=raw_photo.has_qr_code,
+                qr_code_data=raw_photo.qr_code_data,
+                taken_at=raw_photo.taken_at,
+                content_hash=raw_photo.content_hash,
+                perceptual_hash=raw_photo.perceptual_hash,
+                duplicate_of_id=raw_photo.duplicate_of_id,
+                near_duplicate_of_id=raw_photo.near_duplicate_of_id,
+                decoded_at=raw_photo.decoded_at,
+                updated_at=raw_photo.decoded_at
             )
-            use_pyzbar = False
+        
+        analysis_started = start_analysis_when_uploaded(raw_photo.batch_id)
+        
+        return {
+            'success': True,
+            'raw_photo_id': raw_photo_id,
+            'has_qr_code': raw_photo.has_qr_code,
+            'analysis_started': analysis_started
+        }
+        
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Failed to decode raw photo {raw_photo_id}: {str(e)}")
+        
+        # A failed photo must not hold up the rest of its batch
+        try:
+            RawPhotoUpload.objects.filter(id=raw_photo_id).update(processing_error=str(e), updated_at=timezone.now())
+            batch_id = RawPhotoUpload.objects.filter(id=raw_photo_id).values_list('batch_id', flat=True).first()
+            if batch_id:
+                start_analysis_when_uploaded(batch_id)
+        except Exception:
+            pass
+        
+        return {
+            'success': False,
+            'raw_photo_id': raw_photo_id,
+            'error': str(e)
+        }
 
-        image_field.open()
-        image_data = image_field.read()
-        image_field.close()
 
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+def start_analysis_when_uploaded(batch_id):
+    """Queue the batch analysis once every registered upload has arrived and been decoded"""
+    pending = RawPhotoUpload.objects.filter(
+        batch_id=batch_id, processing_error__isnull=True
+    ).filter(Q(image='') | Q(decoded_at__isnull=True))
+    if pending.exists():
+        return False
+    
+    # Only one of the batch's last decode tasks wins the transition
+    if PhotoUploadBatch.objects.filter(id=batch_id, status='uploading').update(status='analyzing', updated_at=timezone.now()):
+        analyze_photo_batch_for_qr_codes.delay(batch_id)
+        return True
+    return False
+
+
+@shared_task
+def expire_stale_uploads():
+    """
+    Beat task: settle batches whose client stopped before every upload arrived.
+    
+    Registered uploads still without an object UPLOAD_EXPIRY_SECONDS after
+    they were created are marked failed (their multipart uploads aborted), and
+    arrived uploads whose decode never ran are queued again. Each batch then
+    goes through the usual transition: analysis once nothing is pending, or
+    'failed' if none of its files ever arrived.
+    """
+    try:
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=getattr(settings, 'UPLOAD_EXPIRY_SECONDS', 6 * 60 * 60))
+        batch_ids = list(
+            PhotoUploadBatch.objects.filter(status='uploading', created_at__lt=cutoff).values_list('id', flat=True)
+        )
+        
+        stale = RawPhotoUpload.objects.filter(
+            batch_id__in=batch_ids, image='', processing_error__isnull=True, uploaded_at__lt=cutoff
+        )
+        multipart_uploads = list(
+            stale.filter(multipart_upload_id__isnull=False).values_list('s3_key', 'multipart_upload_id')
+        )
+        if multipart_uploads:
+            abort_multipart_uploads(settings.AWS_STORAGE_BUCKET_NAME, multipart_uploads)
+        expired = stale.update(processing_error='Upload never arrived', multipart_upload_id=None, updated_at=now)
+        
+        undecoded = RawPhotoUpload.objects.filter(
+            batch_id__in=batch_ids, processing_error__isnull=True, decoded_at__isnull=True, updated_at__lt=cutoff
+        ).exclude(image='').values_list('id', flat=True)
+        for raw_photo_id in undecoded:
+            decode_raw_photo.delay(raw_photo_id)
+        
+        started = failed = 0
+        for batch_id in batch_ids:
+            raw_photos = RawPhotoUpload.objects.filter(batch_id=batch_id)
+            if not raw_photos.exclude(image='').exists():
+                if not raw_photos.filter(processing_error__isnull=True).exists():
+                    failed += PhotoUploadBatch.objects.filter(id=batch_id, status='uploading').update(
+                        status='failed', error_message='No files were successfully uploaded', updated_at=now
+                    )
+            elif start_analysis_when_uploaded(batch_id):
+                started += 1
+        
+        return {'success': True, 'expired': expired, 'analysis_started': started, 'failed': failed}
+        
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Failed to expire stale uploads: {str(e)}")
+        
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
+def extract_qr_code_from_image(image_field):
+    """Extract QR code data from an image.
+    Engines are tried in the order configured in qr.decoders (pyzbar first,
+    then OpenCV's QRCodeDetector by default); see `benchmark_qr_decoders`.
+    """
+    try:
+        with open_photo_buffer(image_field) as image_data:
+            nparr = np.frombuffer(image_data, np.uint8)
+            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            # Release the buffer export so an mmap can be closed
+            del nparr
         if image is None:
             return None
 
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-        if use_pyzbar:
-            qr_codes = pyzbar.decode(gray)
-            if qr_codes:
-                return qr_codes[0].data.decode('utf-8')
-            return None
-        else:
-            detector = cv2.QRCodeDetector()
-            data, points, _ = detector.detectAndDecode(gray)
-            if points is not None and data:
-                return data
-            return None
+        payloads = decode_qr_payloads(gray)
+        if payloads:
+            return payloads[0]
+        return None
 
     except Exception as e:
         logging.getLogger(__name__).error(f"Error extracting QR code from image: {str(e)}")
         return None
 
 
+def fingerprint_raw_photo(raw_photo, project, near_index=None):
+    """Register a raw photo's content/perceptual hashes; returns True for exact duplicates"""
+    if raw_photo.duplicate_of_id:
+        return True
+    
+    sha256 = raw_photo.content_hash
+    phash = raw_photo.perceptual_hash or ''
+    if not sha256:
+        # Direct S3 uploads are only hashed once they reach a worker
+        with open_photo_file(raw_photo.image) as source_file:
+            sha256, phash = fingerprint_file(source_file)
+    elif not phash:
+        # Streamed uploads are hashed in the request but need decoding for the perceptual hash
+        with open_photo_file(raw_photo.image) as source_file:
+            try:
+                phash = perceptual_hash(source_file)
+            except Exception:
+                phash = ''
+    
+    return register_fingerprint(raw_photo, project, sha256, phash, near_index)
+
+
+def copy_decode_result(raw_photo, original):
+    """
+    Give an exact duplicate its original's decode result instead of decoding
+    the same bytes again; returns False while the original isn't decoded
+    """
+    if original.processing_error or not (original.decoded_at or original.is_processed):
+        return False
+    
+    raw_photo.has_qr_code = original.has_qr_code
+    raw_photo.qr_code_data = original.qr_code_data
+    raw_photo.taken_at = raw_photo.taken_at or original.taken_at
+    raw_photo.content_hash = original.content_hash
+    raw_photo.perceptual_hash = original.perceptual_hash
+    raw_photo.decoded_at = timezone.now()
+    return True
+
+
 def find_qr_card_by_url(qr_data, project):
     """Find QR card by matching the URL/code in QR data"""
     try:
@@ -343,10 +544,9 @@ def create_qr_card_photo_from_raw(raw_photo):
         ).exists():
             return
         
-        # Copy image file
-        with raw_photo.image.open('rb') as source_file:
-            content = ContentFile(source_file.read())
-            
+        # Copy image file, reading the original through the local photo cache
+        photo_cache = get_photo_cache()
+        with open_photo_file(raw_photo.image) as source_file:
             qr_photo = QRCardPhoto.objects.create(
                 qr_card=raw_photo.assigned_qr_card,
                 original_filename=raw_photo.original_filename,
@@ -357,14 +557,62 @@ def create_qr_card_photo_from_raw(raw_photo):
             # Save the image
             qr_photo.image.save(
                 raw_photo.original_filename,
-                content,
+                File(source_file),
                 save=True
             )
             
+            # The copy has the same bytes, so later steps can hit the cache too
+            photo_cache.prime(qr_photo.image.name, qr_photo.image.storage, source_file.name)
+        
+        generate_photo_derivatives.delay(qr_photo.id)
+            
     except Exception as e:
         logging.getLogger(__name__).error(f"Error creating QRCardPhoto from raw photo {raw_photo.id}: {str(e)}")
 
 
+@shared_task
+def generate_photo_derivatives(photo_id):
+    """Generate the thumbnail and web preview for a QRCardPhoto"""
+    try:
+        photo = QRCardPhoto.objects.get(id=photo_id)
+        if photo.is_processed:
+            return {'success': True, 'photo_id': photo_id, 'skipped': True}
+        
+        generate_derivatives(photo)
+        
+        return {
+            'success': True,
+            'photo_id': photo_id,
+            'thumbnail': photo.thumbnail.name,
+            'preview': photo.preview.name
+        }
+        
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Failed to generate derivatives for photo {photo_id}: {str(e)}")
+        
+        return {
+            'success': False,
+            'photo_id': photo_id,
+            'error': str(e)
+        }
+
+
+@shared_task
+def refresh_project_funnels(full=False):
+    """Beat task: recompute the funnel rollups of recent days, or of every day if `full` (qr.funnel)"""
+    try:
+        rows = refresh_funnels() if full else refresh_recent_funnels()
+        return {'success': True, 'rows': rows}
+        
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Failed to refresh project funnels: {str(e)}")
+        
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
 def update_qr_card_statuses(batch):
     """Update QR card statuses after photo processing"""
     try:
@@ -375,21 +623,22 @@ def update_qr_card_statuses(batch):
             raw_source_photos__assigned_qr_card__isnull=False
         ).distinct()
         
+        # Completed cards with new photos go back to be delivered again
+        from_statuses = [status for status, _ in QRCard.STATUS_CHOICES if status != 'photos_uploaded']
         for qr_card in qr_cards_with_photos:
             if qr_card.photos.exists():
-                qr_card.status = 'photos_uploaded'
-                qr_card.photos_uploaded_at = timezone.now()
-                qr_card.save()
+                counters.change_card_status(
+                    qr_card, 'photos_uploaded', from_statuses, photos_uploaded_at=timezone.now()
+                )
                 
     except Exception as e:
         logging.getLogger(__name__).error(f"Error updating QR card statuses for batch {batch.id}: {str(e)}")
 
 
-def extract_exif_datetime(image_field):
-    """Extract datetime from EXIF data"""
+def read_exif_datetime(file_obj):
+    """EXIF DateTime of an open image; for JPEGs the segments before the image data are enough"""
     try:
-        image_field.open()
-        image = Image.open(image_field)
+        image = Image.open(file_obj)
         exif = image.getexif()
         
         if exif:
@@ -397,9 +646,20 @@ def extract_exif_datetime(image_field):
                 tag = ExifTags.TAGS.get(tag_id, tag_id)
                 if tag == 'DateTime':
                     return datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+        return None
         
-        image_field.close()
+    except Exception:
         return None
+
+
+def extract_exif_datetime(image_field):
+    """Extract datetime from EXIF data"""
+    try:
+        image_field.open()
+        try:
+            return read_exif_datetime(image_field)
+        finally:
+            image_field.close()
         
     except Exception:
         return None
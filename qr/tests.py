@@ -1,3 +1,1755 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from botocore.exceptions import ClientError
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, InMemoryStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import models
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from projects.models import Project
+from . import counters
+from .models import PhotoFingerprint, PhotoUploadBatch, QRCard, QRCardBatch, QRCardPhoto, RawPhotoUpload
+from .tasks import start_analysis_when_uploaded
+from .upload_handlers import (
+    LocalFileWriter, S3MultipartWriter, StoredUploadedFile, discard_upload, save_uploads
+)
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+def load_event(name):
+    with open(os.path.join(TEST_DATA_DIR, name)) as f:
+        return json.load(f)
+
+
+class FakeEngine:
+    """Decoder engine that returns canned payloads, or raises them if they are an exception"""
+
+    def __init__(self, name, payloads):
+        self.name = name
+        self.payloads = payloads
+        self.calls = 0
+
+    def decode(self, gray):
+        self.calls += 1
+        if isinstance(self.payloads, Exception):
+            raise self.payloads
+        return self.payloads
+
+
+class DecoderEngineTests(TestCase):
+
+    def tearDown(self):
+        from .decoders import get_engines
+        get_engines.cache_clear()
+
+    def test_stops_at_first_engine_with_payloads(self):
+        from .decoders import decode_qr_payloads
+        fast, slow = FakeEngine('fast', ['card-1']), FakeEngine('slow', ['card-2'])
+
+        self.assertEqual(decode_qr_payloads(None, [fast, slow]), ['card-1'])
+        self.assertEqual(slow.calls, 0)
+
+    def test_falls_back_on_misses_and_errors(self):
+        from .decoders import decode_qr_payloads
+        engines = [FakeEngine('miss', []), FakeEngine('broken', RuntimeError('bad image')), FakeEngine('robust', ['card-1'])]
+
+        self.assertEqual(decode_qr_payloads(None, engines), ['card-1'])
+        self.assertEqual([engine.calls for engine in engines], [1, 1, 1])
+        self.assertEqual(decode_qr_payloads(None, engines[:2]), [])
+
+    def test_order_from_settings_then_saved_file(self):
+        import tempfile
+        from .decoders import get_engines, save_engine_order
+
+        with tempfile.TemporaryDirectory() as directory:
+            order_file = os.path.join(directory, 'order.json')
+            with override_settings(QR_DECODER_ORDER_FILE=order_file):
+                self.assertEqual([e.name for e in get_engines()][-2:], ['opencv', 'opencv_multi'])
+
+                save_engine_order(['opencv_multi', 'no-such-engine', 'opencv'])
+                self.assertEqual([e.name for e in get_engines()], ['opencv_multi', 'opencv'])
+
+                with override_settings(QR_DECODER_ENGINES=['opencv']):
+                    get_engines.cache_clear()
+                    self.assertEqual([e.name for e in get_engines()], ['opencv'])
+
+    @override_settings(QR_DECODER_ENGINES=['no-such-engine'])
+    def test_unusable_order_falls_back_to_opencv(self):
+        from .decoders import get_engines
+        get_engines.cache_clear()
+        self.assertEqual([e.name for e in get_engines()], ['opencv'])
+
+    def test_opencv_decodes_a_generated_code(self):
+        import numpy
+        import qrcode
+        from .decoders import OpenCVEngine
+
+        image = qrcode.make('https://spotshot.example/c/3f2a9c1e', box_size=8).get_image().convert('L')
+        self.assertEqual(OpenCVEngine().decode(numpy.array(image)), ['https://spotshot.example/c/3f2a9c1e'])
+
+
+class PhotoCacheTests(TestCase):
+
+    def setUp(self):
+        import tempfile
+        from .photo_cache import PhotoCache
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = InMemoryStorage()
+        for name in ('raw/a.jpg', 'raw/b.jpg', 'raw/c.jpg', 'raw/d.jpg'):
+            self.storage.save(name, io.BytesIO(b'x' * 100))
+        self.cache = PhotoCache(directory.name, max_bytes=350, mmap_threshold=150)
+
+    def cached_files(self):
+        return sorted(path for _, path, _ in self.cache._scan())
+
+    def test_least_recently_used_is_evicted(self):
+        paths = {name: self.cache.get_path(f'raw/{name}.jpg', self.storage) for name in 'abc'}
+        # a was read first but used again most recently, so b is the oldest entry
+        for age, name in enumerate('bca'):
+            os.utime(paths[name], (1000 + age, 1000 + age))
+
+        self.cache.get_path('raw/d.jpg', self.storage)
+
+        self.assertFalse(os.path.exists(paths['b']))
+        self.assertTrue(all(os.path.exists(paths[name]) for name in 'ac'))
+        with self.cache.open_buffer('raw/a.jpg', self.storage) as buffer:
+            self.assertEqual(bytes(buffer), b'x' * 100)
+        self.assertEqual(
+            {key: self.cache.stats()[key] for key in ('hits', 'misses', 'evictions', 'bytes')},
+            {'hits': 1, 'misses': 4, 'evictions': 1, 'bytes': 300}
+        )
+
+    def test_failed_download_leaves_no_partial_file(self):
+        def chunks():
+            yield b'x' * 50
+            raise OSError('connection reset')
+
+        broken = mock.MagicMock()
+        broken.__enter__.return_value.chunks.side_effect = chunks
+        with mock.patch.object(self.storage, 'open', return_value=broken):
+            with self.assertRaises(OSError):
+                self.cache.get_path('raw/a.jpg', self.storage)
+
+        self.assertEqual(self.cached_files(), [])
+        self.assertEqual([name for _, _, files in os.walk(self.cache.directory) for name in files], [])
+        with self.cache.open_file('raw/a.jpg', self.storage) as f:
+            self.assertEqual(f.read(), b'x' * 100)
+
+
+def jpeg_bytes(size=(3000, 2000), orientation=None):
+    """JPEG whose left half is red and right half blue, with an optional EXIF orientation"""
+    from PIL import Image
+    image = Image.new('RGB', size, (0, 0, 255))
+    image.paste((255, 0, 0), (0, 0, size[0] // 2, size[1]))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+class DerivativeTests(TestCase):
+
+    def test_oriented_preview_and_thumbnail_next_to_original(self):
+        from PIL import Image
+        from .derivatives import PREVIEW_SIZE, THUMBNAIL_SIZE, generate_derivatives
+
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        qr_card = QRCard.objects.create(project=Project.objects.create(user=user, name='Beach day'), code='card-1')
+        storage = InMemoryStorage()
+        with mock.patch.object(QRCardPhoto._meta.get_field('image'), 'storage', storage):
+            # Orientation 6: the camera was turned, so the stored landscape frame shows as portrait
+            name = storage.save('qr_photos/IMG_0001.jpg', io.BytesIO(jpeg_bytes(orientation=6)))
+            photo = QRCardPhoto.objects.create(qr_card=qr_card, image=name, original_filename='IMG_0001.jpg', file_size=1)
+
+            generate_derivatives(photo)
+
+            self.assertTrue(photo.is_processed)
+            self.assertTrue(photo.preview.name.startswith('qr_photos/IMG_0001_preview.'))
+            self.assertTrue(photo.thumbnail.name.startswith('qr_photos/IMG_0001_thumb.'))
+            with storage.open(photo.preview.name) as f:
+                preview = Image.open(f)
+                preview.load()
+            with storage.open(photo.thumbnail.name) as f:
+                thumbnail = Image.open(f)
+                thumbnail.load()
+
+        for image, size in ((preview, PREVIEW_SIZE), (thumbnail, THUMBNAIL_SIZE)):
+            self.assertEqual(image.height, size)
+            self.assertAlmostEqual(image.width, size * 2 / 3, delta=1)
+        # Rotated a quarter turn clockwise: the red left half is now on top
+        red, _, blue = preview.convert('RGB').getpixel((preview.width // 2, 10))
+        self.assertGreater(red, 200)
+        self.assertLess(blue, 50)
+        self.assertNotIn('exif', preview.info)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PhotoZipDownloadTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.qr_card = QRCard.objects.create(
+            project=Project.objects.create(user=user, name='Beach day'), code='card-1', access_pin='1234'
+        )
+        self.storage = InMemoryStorage()
+        patch = mock.patch.object(QRCardPhoto._meta.get_field('image'), 'storage', self.storage)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.originals = {}
+        for i, filename in enumerate(['IMG_0001.jpg', 'IMG_0001.jpg', 'IMG_0002.jpg']):
+            data = os.urandom(3000 + i)
+            name = self.storage.save(f'qr_photos/{i}.jpg', io.BytesIO(data))
+            QRCardPhoto.objects.create(qr_card=self.qr_card, image=name, original_filename=filename, file_size=len(data))
+            self.originals[name] = data
+
+    def test_stored_entries_stream_as_a_valid_zip(self):
+        import zipfile
+        from .downloads import stream_photos_zip
+
+        photos = self.qr_card.photos.order_by('id')
+        chunks = list(stream_photos_zip(photos, chunk_size=1024))
+        # Written out a piece at a time, never the whole archive at once
+        self.assertLess(max(len(chunk) for chunk in chunks), 1024 + 200)
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['IMG_0001.jpg', 'IMG_0001 (2).jpg', 'IMG_0002.jpg'])
+            self.assertEqual({info.compress_type for info in archive.infolist()}, {zipfile.ZIP_STORED})
+            self.assertEqual(
+                [archive.read(name) for name in archive.namelist()],
+                [self.originals[photo.image.name] for photo in photos]
+            )
+
+    def test_download_requires_the_pin(self):
+        import zipfile
+        url = f'/api/client/{self.qr_card.code}/download/'
+
+        self.assertEqual(self.client.get(url, {'pin': '0000'}).status_code, 404)
+        response = self.client.get(url, {'pin': '1234'})
+
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+
+
+def mandelbrot_jpeg(extent=(-2, -1.2, 1, 1.2), resize=None, quality=90):
+    from PIL import Image
+    image = Image.effect_mandelbrot((640, 480), extent, 64).convert('RGB')
+    if resize:
+        image = image.resize(resize)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    buffer.seek(0)
+    return buffer
+
+
+class PhotoFingerprintTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=user, name='Beach day')
+        self.batch = PhotoUploadBatch.objects.create(project=self.project)
+
+    def raw_photo(self, name):
+        return RawPhotoUpload.objects.create(batch=self.batch, image=f'raw/{name}', original_filename=name, file_size=1)
+
+    def test_re_encoded_copy_is_a_near_duplicate(self):
+        from .fingerprints import NEAR_DUPLICATE_DISTANCE, hamming_distance, perceptual_hash
+
+        original = perceptual_hash(mandelbrot_jpeg())
+        smaller = perceptual_hash(mandelbrot_jpeg(resize=(320, 240), quality=60))
+        different = perceptual_hash(mandelbrot_jpeg(extent=(-0.8, 0, 0.2, 0.8)))
+
+        self.assertLessEqual(hamming_distance(original, smaller), NEAR_DUPLICATE_DISTANCE)
+        self.assertGreater(hamming_distance(original, different), NEAR_DUPLICATE_DISTANCE)
+
+    def test_register_flags_exact_and_near_duplicates(self):
+        from .fingerprints import NearDuplicateIndex, find_exact_duplicates, fingerprint_file, register_fingerprint
+
+        near_index = NearDuplicateIndex.for_project(self.project)
+        first, copy, resized = self.raw_photo('a.jpg'), self.raw_photo('b.jpg'), self.raw_photo('c.jpg')
+        sha256, phash = fingerprint_file(mandelbrot_jpeg())
+
+        self.assertFalse(register_fingerprint(first, self.project, sha256, phash, near_index))
+        self.assertTrue(register_fingerprint(copy, self.project, sha256, phash, near_index))
+        self.assertEqual(copy.duplicate_of_id, first.id)
+
+        self.assertFalse(register_fingerprint(resized, self.project, *fingerprint_file(mandelbrot_jpeg(resize=(320, 240))), near_index))
+        self.assertEqual(resized.near_duplicate_of_id, first.id)
+        self.assertIsNone(resized.duplicate_of_id)
+
+        self.assertEqual(find_exact_duplicates(self.project, [sha256, '0' * 64]), {sha256: first.id})
+        other_project = Project.objects.create(user=self.project.user, name='Other')
+        self.assertEqual(find_exact_duplicates(other_project, [sha256]), {})
+
+
+@override_settings(AWS_ACCESS_KEY_ID='AKIDEXAMPLE', AWS_SECRET_ACCESS_KEY='wJalrXUtnFEMI/K7MDENG', AWS_S3_REGION_NAME='eu-central-1')
+class PutPresignerTests(TestCase):
+    keys = [
+        'qr_photos/2026/10/19/1/7/3f2a9c1e_IMG_0001.jpg',
+        'qr_photos/2026/10/19/1/7/8b7e6d5c_IMG 0002 (copy).JPG',
+        'qr_photos/2026/10/19/1/7/0c1d2e3f_Plaża+słońce~&=.heic',
+    ]
+
+    def assertMatchesBotocore(self):
+        from datetime import datetime
+        from .s3 import PutPresigner, build_s3_client
+
+        client = build_s3_client()
+        with mock.patch('botocore.auth.get_current_datetime', return_value=datetime(2026, 10, 19, 9, 15)):
+            presigner = PutPresigner('spotshot', expires_in=900, client=client)
+            for key in self.keys:
+                with self.subTest(key=key):
+                    self.assertEqual(
+                        presigner.url(key, 'image/jpeg'),
+                        client.generate_presigned_url(
+                            'put_object', Params={'Bucket': 'spotshot', 'Key': key, 'ContentType': 'image/jpeg'},
+                            ExpiresIn=900
+                        )
+                    )
+
+    def test_aws_urls_match_botocore(self):
+        self.assertMatchesBotocore()
+
+    @override_settings(AWS_S3_ENDPOINT_URL='http://minio:9000')
+    def test_path_style_endpoint_urls_match_botocore(self):
+        self.assertMatchesBotocore()
+
+
+@override_settings(AWS_STORAGE_BUCKET_NAME='spotshot', MULTIPART_UPLOAD_THRESHOLD=64 * 1024 * 1024)
+class DirectUploadTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=self.user, name='Beach day')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def generate(self, files, **data):
+        return self.client.post(
+            '/api/upload/generate_upload_urls/', {'project_id': self.project.id, 'files': files, **data}, format='json'
+        )
+
+    def test_rejects_sizes_that_are_not_byte_counts(self):
+        for size in ('12MB', -1, [1]):
+            with self.subTest(size=size):
+                response = self.generate([{'filename': 'IMG_0001.jpg', 'content_type': 'image/jpeg', 'size': size}])
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(PhotoUploadBatch.objects.exists())
+
+    @override_settings(MULTIPART_UPLOAD_PART_SIZE=16 * 1024 * 1024)
+    def test_part_size_grows_to_stay_under_the_part_limit(self):
+        from .s3 import MAX_PARTS, multipart_part_count, multipart_part_size
+        MiB = 1024 * 1024
+
+        self.assertEqual(multipart_part_size(100 * MiB), 16 * MiB)
+        self.assertEqual(multipart_part_count(100 * MiB, 16 * MiB), 7)
+        self.assertEqual(multipart_part_count(0, 16 * MiB), 1)
+        with override_settings(MULTIPART_UPLOAD_PART_SIZE=MiB):
+            # S3 rejects parts under 5MiB
+            self.assertEqual(multipart_part_size(100 * MiB), 5 * MiB)
+        huge = 200 * 1024 * MiB
+        part_size = multipart_part_size(huge)
+        self.assertGreater(part_size, 16 * MiB)
+        self.assertEqual(multipart_part_count(huge, part_size), MAX_PARTS)
+
+    @override_settings(
+        AWS_ACCESS_KEY_ID='AKIDEXAMPLE', AWS_SECRET_ACCESS_KEY='wJalrXUtnFEMI/K7MDENG', AWS_S3_REGION_NAME='eu-central-1',
+        MULTIPART_UPLOAD_PART_SIZE=16 * 1024 * 1024
+    )
+    def test_large_files_get_presigned_parts(self):
+        from urllib.parse import parse_qs, urlsplit
+        from .s3 import get_s3_client, reset_s3_client
+
+        reset_s3_client()
+        self.addCleanup(reset_s3_client)
+        with mock.patch.object(get_s3_client(), 'create_multipart_upload', return_value={'UploadId': 'upload-1'}) as create:
+            response = self.generate([
+                {'filename': 'IMG_0001.jpg', 'content_type': 'image/jpeg', 'size': 9000000},
+                {'filename': 'DSC_4410.tif', 'content_type': 'image/tiff', 'size': '100000000'},
+            ])
+
+        self.assertEqual(response.status_code, 200)
+        jpeg, tiff = response.data['upload_urls']
+        self.assertIn('upload_url', jpeg)
+        self.assertNotIn('multipart', jpeg)
+        create.assert_called_once_with(Bucket='spotshot', Key=tiff['s3_key'], ContentType='image/tiff')
+        multipart = tiff['multipart']
+        self.assertEqual((multipart['upload_id'], multipart['part_size']), ('upload-1', 16 * 1024 * 1024))
+        self.assertEqual([part['part_number'] for part in multipart['parts']], list(range(1, 7)))
+        query = parse_qs(urlsplit(multipart['parts'][5]['upload_url']).query)
+        self.assertEqual((query['partNumber'], query['uploadId']), (['6'], ['upload-1']))
+        raw_photo = RawPhotoUpload.objects.get(id=tiff['photo_id'])
+        self.assertEqual((raw_photo.file_size, raw_photo.multipart_upload_id), (100000000, 'upload-1'))
+
+    @override_settings(AWS_ACCESS_KEY_ID='AKIDEXAMPLE', AWS_SECRET_ACCESS_KEY='wJalrXUtnFEMI/K7MDENG', AWS_S3_REGION_NAME='eu-central-1')
+    def test_failed_multipart_start_aborts_the_ones_already_started(self):
+        from .s3 import get_s3_client, reset_s3_client
+
+        reset_s3_client()
+        self.addCleanup(reset_s3_client)
+        client = get_s3_client()
+        throttled = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Reduce your request rate'}}, 'CreateMultipartUpload')
+        with mock.patch.object(client, 'create_multipart_upload', side_effect=[{'UploadId': 'upload-1'}, throttled]), \
+                mock.patch.object(client, 'abort_multipart_upload') as abort:
+            response = self.generate([
+                {'filename': f'DSC_{i}.tif', 'content_type': 'image/tiff', 'size': 100000000} for i in range(3)
+            ])
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(abort.call_count, 1)
+        self.assertEqual(abort.call_args.kwargs['UploadId'], 'upload-1')
+        self.assertFalse(PhotoUploadBatch.objects.exists())
+        self.assertFalse(RawPhotoUpload.objects.exists())
+
+
+    @override_settings(AWS_ACCESS_KEY_ID='AKIDEXAMPLE', AWS_SECRET_ACCESS_KEY='wJalrXUtnFEMI/K7MDENG', AWS_S3_REGION_NAME='eu-central-1')
+    def test_duplicates_stay_in_the_batch_without_uploads(self):
+        earlier = PhotoUploadBatch.objects.create(project=self.project, status='completed')
+        original = RawPhotoUpload.objects.create(
+            batch=earlier, image='qr_photos/earlier/IMG_0001.jpg', original_filename='IMG_0001.jpg', file_size=1000,
+            has_qr_code=True, qr_code_data='https://spotshot.example/client/card-1', decoded_at=timezone.now(),
+            taken_at=timezone.now(), content_hash='a' * 64
+        )
+        PhotoFingerprint.objects.create(project=self.project, raw_photo=original, content_hash='a' * 64)
+
+        response = self.generate([
+            {'filename': 'IMG_0001 copy.jpg', 'content_type': 'image/jpeg', 'size': 1000, 'sha256': 'A' * 64},
+            {'filename': 'IMG_0002.jpg', 'content_type': 'image/jpeg', 'size': 1000, 'sha256': 'b' * 64},
+            {'filename': 'IMG_0002 copy.jpg', 'content_type': 'image/jpeg', 'size': 1000, 'sha256': 'b' * 64},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([upload['filename'] for upload in response.data['upload_urls']], ['IMG_0002.jpg'])
+        known, repeat = RawPhotoUpload.objects.filter(id__in=[d['photo_id'] for d in response.data['duplicates']]).order_by('id')
+        self.assertEqual((known.duplicate_of, known.image.name), (original, original.image.name))
+        self.assertEqual((known.has_qr_code, known.taken_at), (True, original.taken_at))
+        self.assertIsNotNone(known.decoded_at)
+        first_copy = RawPhotoUpload.objects.get(id=response.data['upload_urls'][0]['photo_id'])
+        self.assertEqual((repeat.duplicate_of, repeat.s3_key, repeat.image.name), (first_copy, first_copy.s3_key, ''))
+        self.assertEqual(PhotoUploadBatch.objects.get(id=response.data['batch_id']).total_photos, 3)
+
+
+@override_settings(AWS_STORAGE_BUCKET_NAME='spotshot')
+class ConfirmUploadsTests(TestCase):
+
+    def setUp(self):
+        from .views import batch_s3_prefix
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        project = Project.objects.create(user=self.user, name='Beach day')
+        self.batch = PhotoUploadBatch.objects.create(project=project, status='uploading')
+        self.prefix = batch_s3_prefix(self.batch)
+        self.raw_photos = RawPhotoUpload.objects.bulk_create(
+            RawPhotoUpload(batch=self.batch, original_filename=f'IMG_{i}.jpg', file_size=1000, s3_key=f'{self.prefix}{i}.jpg')
+            for i in range(25)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patch = mock.patch('qr.tasks.analyze_photo_batch_for_qr_codes.delay')
+        self.delay = patch.start()
+        self.addCleanup(patch.stop)
+        patch = mock.patch('qr.views.decode_raw_photo.delay')
+        self.decode = patch.start()
+        self.addCleanup(patch.stop)
+
+    def s3_listing(self, keys):
+        """Fake client whose prefix listing returns `keys` (2,000 bytes each) in pages of 10"""
+        contents = [{'Key': key, 'Size': 2000} for key in keys] + [{'Key': f'{self.prefix}stray.jpg', 'Size': 1}]
+        client = mock.Mock()
+        client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': contents[i:i + 10]} for i in range(0, len(contents), 10)
+        ]
+        return client
+
+    def confirm(self, photo_ids):
+        return self.client.post(
+            '/api/upload/confirm_uploads/', {'batch_id': self.batch.id, 'completed_uploads': photo_ids}, format='json'
+        )
+
+    def test_one_prefix_listing_verifies_the_batch(self):
+        arrived = self.raw_photos[:23]
+        client = self.s3_listing([raw_photo.s3_key for raw_photo in arrived])
+
+        with mock.patch('qr.s3.get_s3_client', return_value=client), self.assertNumQueries(11):
+            response = self.confirm([raw_photo.id for raw_photo in self.raw_photos])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['successful_uploads'], 23)
+        client.get_paginator.assert_called_once_with('list_objects_v2')
+        client.get_paginator.return_value.paginate.assert_called_once_with(Bucket='spotshot', Prefix=self.prefix)
+        client.head_object.assert_not_called()
+
+        confirmed = RawPhotoUpload.objects.filter(batch=self.batch, processing_error__isnull=True)
+        self.assertEqual(confirmed.count(), 23)
+        self.assertTrue(all(photo.image.name == photo.s3_key and photo.file_size == 2000 for photo in confirmed))
+        self.assertEqual(
+            set(RawPhotoUpload.objects.filter(processing_error__isnull=False).values_list('id', flat=True)),
+            {raw_photo.id for raw_photo in self.raw_photos[23:]}
+        )
+        # Decoded first, like photos announced by storage events
+        self.assertCountEqual([call.args[0] for call in self.decode.call_args_list], [photo.id for photo in arrived])
+        self.assertFalse(response.data['analysis_started'])
+        self.delay.assert_not_called()
+
+    def test_repeated_confirm_decodes_each_photo_once(self):
+        client = self.s3_listing([raw_photo.s3_key for raw_photo in self.raw_photos])
+        photo_ids = [raw_photo.id for raw_photo in self.raw_photos]
+
+        with mock.patch('qr.s3.get_s3_client', return_value=client):
+            first = self.confirm(photo_ids)
+            second = self.confirm(photo_ids)
+
+        self.assertEqual((first.data['decoding'], second.data['decoding']), (25, 0))
+        self.assertEqual(self.decode.call_count, 25)
+
+        RawPhotoUpload.objects.filter(batch=self.batch).update(decoded_at=timezone.now())
+        with mock.patch('qr.s3.get_s3_client', return_value=client):
+            third = self.confirm(photo_ids)
+
+        self.assertTrue(third.data['analysis_started'])
+        self.delay.assert_called_once_with(self.batch.id)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, 'analyzing')
+
+    def test_unconfirmed_uploads_do_not_hold_the_batch(self):
+        RawPhotoUpload.objects.filter(id=self.raw_photos[0].id).update(
+            image=self.raw_photos[0].s3_key, decoded_at=timezone.now()
+        )
+        client = mock.Mock()
+        client.head_object.return_value = {'ContentLength': 1000}
+
+        with mock.patch('qr.s3.get_s3_client', return_value=client):
+            response = self.confirm([self.raw_photos[0].id])
+
+        self.assertEqual(response.data['decoding'], 0)
+        self.assertTrue(response.data['analysis_started'])
+        self.assertEqual(
+            RawPhotoUpload.objects.filter(batch=self.batch, processing_error='Upload not confirmed').count(), 24
+        )
+
+    def test_few_keys_are_checked_with_heads(self):
+        client = mock.Mock()
+        client.head_object.side_effect = lambda Bucket, Key: (
+            {'ContentLength': 1000} if Key.endswith('0.jpg')
+            else (_ for _ in ()).throw(ClientError({'Error': {'Code': '404'}}, 'HeadObject'))
+        )
+
+        with mock.patch('qr.s3.get_s3_client', return_value=client):
+            response = self.confirm([self.raw_photos[0].id, self.raw_photos[1].id])
+
+        self.assertEqual(response.data['successful_uploads'], 1)
+        client.get_paginator.assert_not_called()
+        self.assertEqual(client.head_object.call_count, 2)
+
+
+@override_settings(STORAGE_WEBHOOK_TOKEN='webhook-secret', AWS_STORAGE_BUCKET_NAME='spotshot')
+class StorageEventWebhookTests(TestCase):
+    url = '/api/storage-events/'
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        project = Project.objects.create(user=user, name='Beach day')
+        self.batch = PhotoUploadBatch.objects.create(project=project, name='Morning', status='uploading')
+        self.jpeg = RawPhotoUpload.objects.create(
+            batch=self.batch, original_filename='IMG 0001.jpg', file_size=0,
+            s3_key='qr_photos/2026/10/19/1/1/3f2a9c1e_IMG 0001.jpg'
+        )
+        self.tiff = RawPhotoUpload.objects.create(
+            batch=self.batch, original_filename='DSC_4410.tif', file_size=0,
+            s3_key='qr_photos/2026/10/19/1/1/8b7e6d5c_DSC_4410.tif', multipart_upload_id='upload-1'
+        )
+        self.event = load_event('minio_object_created_event.json')
+        self.client = APIClient()
+
+    def post(self, payload, **extra):
+        extra.setdefault('HTTP_AUTHORIZATION', 'Bearer webhook-secret')
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json', **extra)
+
+    @mock.patch('qr.storage_events.decode_raw_photo.delay')
+    def test_recorded_event_marks_uploads_and_queues_decoding(self, delay):
+        response = self.post(self.event)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'records': 3, 'ingested': 2, 'ignored': 1})
+        self.jpeg.refresh_from_db()
+        self.tiff.refresh_from_db()
+        self.assertEqual(self.jpeg.image.name, self.jpeg.s3_key)
+        self.assertEqual(self.jpeg.file_size, 8734215)
+        self.assertEqual(self.tiff.file_size, 96468992)
+        self.assertIsNone(self.tiff.multipart_upload_id)
+        self.assertCountEqual([call.args[0] for call in delay.call_args_list], [self.jpeg.id, self.tiff.id])
+
+    @mock.patch('qr.storage_events.decode_raw_photo.delay')
+    def test_redelivered_event_is_a_noop(self, delay):
+        self.post(self.event)
+        response = self.post(self.event)
+
+        self.assertEqual(response.data['ingested'], 0)
+        self.assertEqual(delay.call_count, 2)
+
+    @mock.patch('qr.storage_events.decode_raw_photo.delay')
+    def test_sns_envelope_with_query_token(self, delay):
+        envelope = {'Type': 'Notification', 'Message': json.dumps(self.event)}
+        response = self.client.post(
+            f'{self.url}?token=webhook-secret', json.dumps(envelope), content_type='text/plain'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ingested'], 2)
+
+    @mock.patch('qr.storage_events.decode_raw_photo.delay')
+    def test_rejects_wrong_token(self, delay):
+        response = self.post(self.event, HTTP_AUTHORIZATION='Bearer nope')
+
+        self.assertEqual(response.status_code, 403)
+        delay.assert_not_called()
+        self.jpeg.refresh_from_db()
+        self.assertFalse(self.jpeg.image)
+
+    @mock.patch('qr.tasks.analyze_photo_batch_for_qr_codes.delay')
+    def test_analysis_starts_once_last_upload_is_decoded(self, delay):
+        RawPhotoUpload.objects.filter(id=self.jpeg.id).update(image=self.jpeg.s3_key, decoded_at='2026-10-19T09:15:00Z')
+        self.assertFalse(start_analysis_when_uploaded(self.batch.id))
+
+        RawPhotoUpload.objects.filter(id=self.tiff.id).update(image=self.tiff.s3_key, decoded_at='2026-10-19T09:15:01Z')
+        self.assertTrue(start_analysis_when_uploaded(self.batch.id))
+        self.assertFalse(start_analysis_when_uploaded(self.batch.id))
+
+        delay.assert_called_once_with(self.batch.id)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, 'analyzing')
+
+    def age_batch(self, hours):
+        past = timezone.now() - timedelta(hours=hours)
+        PhotoUploadBatch.objects.filter(id=self.batch.id).update(created_at=past)
+        RawPhotoUpload.objects.filter(batch=self.batch).update(uploaded_at=past, updated_at=past)
+
+    @mock.patch('qr.tasks.abort_multipart_uploads')
+    @mock.patch('qr.tasks.analyze_photo_batch_for_qr_codes.delay')
+    def test_sweeper_fails_uploads_that_never_arrived(self, delay, abort):
+        from .tasks import expire_stale_uploads
+        RawPhotoUpload.objects.filter(id=self.jpeg.id).update(image=self.jpeg.s3_key, decoded_at='2026-10-19T09:15:00Z')
+
+        self.age_batch(hours=1)
+        self.assertEqual(expire_stale_uploads()['expired'], 0)
+
+        self.age_batch(hours=7)
+        self.assertEqual(expire_stale_uploads(), {'success': True, 'expired': 1, 'analysis_started': 1, 'failed': 0})
+
+        abort.assert_called_once_with('spotshot', [(self.tiff.s3_key, 'upload-1')])
+        self.tiff.refresh_from_db()
+        self.assertEqual(self.tiff.processing_error, 'Upload never arrived')
+        self.assertIsNone(self.tiff.multipart_upload_id)
+        delay.assert_called_once_with(self.batch.id)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, 'analyzing')
+
+    @mock.patch('qr.tasks.abort_multipart_uploads')
+    @mock.patch('qr.tasks.analyze_photo_batch_for_qr_codes.delay')
+    def test_sweeper_fails_batch_with_nothing_uploaded(self, delay, abort):
+        from .tasks import expire_stale_uploads
+        self.age_batch(hours=7)
+
+        self.assertEqual(expire_stale_uploads()['failed'], 1)
+
+        delay.assert_not_called()
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, 'failed')
+
+
+class FakeS3Client:
+    """Records the calls of an S3MultipartWriter; the method named by `fail` raises"""
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.calls = []
+
+    def __getattr__(self, method):
+        def call(**kwargs):
+            self.calls.append((method, kwargs))
+            if method == self.fail:
+                raise ClientError({'Error': {'Code': 'InternalError'}}, method)
+            return {'UploadId': 'upload-1', 'ETag': f'"etag-{len(self.calls)}"'}
+        return call
+
+    def methods(self):
+        return [method for method, _ in self.calls]
+
+
+class StreamingUploadTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.storage = FileSystemStorage(location=media)
+        storage_patch = mock.patch.object(RawPhotoUpload._meta.get_field('image'), 'storage', self.storage)
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+        delay_patch = mock.patch('qr.views.analyze_photo_batch_for_qr_codes.delay')
+        delay_patch.start().return_value.id = 'task-1'
+        self.addCleanup(delay_patch.stop)
+
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=self.user, name='Beach day')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.storage.location)
+            for root, _, names in os.walk(self.storage.location) for name in names
+        )
+
+    def photo(self, name='IMG_0001.jpg', size=(64, 48)):
+        return SimpleUploadedFile(name, jpeg_bytes(size), content_type='image/jpeg')
+
+    def upload(self, photos, project=None, **data):
+        project = project or self.project
+        return self.client.post(
+            f'/api/photo-batches/upload_photos/?project={project.id}', {'photos': photos, **data}, format='multipart'
+        )
+
+    def s3_writer(self, client, part_size):
+        from storages.backends.s3 import S3Storage
+        storage = S3Storage(
+            bucket_name='spotshot-test', access_key='AKIDEXAMPLE', secret_key='secret', region_name='us-east-1'
+        )
+        storage._bucket = mock.Mock(**{'meta.client': client})
+        storage._bucket.name = storage.bucket_name
+        with override_settings(UPLOAD_STREAM_PART_SIZE=part_size):
+            return S3MultipartWriter(storage, 'raw_photos/IMG_0001.jpg', 'image/jpeg')
+
+    def test_local_writer_claims_a_name_and_aborts_cleanly(self):
+        writer = LocalFileWriter(self.storage, 'raw_photos/IMG_0001.jpg', 'image/jpeg')
+        other = LocalFileWriter(self.storage, 'raw_photos/IMG_0001.jpg', 'image/jpeg')
+        writer.write(b'abc')
+        writer.write(b'def')
+        name = writer.close()
+        other.write(b'partial')
+        other.abort()
+
+        self.assertNotEqual(other.name, name)
+        self.assertEqual(self.stored_files(), [name])
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'abcdef')
+
+    def test_s3_writer_uploads_parts_then_completes(self):
+        client = FakeS3Client()
+        writer = self.s3_writer(client, part_size=4)
+        for chunk in (b'abc', b'defg', b'hi'):
+            writer.write(chunk)
+        writer.close()
+        writer.finish()
+
+        self.assertEqual(
+            client.methods(), ['create_multipart_upload', 'upload_part', 'upload_part', 'complete_multipart_upload']
+        )
+        self.assertEqual([kwargs['Body'] for method, kwargs in client.calls if method == 'upload_part'], [b'abcdefg', b'hi'])
+        self.assertEqual(client.calls[0][1]['ContentType'], 'image/jpeg')
+        self.assertEqual([part['PartNumber'] for part in client.calls[-1][1]['MultipartUpload']['Parts']], [1, 2])
+
+    def test_s3_writer_sends_small_files_in_one_put(self):
+        client = FakeS3Client()
+        writer = self.s3_writer(client, part_size=1024)
+        writer.write(b'abc')
+        writer.close()
+        writer.finish()
+
+        self.assertEqual(client.methods(), ['put_object'])
+        self.assertEqual(client.calls[0][1]['Body'], b'abc')
+
+    def test_s3_writer_aborts_when_a_part_or_the_completion_fails(self):
+        for failing in ('upload_part', 'complete_multipart_upload'):
+            with self.subTest(failing=failing):
+                client = FakeS3Client(fail=failing)
+                writer = self.s3_writer(client, part_size=4)
+                with self.assertRaises(ClientError):
+                    writer.write(b'abcdefgh')
+                    writer.close()
+                    writer.finish()
+                # Again from the handler's upload_interrupted(): nothing left to abort
+                writer.abort()
+
+                self.assertEqual(client.methods()[-1], 'abort_multipart_upload')
+                self.assertEqual(client.methods().count('abort_multipart_upload'), 1)
+
+    def test_discard_upload_deletes_the_stored_file_once(self):
+        name = self.storage.save('raw_photos/IMG_0001.jpg', ContentFile(b'abc'))
+        upload = StoredUploadedFile(self.storage, name, 'IMG_0001.jpg', 'image/jpeg', 3, None, {}, 'hash', b'abc')
+
+        discard_upload(upload)
+        discard_upload(upload)
+        discard_upload(self.photo())
+
+        self.assertEqual(self.stored_files(), [])
+
+    def test_wrong_project_is_rejected_before_anything_is_stored(self):
+        someone_else = get_user_model().objects.create_user(username='someone-else', password='x')
+        project = Project.objects.create(user=someone_else, name='Not yours')
+
+        response = self.upload([self.photo()], project=project)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(PhotoUploadBatch.objects.exists())
+
+    def test_streamed_duplicates_share_the_stored_original(self):
+        response = self.upload([self.photo('IMG_0001.jpg'), self.photo('IMG_0002.jpg'), self.photo('IMG_0003.jpg', (32, 32))])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['photos_uploaded'], 3)
+        original, duplicate = RawPhotoUpload.objects.filter(original_filename__in=['IMG_0001.jpg', 'IMG_0002.jpg']).order_by('id')
+        self.assertEqual(
+            response.data['duplicates'], [{'photo_id': duplicate.id, 'filename': 'IMG_0002.jpg', 'duplicate_of': original.id}]
+        )
+        self.assertEqual(duplicate.image.name, original.image.name)
+        names = sorted(set(RawPhotoUpload.objects.values_list('image', flat=True)))
+        self.assertEqual(len(names), 2)
+        self.assertEqual(self.stored_files(), names)
+
+    def test_exif_after_large_header_segments_is_read(self):
+        from datetime import datetime
+        from PIL import Image
+        exif = Image.Exif()
+        exif[0x0132] = '2026:10:19 09:15:00'
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48)).save(buffer, format='JPEG', exif=exif)
+        data = buffer.getvalue()
+        # Two ~60KB APP2 segments (an ICC profile, say) push EXIF past the first 64KB
+        app2 = b'\xff\xe2' + (60000 + 2).to_bytes(2, 'big') + bytes(60000)
+        photo = SimpleUploadedFile('IMG_0001.jpg', data[:2] + app2 * 2 + data[2:], content_type='image/jpeg')
+
+        response = self.upload([photo])
+
+        self.assertEqual(response.status_code, 201)
+        raw_photo = RawPhotoUpload.objects.get()
+        self.assertEqual(raw_photo.taken_at, timezone.make_aware(datetime(2026, 10, 19, 9, 15)))
+
+    def test_failure_after_streaming_discards_stored_files(self):
+        with mock.patch('qr.views.register_fingerprint', side_effect=RuntimeError('database went away')):
+            with self.assertRaises(RuntimeError):
+                self.upload([self.photo('IMG_0001.jpg'), self.photo('IMG_0002.jpg', (32, 32))])
+
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(PhotoUploadBatch.objects.exists())
+
+    def test_project_form_field_is_checked_before_storing(self):
+        response = self.client.post(
+            '/api/photo-batches/upload_photos/', {'project': self.project.id, 'photos': [self.photo()]}, format='multipart'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stored_files(), [RawPhotoUpload.objects.get().image.name])
+
+
+class InFlight:
+    """Counts the calls running at once; each holds its slot for `hold` seconds so that overlaps show"""
+
+    def __init__(self, hold=0.02):
+        self.hold = hold
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.running += 1
+            self.max = max(self.max, self.running)
+        time.sleep(self.hold)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.running -= 1
+
+
+class CountingStorage(InMemoryStorage):
+    """Local stand-in for S3 that records how many writes run at once"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = InFlight()
+
+    def _save(self, name, content):
+        with self.in_flight:
+            return super()._save(name, content)
+
+
+class CountingS3Client(FakeS3Client):
+    """FakeS3Client whose PUTs and parts record how many run at once"""
+
+    def __init__(self, fail=None):
+        super().__init__(fail)
+        self.in_flight = InFlight()
+
+    def __getattr__(self, method):
+        call = super().__getattr__(method)
+        if method not in ('put_object', 'upload_part'):
+            return call
+
+        def counted(**kwargs):
+            with self.in_flight:
+                return call(**kwargs)
+        return counted
+
+
+def jpeg_uploads(count, size=256):
+    return [
+        SimpleUploadedFile(f'IMG_{i:04d}.jpg', b'\xff\xd8' + os.urandom(size), content_type='image/jpeg')
+        for i in range(count)
+    ]
+
+
+class ParallelUploadStorageTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=self.user, name='Beach day')
+        self.qr_card = QRCard.objects.create(project=self.project, status='distributed')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        delay_patch = mock.patch('qr.views.generate_photo_derivatives.delay')
+        self.delay = delay_patch.start()
+        self.addCleanup(delay_patch.stop)
+
+    def upload(self, photos):
+        return self.client.post(
+            f'/api/qrcards/{self.qr_card.id}/upload_photos/', {'photos': photos}, format='multipart'
+        )
+
+    def s3_storage(self, client):
+        from storages.backends.s3 import S3Storage
+        storage = S3Storage(
+            bucket_name='spotshot-test', access_key='AKIDEXAMPLE', secret_key='secret', region_name='us-east-1'
+        )
+        storage._bucket = mock.Mock(**{'meta.client': client})
+        storage._bucket.name = storage.bucket_name
+        return storage
+
+    def test_writes_are_bounded_by_the_pool(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                field = models.FileField(upload_to='qr_photos/', storage=CountingStorage())
+
+                names = save_uploads(jpeg_uploads(8), field, max_workers=workers)
+
+                self.assertLessEqual(field.storage.in_flight.max, workers)
+                self.assertEqual(field.storage.in_flight.max > 1, workers > 1)
+                self.assertEqual(len(set(names)), 8)
+                self.assertTrue(all(field.storage.exists(name) for name in names))
+
+    def test_failed_write_removes_stored_files(self):
+        storage = CountingStorage()
+        field = models.FileField(upload_to='qr_photos/', storage=storage)
+        original_save = storage._save
+
+        def flaky_save(name, content):
+            if 'IMG_0003' in name:
+                raise OSError('storage unavailable')
+            return original_save(name, content)
+
+        with mock.patch.object(storage, '_save', side_effect=flaky_save):
+            with self.assertRaises(OSError):
+                save_uploads(jpeg_uploads(6), field, max_workers=3)
+        self.assertEqual(storage.listdir('qr_photos')[1], [])
+
+    @override_settings(UPLOAD_STORAGE_WORKERS=3)
+    def test_qr_card_upload_writes_concurrently_and_inserts_once(self):
+        storage = CountingStorage()
+        with mock.patch.object(QRCardPhoto._meta.get_field('image'), 'storage', storage):
+            response = self.upload(jpeg_uploads(8))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.qr_card.photos.count(), 8)
+        self.assertEqual(self.delay.call_count, 8)
+        self.assertGreater(storage.in_flight.max, 1)
+        self.assertLessEqual(storage.in_flight.max, 3)
+        self.qr_card.refresh_from_db()
+        self.assertEqual(self.qr_card.status, 'photos_uploaded')
+
+    @override_settings(UPLOAD_STORAGE_WORKERS=3, UPLOAD_STREAM_PART_SIZE=64 * 1024)
+    def test_streamed_parts_are_sent_on_the_pool(self):
+        client = CountingS3Client()
+        with mock.patch.object(QRCardPhoto._meta.get_field('image'), 'storage', self.s3_storage(client)):
+            response = self.upload(jpeg_uploads(4, size=300 * 1024) + jpeg_uploads(2))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.qr_card.photos.count(), 6)
+        methods = client.methods()
+        self.assertEqual(methods.count('put_object'), 2)
+        self.assertEqual(methods.count('complete_multipart_upload'), 4)
+        self.assertGreater(methods.count('upload_part'), 4)
+        self.assertGreater(client.in_flight.max, 1)
+        self.assertLessEqual(client.in_flight.max, 3)
+
+    @override_settings(UPLOAD_STORAGE_WORKERS=3, UPLOAD_STREAM_PART_SIZE=64 * 1024)
+    def test_failed_completion_discards_the_whole_request(self):
+        client = CountingS3Client(fail='complete_multipart_upload')
+        storage = self.s3_storage(client)
+        with mock.patch.object(QRCardPhoto._meta.get_field('image'), 'storage', storage):
+            with self.assertRaises(ClientError):
+                self.upload(jpeg_uploads(3, size=300 * 1024) + jpeg_uploads(1))
+
+        started = [kwargs['Key'] for method, kwargs in client.calls if method == 'create_multipart_upload']
+        put = [kwargs['Key'] for method, kwargs in client.calls if method == 'put_object']
+        self.assertEqual(len(started), 3)
+        self.assertEqual(client.methods().count('abort_multipart_upload'), 3)
+        # Including the single PUT that went through
+        deleted = [call.args[0] for call in storage.bucket.Object.call_args_list]
+        self.assertEqual(sorted(deleted), sorted(started + put))
+        self.assertFalse(QRCardPhoto.objects.exists())
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=self.user, name='Beach day')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url):
+        """Follow next links, then previous links back; returns both id sequences"""
+        forward, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            results = response.data.get('results', response.data.get('photos'))
+            forward += [row['id'] for row in results]
+            pages.append([row['id'] for row in results])
+            url, previous = response.data['next'], response.data['previous']
+        backward = pages[-1]
+        while previous:
+            response = self.client.get(previous)
+            backward = [row['id'] for row in response.data.get('results', response.data.get('photos'))] + backward
+            previous = response.data['previous']
+        return forward, backward
+
+    def test_qr_cards_page_through_ties_on_created_at(self):
+        cards = QRCard.objects.bulk_create(
+            QRCard(project=self.project, code=f'card-{i}', access_pin='1234') for i in range(7)
+        )
+        # Same timestamp for several cards, so only the id breaks the tie
+        QRCard.objects.filter(id__in=[c.id for c in cards[:4]]).update(created_at='2026-10-19T09:00:00Z')
+        QRCard.objects.filter(id__in=[c.id for c in cards[4:]]).update(created_at='2026-10-19T10:00:00Z')
+
+        forward, backward = self.walk(f'/api/qrcards/?project={self.project.id}&page_size=3')
+
+        expected = [c.id for c in cards[4:]] + [c.id for c in cards[:4]]
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_batch_photos_in_shooting_order_with_undated_last(self):
+        batch = PhotoUploadBatch.objects.create(project=self.project, name='Morning')
+        taken = ['2026-10-19T09:00:02Z', None, '2026-10-19T09:00:01Z', None, '2026-10-19T09:00:01Z']
+        photos = [
+            RawPhotoUpload.objects.create(batch=batch, original_filename=f'IMG_{i}.jpg', file_size=1, image=f'raw/{i}.jpg', taken_at=t)
+            for i, t in enumerate(taken)
+        ]
+
+        forward, backward = self.walk(f'/api/photo-batches/{batch.id}/photos/?page_size=2')
+
+        expected = [photos[i].id for i in (2, 4, 0, 1, 3)]
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_page_query_count_does_not_depend_on_depth(self):
+        QRCard.objects.bulk_create(
+            QRCard(project=self.project, code=f'card-{i}', access_pin='1234') for i in range(30)
+        )
+        response = self.client.get('/api/qrcards/?page_size=10')
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_rejects_garbled_cursor(self):
+        response = self.client.get('/api/qrcards/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_only_the_qr_lists_are_paginated(self):
+        self.assertIn('results', self.client.get('/api/qrcard-batches/').data)
+        self.assertIn('results', self.client.get('/api/photo-batches/').data)
+        self.assertEqual([row['id'] for row in self.client.get('/api/projects/').data], [self.project.id])
+
+
+class QRCardListTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        project = Project.objects.create(user=user, name='Beach day')
+        self.cards = QRCard.objects.bulk_create(
+            QRCard(project=project, code=f'card-{i}', access_pin='1234', session_notes='x' * 1000) for i in range(5)
+        )
+        QRCardPhoto.objects.bulk_create(
+            QRCardPhoto(qr_card=card, image=f'qr_photos/{card.id}-{n}.jpg', original_filename=f'{n}.jpg', file_size=1)
+            for card in self.cards[:3] for n in range(card.id % 3 + 1)
+        )
+        # bulk_create skips the signals that keep photo_total
+        for card in self.cards[:3]:
+            counters.photos_added(card.id, card.id % 3 + 1)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_list_is_one_query_with_annotated_photo_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/qrcards/')
+
+        counts = {row['id']: row['photo_count'] for row in response.data['results']}
+        self.assertEqual(counts, {card.id: card.photos.count() for card in self.cards})
+        row = response.data['results'][0]
+        self.assertNotIn('photos', row)
+        self.assertNotIn('session_notes', row)
+
+    def test_sparse_fieldset(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/qrcards/?fields=id,code,status')
+
+        self.assertEqual(set(response.data['results'][0]), {'id', 'code', 'status'})
+
+    def test_expand_photos(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/qrcards/?expand=photos&fields=id,photo_count')
+
+        for row in response.data['results']:
+            self.assertEqual(set(row), {'id', 'photo_count', 'photos'})
+            self.assertEqual(len(row['photos']), row['photo_count'])
+
+
+class ConstantQueryCountTests(TestCase):
+    """List pages must not run a query per row"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser(username='admin', password='x', email='admin@example.com')
+        self.project = Project.objects.create(user=self.user, name='Beach day')
+
+    def add_rows(self, count):
+        project = Project.objects.create(user=self.user, name=f'Project {Project.objects.count()}')
+        qr_batch = QRCardBatch.objects.create(project=project, amount=count)
+        photo_batch = PhotoUploadBatch.objects.create(project=project)
+        for i in range(count):
+            card = QRCard.objects.create(project=project, batch=qr_batch, code=f'{project.id}-{i}', access_pin='1234')
+            QRCardPhoto.objects.create(qr_card=card, image=f'qr_photos/{card.id}.jpg', original_filename='a.jpg', file_size=1)
+            RawPhotoUpload.objects.create(
+                batch=photo_batch, image=f'raw/{card.id}.jpg', original_filename='a.jpg', file_size=1, assigned_qr_card=card
+            )
+
+    def assertConstantQueries(self, client, url):
+        self.add_rows(2)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(client.get(url).status_code, 200)
+        self.add_rows(10)
+        with self.assertNumQueries(len(small)):
+            self.assertEqual(client.get(url).status_code, 200)
+
+    def test_admin_changelists(self):
+        for url in (
+            '/admin/projects/project/', '/admin/qr/qrcardbatch/', '/admin/qr/qrcard/',
+            '/admin/qr/qrcardphoto/', '/admin/qr/photouploadbatch/', '/admin/qr/rawphotoupload/',
+        ):
+            with self.subTest(url=url):
+                self.client.force_login(self.user)
+                self.assertConstantQueries(self.client, url)
+
+    def test_api_lists(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for url in ('/api/qrcard-batches/', '/api/qrcards/', '/api/photo-batches/', '/api/projects/'):
+            with self.subTest(url=url):
+                self.assertConstantQueries(client, url)
+
+    def test_annotated_counts(self):
+        self.add_rows(3)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        batch = client.get('/api/qrcard-batches/').data['results'][0]
+        self.assertEqual(batch['qrcards_count'], 3)
+        card = QRCard.objects.annotate(photos_total=models.Count('photos')).first()
+        with self.assertNumQueries(0):
+            self.assertEqual(card.photo_count, 1)
+
+
+class QRCardSearchTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        project = Project.objects.create(user=user, name='Beach day')
+        self.alice = QRCard.objects.create(
+            project=project, code='3f2a9c1e-5b7d-4e0a-9c41-0d2e8f6a7b13', access_pin='1234', client_name='Alice Martin'
+        )
+        self.bob = QRCard.objects.create(
+            project=project, code='a93f2a9c-1d0b-4c5e-8f7a-6b2c9d3e4f51', access_pin='1234', location_name='North pier'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def search(self, term):
+        response = self.client.get('/api/qrcards/', {'search': term})
+        return {row['id'] for row in response.data['results']}
+
+    def test_short_code_matches_code_prefix_only(self):
+        self.assertEqual(self.search('3F2A9C1E'), {self.alice.id})
+        self.assertEqual(self.search('3f2a'), {self.alice.id})
+
+    def test_free_text_matches_client_and_session_fields(self):
+        self.assertEqual(self.search('martin'), {self.alice.id})
+        self.assertEqual(self.search('pier'), {self.bob.id})
+        self.assertEqual(self.search('nobody'), set())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ClientCardCacheTests(TestCase):
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=user, name='Beach day', description='Sunset session')
+        self.card = QRCard.objects.create(project=self.project, code='3f2a9c1e-5b7d-4e0a-9c41-0d2e8f6a7b13', access_pin='4821')
+        self.url = f'/api/client/{self.card.code}/'
+        self.client = APIClient()
+
+    def get(self, pin='4821'):
+        return self.client.get(self.url, {'pin': pin})
+
+    def test_first_scan_writes_status_then_repeat_views_hit_the_cache(self):
+        self.assertEqual(self.get().data['status'], 'scanned')
+        self.card.refresh_from_db()
+        self.assertIsNotNone(self.card.scanned_at)
+
+        with self.assertNumQueries(0):
+            response = self.get()
+        self.assertEqual(response.data['status'], 'scanned')
+
+    def test_wrong_pin_is_rejected_even_when_cached(self):
+        self.get()
+        self.assertEqual(self.get(pin='0000').status_code, 404)
+
+    def test_new_photos_invalidate(self):
+        self.get()
+        QRCardPhoto.objects.create(qr_card=self.card, image='qr_photos/a.jpg', original_filename='a.jpg', file_size=1)
+
+        self.assertEqual(self.get().data['photo_count'], 1)
+
+    @mock.patch('qr.views.generate_photo_derivatives.delay')
+    def test_photographer_upload_invalidates(self, delay):
+        self.get()
+        client = APIClient()
+        client.force_authenticate(self.project.user)
+        with mock.patch.object(QRCardPhoto._meta.get_field('image'), 'storage', InMemoryStorage()):
+            client.post(f'/api/qrcards/{self.card.id}/upload_photos/', {'photos': jpeg_uploads(2)}, format='multipart')
+
+        response = self.get()
+        self.assertEqual(response.data['photo_count'], 2)
+        self.assertEqual(response.data['status'], 'photos_uploaded')
+
+    def test_provide_info_and_project_edits_invalidate(self):
+        self.get()
+        self.client.post(f'{self.url}provide_info/', {'pin': '4821', 'email': 'ana@example.com', 'name': 'Ana'})
+        self.assertEqual(self.get().data['client_name'], 'Ana')
+
+        self.project.description = 'Golden hour'
+        self.project.save()
+        self.assertEqual(self.get().data['project']['description'], 'Golden hour')
+
+    def test_project_saves_that_clients_dont_see_keep_the_cache(self):
+        self.get()
+        project = Project.objects.get(id=self.project.id)
+
+        with mock.patch('qr.signals.invalidate_client_cards') as invalidate, self.assertNumQueries(1):
+            project.save()
+        invalidate.assert_not_called()
+
+        project.name = 'Beach evening'
+        project.save()
+        self.assertEqual(self.get().data['project']['name'], 'Beach evening')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CounterTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=self.user, name='Beach day')
+        self.batch = QRCardBatch.objects.create(project=self.project, amount=2)
+        self.card = QRCard.objects.create(project=self.project, batch=self.batch, code='card-1', access_pin='4821')
+        self.other = QRCard.objects.create(project=self.project, batch=self.batch, code='card-2', access_pin='1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_photo(self, card):
+        return QRCardPhoto.objects.create(qr_card=card, image='qr_photos/a.jpg', original_filename='a.jpg', file_size=1)
+
+    def assertNoDrift(self):
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertIn('0 counters found', out.getvalue())
+
+    def test_counters_follow_creates_transitions_and_deletes(self):
+        self.add_photo(self.card)
+        photo = self.add_photo(self.other)
+        self.client.get(f'/api/client/{self.card.code}/', {'pin': '4821'})
+        self.client.post(f'/api/client/{self.other.code}/provide_info/', {'pin': '1234', 'email': 'ana@example.com'})
+
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.card_total, self.project.photo_total), (2, 2))
+        self.assertEqual((self.project.cards_distributed, self.project.cards_scanned, self.project.cards_info_provided), (0, 1, 1))
+        self.assertNoDrift()
+
+        photo.delete()
+        self.card.refresh_from_db()
+        self.card.delete()
+        self.project.refresh_from_db()
+        self.batch.refresh_from_db()
+        self.assertEqual((self.project.card_total, self.project.photo_total, self.project.cards_scanned), (1, 0, 0))
+        self.assertEqual(self.batch.card_total, 1)
+        self.assertNoDrift()
+
+    @mock.patch('qr.views.generate_photo_derivatives.delay')
+    def test_bulk_upload_is_counted_and_stale_saves_keep_counters(self, delay):
+        self.card.status = 'photos_uploaded'
+        self.card.save()
+        stale_card = QRCard.objects.get(pk=self.card.pk)
+        stale_project = Project.objects.get(pk=self.project.pk)
+        with mock.patch.object(QRCardPhoto._meta.get_field('image'), 'storage', InMemoryStorage()):
+            self.client.post(f'/api/qrcards/{self.card.id}/upload_photos/', {'photos': jpeg_uploads(3)}, format='multipart')
+
+        stale_card.location_name = 'Pier'
+        stale_card.save()
+        stale_project.name = 'Beach evening'
+        stale_project.save()
+
+        self.card.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual(self.card.photo_total, 3)
+        self.assertEqual(self.card.location_name, 'Pier')
+        self.assertEqual((self.project.photo_total, self.project.cards_photos_uploaded), (3, 1))
+        self.assertEqual(self.client.get('/api/qrcards/').data['results'][-1]['photo_count'], 3)
+        self.assertNoDrift()
+
+    def test_concurrent_transitions_move_the_counters_once(self):
+        self.card.status = 'photos_uploaded'
+        self.card.save()
+        first, second = QRCard.objects.get(pk=self.card.pk), QRCard.objects.get(pk=self.card.pk)
+        self.assertTrue(counters.change_card_status(first, 'completed', ['photos_uploaded'], completed_at=timezone.now()))
+        self.assertFalse(counters.change_card_status(second, 'completed', ['photos_uploaded'], completed_at=timezone.now()))
+        self.assertEqual((second.status, second.completed_at), ('completed', first.completed_at))
+
+        # A stale instance moves on from the status that won, if that is still eligible
+        scanning, uploading = QRCard.objects.get(pk=self.other.pk), QRCard.objects.get(pk=self.other.pk)
+        counters.change_card_status(scanning, 'info_provided', ['distributed', 'scanned'], info_provided_at=timezone.now())
+        self.assertTrue(counters.change_card_status(
+            uploading, 'photos_uploaded', ['distributed', 'scanned', 'info_provided'], photos_uploaded_at=timezone.now()
+        ))
+
+        self.project.refresh_from_db()
+        self.assertEqual(
+            (self.project.cards_distributed, self.project.cards_info_provided,
+             self.project.cards_photos_uploaded, self.project.cards_completed),
+            (0, 0, 1, 1)
+        )
+        self.assertNoDrift()
+
+    def test_reconcile_repairs_drift(self):
+        from django.core.management import call_command
+        self.add_photo(self.card)
+        QRCard.objects.filter(pk=self.card.pk).update(photo_total=7)
+        Project.objects.filter(pk=self.project.pk).update(card_total=0, cards_distributed=5)
+
+        out = io.StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('3 counters repaired', out.getvalue())
+        self.card.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual((self.card.photo_total, self.project.card_total, self.project.cards_distributed), (1, 2, 2))
+        self.assertNoDrift()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        project = Project.objects.create(user=user, name='Beach day')
+        self.batch = PhotoUploadBatch.objects.create(project=project, name='Morning', total_photos=2)
+        self.photo = RawPhotoUpload.objects.create(batch=self.batch, image='raw/a.jpg', original_filename='a.jpg', file_size=1)
+        self.card = QRCard.objects.create(project=project, code='3f2a9c1e-5b7d-4e0a-9c41-0d2e8f6a7b13', access_pin='4821', status='scanned')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def assertRevalidates(self, url, change, **params):
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+
+        with self.assertNumQueries(1):
+            again = self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        change()
+        changed = self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_progress(self):
+        def change():
+            self.batch.processed_photos = 1
+            self.batch.save()
+        self.assertRevalidates(f'/api/photo-batches/{self.batch.id}/progress/', change)
+
+    def test_photos_change_with_any_photo(self):
+        def change():
+            # Same kind of write as the storage event ingest: no save(), no batch change
+            RawPhotoUpload.objects.filter(id=self.photo.id).update(
+                processing_error='Upload aborted', updated_at=self.photo.updated_at + timedelta(seconds=1)
+            )
+        self.assertRevalidates(f'/api/photo-batches/{self.batch.id}/photos/', change)
+
+    def test_photo_pages_have_their_own_etags(self):
+        url = f'/api/photo-batches/{self.batch.id}/photos/'
+        self.assertNotEqual(self.client.get(url)['ETag'], self.client.get(url, {'unprocessed': 'true'})['ETag'])
+
+    def test_client_card_from_cache(self):
+        url = f'/api/client/{self.card.code}/'
+        first = self.client.get(url, {'pin': '4821'})
+
+        with self.assertNumQueries(0):
+            again = self.client.get(url, {'pin': '4821'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        self.card.client_name = 'Ana'
+        self.card.save()
+        self.assertEqual(self.client.get(url, {'pin': '4821'}, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+class FakePubSub:
+    """Replays queued messages, then reports idle (a heartbeat) like a quiet channel"""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.channels = []
+
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=None):
+        return {'data': self.messages.pop(0)} if self.messages else None
+
+    async def aclose(self):
+        pass
+
+
+class BatchEventStreamTests(TestCase):
+
+    def setUp(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        project = Project.objects.create(user=self.user, name='Beach day')
+        self.batch = PhotoUploadBatch.objects.create(project=project, status='analyzing', total_photos=2)
+        self.url = f'/api/photo-batches/{self.batch.id}/events/'
+        self.async_client.cookies['access'] = str(AccessToken.for_user(self.user))
+
+    def stream_with(self, messages):
+        pubsub = FakePubSub(json.dumps(message) for message in messages)
+        redis_client = mock.Mock(pubsub=mock.Mock(return_value=pubsub), aclose=mock.AsyncMock())
+        return pubsub, mock.patch('qr.progress_events.redis.asyncio.Redis.from_url', return_value=redis_client)
+
+    async def read(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_streams_snapshot_then_events_until_final_status(self):
+        pubsub, patch = self.stream_with([
+            {'event': 'photo', 'data': {'id': 7, 'assigned_qr_card': {'id': 3, 'short_code': '3f2a9c1e'}}},
+            {'event': 'progress', 'data': {'processed_photos': 2}},
+            {'event': 'status', 'data': {'status': 'completed'}},
+        ])
+        with patch:
+            response = await self.async_client.get(self.url)
+            body = await self.read(response)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(pubsub.channels, [f'spotshot:batch:{self.batch.id}:events'])
+        events = [block.split('\n')[0] for block in body.strip().split('\n\n')]
+        self.assertEqual(events, ['event: progress', 'event: photo', 'event: progress', 'event: status'])
+        self.assertIn('"short_code": "3f2a9c1e"', body)
+
+    async def test_finished_batch_closes_after_snapshot(self):
+        await PhotoUploadBatch.objects.filter(id=self.batch.id).aupdate(status='completed')
+        _, patch = self.stream_with([])
+        with patch:
+            body = await self.read(await self.async_client.get(self.url))
+
+        self.assertTrue(body.endswith('event: status\ndata: {"status": "completed"}\n\n'))
+
+    @override_settings(PROGRESS_EVENTS_MAX_SECONDS=0)
+    async def test_stream_closes_with_a_snapshot_after_max_seconds(self):
+        _, patch = self.stream_with([])
+        with patch:
+            body = await self.read(await self.async_client.get(self.url))
+
+        events = [block.split('\n')[0] for block in body.strip().split('\n\n')]
+        self.assertEqual(events, ['event: progress', 'event: progress'])
+        self.assertIn('"status": "analyzing"', body.strip().split('\n\n')[-1])
+
+    async def test_requires_owner(self):
+        self.async_client.cookies.clear()
+        self.assertEqual((await self.async_client.get(self.url)).status_code, 401)
+
+        other = await get_user_model().objects.acreate(username='someone-else')
+        from rest_framework_simplejwt.tokens import AccessToken
+        self.async_client.cookies['access'] = str(AccessToken.for_user(other))
+        self.assertEqual((await self.async_client.get(self.url)).status_code, 404)
+
+    @mock.patch('qr.progress_events.publish_batch_event')
+    @mock.patch('qr.tasks.fingerprint_raw_photo', return_value=False)
+    @mock.patch('qr.tasks.extract_qr_code_from_image', return_value=None)
+    def test_analysis_publishes_progress(self, extract, fingerprint, publish):
+        from .tasks import analyze_photo_batch_for_qr_codes
+        for i in range(2):
+            RawPhotoUpload.objects.create(batch=self.batch, image=f'raw/{i}.jpg', original_filename=f'{i}.jpg', file_size=1)
+
+        analyze_photo_batch_for_qr_codes(self.batch.id)
+
+        events = [call.args[1] for call in publish.call_args_list]
+        self.assertEqual(events, ['status', 'photo', 'progress', 'photo', 'progress', 'progress', 'status'])
+        self.assertEqual(publish.call_args_list[4].args[2]['processed_photos'], 2)
+        self.assertEqual(publish.call_args_list[-1].args[2]['status'], 'completed')
+
+
+@mock.patch('qr.progress_events.publish_batch_event')
+@mock.patch('qr.tasks.create_qr_card_photo_from_raw')
+@mock.patch('qr.tasks.fingerprint_raw_photo', return_value=False)
+class BatchAnalysisTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=user, name='Beach day')
+        self.qr_card = QRCard.objects.create(project=self.project, code='card-1')
+        self.batch = PhotoUploadBatch.objects.create(project=self.project, status='uploading')
+        self.raw_photos = [
+            RawPhotoUpload.objects.create(
+                batch=self.batch, image=f'raw/{i}.jpg', original_filename=f'{i}.jpg', file_size=1,
+                taken_at=timezone.now() + timedelta(seconds=i)
+            )
+            for i in range(3)
+        ]
+
+    @staticmethod
+    def decoder(image_field):
+        return 'https://spotshot.example/client/card-1?pin=1234' if image_field.name == 'raw/0.jpg' else None
+
+    @mock.patch('qr.tasks.extract_exif_datetime', return_value=None)
+    def test_late_decode_keeps_the_analysis_assignment(self, exif, fingerprint, copy, publish):
+        from .tasks import analyze_photo_batch_for_qr_codes, decode_raw_photo
+
+        def analyse_meanwhile(image_field):
+            # The batch analysis finishes while this decode is still working on its photo
+            if not RawPhotoUpload.objects.filter(is_processed=True).exists():
+                with mock.patch('qr.tasks.extract_qr_code_from_image', side_effect=self.decoder):
+                    analyze_photo_batch_for_qr_codes(self.batch.id)
+            return self.decoder(image_field)
+
+        with mock.patch('qr.tasks.extract_qr_code_from_image', side_effect=analyse_meanwhile):
+            decode_raw_photo(self.raw_photos[1].id)
+
+        photo = RawPhotoUpload.objects.get(id=self.raw_photos[1].id)
+        self.assertEqual(photo.assigned_qr_card, self.qr_card)
+        self.assertTrue(photo.is_processed)
+        self.assertIsNotNone(photo.decoded_at)
+
+
+    def test_failed_uploads_keep_their_error(self, fingerprint, copy, publish):
+        from .tasks import analyze_photo_batch_for_qr_codes
+        RawPhotoUpload.objects.filter(id=self.raw_photos[2].id).update(image='', processing_error='Upload never arrived')
+
+        with mock.patch('qr.tasks.extract_qr_code_from_image', side_effect=self.decoder) as extract:
+            result = analyze_photo_batch_for_qr_codes(self.batch.id)
+
+        self.assertEqual(extract.call_count, 2)
+        self.assertEqual((result['total_photos'], result['processed_photos']), (3, 3))
+        failed = RawPhotoUpload.objects.get(id=self.raw_photos[2].id)
+        self.assertEqual(failed.processing_error, 'Upload never arrived')
+        self.assertFalse(failed.is_processed)
+        self.assertIsNone(failed.assigned_qr_card)
+
+    def test_duplicate_qr_photo_still_starts_the_sequence(self, fingerprint, copy, publish):
+        from .tasks import analyze_photo_batch_for_qr_codes
+        earlier = PhotoUploadBatch.objects.create(project=self.project, status='completed')
+        original = RawPhotoUpload.objects.create(
+            batch=earlier, image='raw/0.jpg', original_filename='0.jpg', file_size=1, is_processed=True,
+            has_qr_code=True, qr_code_data='https://spotshot.example/client/card-1?pin=1234',
+            assigned_qr_card=self.qr_card
+        )
+        RawPhotoUpload.objects.filter(id=self.raw_photos[0].id).update(duplicate_of=original)
+        fingerprint.side_effect = lambda raw_photo, *args: bool(raw_photo.duplicate_of_id)
+
+        with mock.patch('qr.tasks.extract_qr_code_from_image', side_effect=self.decoder) as extract:
+            analyze_photo_batch_for_qr_codes(self.batch.id)
+
+        self.assertEqual(extract.call_count, 2)
+        self.assertEqual(
+            list(self.batch.raw_photos.values_list('assigned_qr_card', flat=True)), [self.qr_card.id] * 3
+        )
+        # The card already has the original; only the photos after it are copied
+        self.assertEqual(
+            [call.args[0].id for call in copy.call_args_list], [photo.id for photo in self.raw_photos[1:]]
+        )
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProjectFunnelTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=self.user, name='Beach day')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_card(self, code, **stages):
+        card = QRCard.objects.create(project=self.project, code=code, access_pin='1234')
+        QRCard.objects.filter(pk=card.pk).update(**{
+            f'{stage}_at': f'{day}T12:00:00Z' for stage, day in stages.items()
+        })
+        return card
+
+    def funnel(self, **params):
+        return self.client.get(f'/api/projects/{self.project.id}/funnel/', params)
+
+    def test_rollups_serve_the_funnel(self):
+        from .tasks import refresh_project_funnels
+        self.add_card('card-1', scanned='2026-10-01', info_provided='2026-10-01', completed='2026-10-03')
+        self.add_card('card-2', scanned='2026-10-01')
+        self.add_card('card-3', scanned='2026-10-02', photos_uploaded='2026-10-03')
+        self.add_card('card-4')
+        self.assertEqual(refresh_project_funnels()['rows'], 3)
+
+        with self.assertNumQueries(2):
+            response = self.funnel(**{'from': '2026-10-01', 'to': '2026-10-04'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cards'], 4)
+        self.assertEqual(
+            response.data['totals'], {'scanned': 3, 'info_provided': 1, 'photos_uploaded': 1, 'completed': 1}
+        )
+        days = {str(row['day']): row for row in response.data['days']}
+        self.assertEqual(len(days), 4)
+        self.assertEqual(days['2026-10-01']['scanned'], 2)
+        self.assertEqual(days['2026-10-03']['completed'], 1)
+        self.assertEqual(days['2026-10-04']['scanned'], 0)
+
+    def test_refresh_window_drops_days_without_cards(self):
+        from datetime import date
+        from .funnel import refresh_funnels
+        card = self.add_card('card-1', scanned='2026-10-01')
+        self.add_card('card-2', scanned='2026-09-01')
+        refresh_funnels()
+
+        card.delete()
+        refresh_funnels(date(2026, 9, 15))
+
+        days = self.funnel(**{'from': '2026-09-01', 'to': '2026-10-01'}).data['days']
+        self.assertEqual(days[0]['scanned'], 1)
+        self.assertEqual(days[-1]['scanned'], 0)
+
+    def test_full_refresh_revisits_days_outside_the_window(self):
+        from .models import ProjectFunnelDaily
+        from .tasks import refresh_project_funnels
+        card = self.add_card('card-1', scanned=(timezone.localdate() - timedelta(days=30)).isoformat())
+        refresh_project_funnels()
+        card.delete()
+
+        refresh_project_funnels()
+        self.assertTrue(ProjectFunnelDaily.objects.filter(project=self.project).exists())
+        refresh_project_funnels(full=True)
+        self.assertFalse(ProjectFunnelDaily.objects.filter(project=self.project).exists())
+
+    def test_rejects_bad_ranges(self):
+        self.assertEqual(self.funnel(to='October').status_code, 400)
+        self.assertEqual(self.funnel(**{'from': '2026-10-02', 'to': '2026-10-01'}).status_code, 400)
+        self.assertEqual(self.funnel(**{'from': '2024-01-01', 'to': '2026-10-01'}).status_code, 400)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CardExportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        self.project = Project.objects.create(user=self.user, name='Beach day')
+        QRCard.objects.bulk_create([
+            QRCard(project=self.project, code='card-1', access_pin='1234', client_name='Ana', client_email='ana@example.com', client_phone='+44 20 7946 0958', status='info_provided'),
+            QRCard(project=self.project, code='card-2', access_pin='1234', client_name='=HYPERLINK("x")', client_email='eve@example.com', client_phone="+cmd|' /C calc'!A0"),
+            QRCard(project=self.project, code='card-3', access_pin='1234'),
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, **params):
+        response = self.client.get('/api/qrcards/export/', {'project': self.project.id, **params})
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        import csv
+        response, body = self.export(has_client_info='true')
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="qr-cards-', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([row['code'] for row in rows], ['card-1', 'card-2'])
+        self.assertEqual(rows[0]['client_email'], 'ana@example.com')
+        self.assertEqual(rows[1]['client_name'], '\'=HYPERLINK("x")')
+        # Phone numbers are not formulas; anything else starting with + is
+        self.assertEqual(rows[0]['client_phone'], '+44 20 7946 0958')
+        self.assertEqual(rows[1]['client_phone'], "'+cmd|' /C calc'!A0")
+        self.assertEqual(rows[0]['scanned_at'], '')
+
+    def test_ndjson_with_list_filters(self):
+        response, body = self.export(file_format='ndjson', status='info_provided')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['code'], rows[0]['client_name'], rows[0]['photo_total']), ('card-1', 'Ana', 0))
+
+    def test_rejects_unknown_format(self):
+        response = self.client.get('/api/qrcards/export/', {'file_format': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_chunks_are_pulled_one_at_a_time_under_asgi(self):
+        from asgiref.sync import async_to_sync
+        from django.test import AsyncRequestFactory
+        from .exports import streaming_content
+
+        pulled = []
+
+        def chunks():
+            for chunk in ('a', 'b', 'c'):
+                pulled.append(chunk)
+                yield chunk
+
+        content = streaming_content(AsyncRequestFactory().get('/'), chunks())
+
+        async def first(content):
+            return await anext(content)
+
+        self.assertEqual(async_to_sync(first)(content), 'a')
+        self.assertEqual(pulled, ['a'])
@@ -0,0 +1,436 @@
+"""
+Streaming upload handler for photo uploads.
+
+Django's default handlers spool each uploaded file to memory or a temp file,
+after which the view copies it to storage and reads it again to hash it. For
+batches of 10-15MB camera files that means every byte crosses the local disk
+twice before it reaches S3.
+
+StreamingStorageUploadHandler writes each photo to its final storage location
+while the request body is being read: S3 through a multipart upload (one part
+per UPLOAD_STREAM_PART_SIZE, a single PUT for smaller files) and
+FileSystemStorage straight into the target file. The SHA-256, size and the
+file's header (for a JPEG, every segment up to the image data, so EXIF is
+complete) are captured on the way through, so the view never reads the file
+back. Other storages, and non-image or other form fields, fall through to
+Django's default handlers.
+
+S3 parts and PUTs are sent on a per-request UploadPool of
+UPLOAD_STORAGE_WORKERS threads, so reading the body overlaps with uploading
+it and a request with many photos pays roughly one round-trip per pool slot
+rather than one per part. The body is only read ahead while a slot is free,
+which keeps at most UPLOAD_STORAGE_WORKERS parts in memory. Multipart
+uploads are completed in upload_complete(), once all their parts are in.
+
+Because the photos are stored before the view runs, views must check that the
+user may upload to the target before installing the handler, and must discard
+what was stored on every path that does not keep it: discard_upload() for one
+file, StreamingStorageUploadHandler.discard() if the body could not be read to
+the end. A writer that fails removes its own partial file or multipart upload.
+
+Exact duplicates are only recognised once they are stored, since the hash is
+taken on the way through; the view then deletes them again. Uploads that
+fall through to the default handlers are still checked before being stored,
+and clients that send the SHA-256 up front (generate_upload_urls) skip the
+upload of a duplicate altogether.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, load_handler
+
+logger = logging.getLogger(__name__)
+
+# Bytes kept from the start of each file for EXIF: at least HEAD_SIZE, and for
+# JPEGs every segment before the image data, since APP1 (EXIF) may follow large
+# ICC or XMP segments; never more than HEAD_MAX_SIZE
+HEAD_SIZE = 64 * 1024
+HEAD_MAX_SIZE = 1024 * 1024
+
+
+def jpeg_header_size(data):
+    """
+    Length of a JPEG's segments up to and including the start of scan, None
+    while `data` ends before that, 0 for anything that isn't a JPEG
+    """
+    if len(data) < 2:
+        return None
+    if data[:2] != b'\xff\xd8':
+        return 0
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            # Not a marker: corrupt, keep what there is
+            return offset
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # Markers without a length
+            offset += 2
+            continue
+        end = offset + 2 + int.from_bytes(data[offset + 2:offset + 4], 'big')
+        if marker == 0xDA:
+            return end if end <= len(data) else None
+        offset = end
+    return None
+
+
+class StoredUploadedFile(UploadedFile):
+    """An upload already saved to storage as `stored_name`; nothing is kept locally"""
+
+    def __init__(self, storage, stored_name, name, content_type, size, charset, content_type_extra, sha256, head):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.storage = storage
+        self.stored_name = stored_name
+        self.sha256 = sha256
+        self.head = head
+
+    def close(self):
+        # Django closes every parsed upload after the request; there is no local file
+        pass
+
+
+class UploadPool:
+    """
+    Runs storage calls on up to `workers` threads. submit() blocks while all
+    of them are busy, so no more than `workers` calls hold a body in memory.
+    """
+
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers)
+
+    def submit(self, fn, *args, **kwargs):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class InlinePool:
+    """UploadPool stand-in that runs each call as it is submitted"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self):
+        pass
+
+
+class LocalFileWriter:
+    """Writes straight into the final file of a FileSystemStorage; local writes don't use the pool"""
+
+    def __init__(self, storage, name, content_type, pool=None):
+        self.storage = storage
+        while True:
+            self.name = storage.get_available_name(name)
+            self.path = storage.path(self.name)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                # Exclusive create, like FileSystemStorage._save, in case of a race for the name
+                self.file = open(self.path, 'xb')
+                break
+            except FileExistsError:
+                continue
+
+    def write(self, data):
+        try:
+            self.file.write(data)
+        except Exception:
+            self.abort()
+            raise
+
+    def close(self):
+        try:
+            self.file.close()
+            if self.storage.file_permissions_mode is not None:
+                os.chmod(self.path, self.storage.file_permissions_mode)
+        except Exception:
+            self.abort()
+            raise
+        return self.name.replace('\\', '/')
+
+    def finish(self):
+        pass
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class S3MultipartWriter:
+    """
+    Writes to an S3Boto3Storage object, one multipart part at a time. Parts
+    are sent on `pool`; finish() waits for them and completes the upload.
+    """
+
+    def __init__(self, storage, name, content_type, pool=None):
+        from storages.utils import clean_name
+
+        self.name = clean_name(storage.get_available_name(name))
+        self.key = storage._normalize_name(self.name)
+        self.bucket = storage.bucket_name
+        self.client = storage.bucket.meta.client
+        # ACL, object parameters and the like, as storage.save() would use
+        self.params = storage._get_write_parameters(self.key)
+        self.params['ContentType'] = content_type or self.params['ContentType']
+        self.part_size = getattr(settings, 'UPLOAD_STREAM_PART_SIZE', 8 * 1024 * 1024)
+        self.pool = pool or InlinePool()
+        self.buffer = bytearray()
+        # Futures of the parts (or the single PUT), in part order
+        self.pending = []
+        self.upload_id = None
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            try:
+                self.flush_part()
+            except Exception:
+                self.abort()
+                raise
+
+    def flush_part(self):
+        # Stop reading the body as soon as a part has failed
+        for future in self.pending:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.params
+            )['UploadId']
+        part_number = len(self.pending) + 1
+        body = bytes(self.buffer)
+        self.buffer.clear()
+        self.pending.append(self.pool.submit(self.upload_part, self.upload_id, part_number, body))
+
+    def upload_part(self, upload_id, part_number, body):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=upload_id, PartNumber=part_number, Body=body
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        """Send the rest of the file and return its name; it is only stored once finish() returns"""
+        try:
+            if self.upload_id is None:
+                # Smaller than one part: a single PUT
+                self.pending.append(self.pool.submit(
+                    self.client.put_object, Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **self.params
+                ))
+                self.buffer.clear()
+            elif self.buffer:
+                self.flush_part()
+        except Exception:
+            self.abort()
+            raise
+        return self.name
+
+    def finish(self):
+        try:
+            results = [future.result() for future in self.pending]
+            if self.upload_id is not None:
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={'Parts': results}
+                )
+        except Exception:
+            self.abort()
+            raise
+        self.pending = []
+        self.upload_id = None
+
+    def abort(self):
+        """Drop the parts uploaded so far; never raises, so the original error is the one reported"""
+        # Parts still in flight would outlive an abort
+        for future in self.pending:
+            future.exception()
+        self.pending = []
+        upload_id, self.upload_id = self.upload_id, None
+        self.buffer.clear()
+        if upload_id is None:
+            return
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=upload_id)
+        except Exception as e:
+            # Left to the bucket's AbortIncompleteMultipartUpload lifecycle rule
+            logger.error(f"Failed to abort multipart upload {upload_id} of {self.key}: {str(e)}")
+
+
+def writer_class_for(storage):
+    if isinstance(storage, FileSystemStorage):
+        return LocalFileWriter
+    if getattr(storage, 'bucket', None) is not None:
+        return S3MultipartWriter
+    return None
+
+
+class StreamingStorageUploadHandler(FileUploadHandler):
+    """Streams image files posted as `field_name` into the storage of a model's FileField"""
+
+    def __init__(self, request=None, model_field=None, field_name='photos'):
+        super().__init__(request)
+        self.model_field = model_field
+        self.field_name = field_name
+        self.writer_class = writer_class_for(model_field.storage)
+        self.writer = None
+        self.pool = None
+        # (writer, upload) of every file stored so far
+        self.stored = []
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.writer = None
+        if self.writer_class is None or field_name != self.field_name or not (content_type or '').startswith('image/'):
+            return
+
+        name = self.model_field.generate_filename(None, file_name)
+        if self.pool is None and self.writer_class is S3MultipartWriter:
+            self.pool = UploadPool(getattr(settings, 'UPLOAD_STORAGE_WORKERS', 8))
+        self.writer = self.writer_class(self.model_field.storage, name, content_type, pool=self.pool)
+        self.sha256 = hashlib.sha256()
+        self.head = bytearray()
+        self.head_open = True
+        # Keep the default handlers from also buffering this file
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+        self.sha256.update(raw_data)
+        if self.head_open:
+            self.head += raw_data[:HEAD_MAX_SIZE - len(self.head)]
+            self.head_open = len(self.head) < HEAD_MAX_SIZE and (
+                len(self.head) < HEAD_SIZE or jpeg_header_size(self.head) is None
+            )
+        self.writer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+        writer, self.writer = self.writer, None
+        upload = StoredUploadedFile(
+            self.model_field.storage, writer.close(), self.file_name, self.content_type, file_size, self.charset,
+            self.content_type_extra, self.sha256.hexdigest(), bytes(self.head)
+        )
+        self.stored.append((writer, upload))
+        return upload
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+    def upload_complete(self):
+        """Wait for the parts still in flight and complete every file; on any failure nothing is kept"""
+        try:
+            for writer, _ in self.stored:
+                writer.finish()
+        except Exception:
+            self.discard()
+            raise
+        finally:
+            self.shutdown()
+
+    def discard(self):
+        """Remove everything stored for this request, for when it could not be read or stored to the end"""
+        self.upload_interrupted()
+        for writer, upload in self.stored:
+            writer.abort()
+            discard_upload(upload)
+        self.shutdown()
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def use_streaming_upload(request, model_field, field_name='photos'):
+    """
+    Install the streaming handler ahead of the default ones and return it.
+    Must run before request.data or request.FILES is first accessed, and
+    only once the user is known to be allowed to upload.
+    """
+    django_request = getattr(request, '_request', request)
+    handler = StreamingStorageUploadHandler(django_request, model_field, field_name)
+    django_request.upload_handlers = [handler] + [
+        load_handler(path, django_request) for path in settings.FILE_UPLOAD_HANDLERS
+    ]
+    return handler
+
+
+def stored_file(upload):
+    """Value to assign to a FileField: the stored name for streamed uploads, else the upload itself"""
+    return upload.stored_name if isinstance(upload, StoredUploadedFile) else upload
+
+
+def discard_upload(upload):
+    """Delete a streamed upload the view decided not to keep; safe to call twice"""
+    if isinstance(upload, StoredUploadedFile) and upload.stored_name:
+        upload.storage.delete(upload.stored_name)
+        upload.stored_name = None
+
+
+def discard_uploads(uploads):
+    for upload in uploads:
+        discard_upload(upload)
+
+
+def save_uploads(uploads, model_field, max_workers=None):
+    """
+    Store uploads for a FileField and return their storage names, in order.
+
+    Streamed uploads are already stored. The rest are written concurrently on
+    a thread pool (UPLOAD_STORAGE_WORKERS, default 8), so a request
+    with many files pays roughly one storage round-trip per pool slot rather
+    than one per file. If any write fails, the files stored so far are
+    deleted and the error is raised.
+    """
+    storage = model_field.storage
+    max_workers = max_workers or getattr(settings, 'UPLOAD_STORAGE_WORKERS', 8)
+
+    def save(upload):
+        if isinstance(upload, StoredUploadedFile):
+            return upload.stored_name
+        name = model_field.generate_filename(None, upload.name)
+        return storage.save(name, upload, max_length=model_field.max_length)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(uploads)))) as executor:
+        futures = [executor.submit(save, upload) for upload in uploads]
+    names, error = [], None
+    for future in futures:
+        try:
+            names.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        for future in futures:
+            if future.exception() is None:
+                storage.delete(future.result())
+        raise error
+    return names
@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     QRCardViewSet, QRCardBatchViewSet, QRCardClientViewSet, 
-    PhotoUploadBatchViewSet, PhotoUploadSignedURLViewSet
+    PhotoUploadBatchViewSet, PhotoUploadSignedURLViewSet, StorageEventViewSet, batch_events
 )
 
 router = DefaultRouter()
@@ -11,7 +11,9 @@ router.register(r'qrcard-batches', QRCardBatchViewSet, basename='qrcardbatch')
 router.register(r'client', QRCardClientViewSet, basename='qrcard-client')
 router.register(r'photo-batches', PhotoUploadBatchViewSet, basename='photo-batch')
 router.register(r'upload', PhotoUploadSignedURLViewSet, basename='photo-upload')
+router.register(r'storage-events', StorageEventViewSet, basename='storage-event')
 
 urlpatterns = [
+    path('photo-batches/<int:pk>/events/', batch_events, name='photo-batch-events'),
     path('', include(router.urls)),
 ]
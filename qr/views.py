@@ -1,7 +1,12 @@
 from django.shortcuts import render, get_object_or_404
 from django.utils import timezone
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, F, Max
 from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
 import io
 import qrcode
 from reportlab.pdfgen import canvas
@@ -13,37 +18,64 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from .models import QRCard, QRCardBatch, QRCardPhoto, PhotoUploadBatch, RawPhotoUpload
 from .serializers import (
     QRCardSerializer, QRCardBatchSerializer, QRCardGenerationOptionsSerializer,
-    QRCardDetailSerializer, QRCardClientSerializer, QRCardPhotoSerializer,
-    PhotoUploadBatchSerializer, RawPhotoUploadSerializer
+    QRCardDetailSerializer, QRCardClientSerializer, QRCardListSerializer, QRCardPhotoSerializer,
+    PhotoUploadBatchSerializer, RawPhotoUploadSerializer, query_param_set
 )
 from projects.models import Project
-from .tasks import generate_qr_pdf_task, analyze_photo_batch_for_qr_codes
+from users.authentication import CookieJWTAuthentication
+from . import counters
+from .client_cache import get_client_card, invalidate_client_cards, set_client_card
+from .conditional import make_etag, not_modified, set_validators
+from .downloads import stream_photos_zip
+from .exports import EXPORT_FORMATS, export_cards, streaming_content
+from .pagination import KeysetPagination, PhotoKeysetPagination
+from .progress_events import batch_event_stream, batch_progress
+from .search import search_qr_cards
+from .storage_events import ingest_storage_event
+from .s3 import (
+    PutPresigner, abort_multipart_uploads, find_uploaded_objects, get_s3_client, list_uploaded_parts,
+    multipart_part_count, multipart_part_size, presign_upload_parts
+)
+from .fingerprints import find_exact_duplicate, find_exact_duplicates, fingerprint_file, register_fingerprint
+from .tasks import (
+    generate_qr_pdf_task, analyze_photo_batch_for_qr_codes, decode_raw_photo, generate_photo_derivatives,
+    copy_decode_result, read_exif_datetime, start_analysis_when_uploaded
+)
+from .upload_handlers import (
+    StoredUploadedFile, discard_upload, discard_uploads, save_uploads, stored_file, use_streaming_upload
+)
+import hmac
 import uuid
 import random
 import string
-import boto3
 from botocore.exceptions import ClientError
 import mimetypes
 from datetime import datetime, timedelta
 
 # Create your views here.
 
-def get_s3_client():
-    """Get configured S3 client"""
-    return boto3.client(
-        's3',
-        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        region_name=settings.AWS_S3_REGION_NAME
-    )
+def batch_s3_prefix(batch):
+    """Key prefix shared by every direct upload in a batch, so one listing covers the batch"""
+    return f"qr_photos/{batch.created_at.strftime('%Y/%m/%d')}/{batch.project_id}/{batch.id}/"
 
-def generate_s3_key(project_id, filename):
+def generate_s3_key(batch, filename):
     """Generate S3 key for photo upload"""
-    # Create a unique key with timestamp and UUID
-    timestamp = datetime.now().strftime('%Y/%m/%d')
+    # Unique key under the batch prefix
     unique_id = str(uuid.uuid4())[:8]
-    return f"qr_photos/{timestamp}/{project_id}/{unique_id}_{filename}"
+    return f"{batch_s3_prefix(batch)}{unique_id}_{filename}"
+
+def multipart_upload_info(raw_photo, part_numbers=None):
+    """Upload id, part size and presigned part URLs for a multipart direct upload"""
+    part_size = multipart_part_size(raw_photo.file_size)
+    if part_numbers is None:
+        part_numbers = range(1, multipart_part_count(raw_photo.file_size, part_size) + 1)
+    return {
+        'upload_id': raw_photo.multipart_upload_id,
+        'part_size': part_size,
+        'parts': presign_upload_parts(
+            settings.AWS_STORAGE_BUCKET_NAME, raw_photo.s3_key, raw_photo.multipart_upload_id, part_numbers
+        )
+    }
 
 class PhotoUploadSignedURLViewSet(viewsets.ViewSet):
     """ViewSet for generating S3 signed upload URLs"""
@@ -51,37 +83,62 @@ class PhotoUploadSignedURLViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['post'])
     def generate_upload_urls(self, request):
-        """Generate signed upload URLs for multiple photos"""
+        """
+        Generate signed upload URLs for multiple photos.
+
+        Large manifests can be sent in pages: the first request creates the
+        batch, later ones pass its batch_id to append more files to it. Files
+        of MULTIPART_UPLOAD_THRESHOLD bytes or more get a multipart upload
+        with presigned part URLs instead of a single PUT URL.
+        """
         project_id = request.data.get('project_id')
-        files = request.data.get('files', [])  # List of {filename, content_type, size}
+        batch_id = request.data.get('batch_id')
+        files = request.data.get('files', [])  # List of {filename, content_type, size, sha256?}
         batch_name = request.data.get('batch_name', 'Photo Batch')
         
-        if not project_id:
+        if not project_id and not batch_id:
             return Response({'error': 'project_id is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         if not files:
             return Response({'error': 'files list is required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        try:
-            project = Project.objects.get(id=project_id, user=request.user)
-        except Project.DoesNotExist:
-            return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+        max_files = getattr(settings, 'UPLOAD_URLS_MAX_FILES_PER_REQUEST', 5000)
+        if len(files) > max_files:
+            return Response({
+                'error': f'At most {max_files} files per request; send the rest in further requests with batch_id'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if batch_id:
+            try:
+                batch = PhotoUploadBatch.objects.select_related('project').get(
+                    id=batch_id, project__user=request.user
+                )
+            except PhotoUploadBatch.DoesNotExist:
+                return Response({'error': 'Batch not found'}, status=status.HTTP_404_NOT_FOUND)
+            if batch.status != 'uploading':
+                return Response({'error': 'Batch is no longer accepting uploads'}, status=status.HTTP_400_BAD_REQUEST)
+            project = batch.project
+        else:
+            try:
+                project = Project.objects.get(id=project_id, user=request.user)
+            except Project.DoesNotExist:
+                return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+            batch = None
         
-        # Create photo upload batch
-        batch = PhotoUploadBatch.objects.create(
-            project=project,
-            name=batch_name,
-            total_photos=len(files),
-            status='uploading'
+        # Clients may send a SHA-256 so files the project already has are never uploaded
+        known_hashes = find_exact_duplicates(
+            project, [(f.get('sha256') or '').lower() for f in files if f.get('sha256')]
         )
+        originals = RawPhotoUpload.objects.in_bulk(set(known_hashes.values()))
         
-        s3_client = get_s3_client()
-        upload_urls = []
+        accepted = []
+        # (filename, size, stored original or None, index in accepted of a repeat within this request)
+        repeated = []
+        seen_hashes = {}
         
         for file_info in files:
             filename = file_info.get('filename')
             content_type = file_info.get('content_type')
-            file_size = file_info.get('size', 0)
             
             if not filename or not content_type:
                 continue
@@ -90,47 +147,241 @@ class PhotoUploadSignedURLViewSet(viewsets.ViewSet):
             if not content_type.startswith('image/'):
                 continue
             
-            # Generate S3 key
-            s3_key = generate_s3_key(project_id, filename)
+            # Decides single PUT vs multipart and is stored, so it must be a real byte count
+            try:
+                file_size = int(file_info.get('size') or 0)
+            except (TypeError, ValueError):
+                file_size = -1
+            if file_size < 0:
+                return Response({'error': f'Invalid size for {filename}'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            sha256 = (file_info.get('sha256') or '').lower()
+            if sha256:
+                if known_hashes.get(sha256) in originals:
+                    repeated.append((filename, file_size, originals[known_hashes[sha256]], None))
+                    continue
+                if sha256 in seen_hashes:
+                    repeated.append((filename, file_size, None, seen_hashes[sha256]))
+                    continue
+                seen_hashes[sha256] = len(accepted)
             
-            # Create RawPhotoUpload record
-            raw_photo = RawPhotoUpload.objects.create(
+            accepted.append((filename, content_type, file_size))
+        
+        # Large originals go up as resumable multipart uploads
+        multipart_threshold = getattr(settings, 'MULTIPART_UPLOAD_THRESHOLD', 64 * 1024 * 1024)
+        
+        # The batch comes first because object keys live under its prefix
+        new_batch = batch is None
+        if new_batch:
+            batch = PhotoUploadBatch.objects.create(
+                project=project,
+                name=batch_name,
+                total_photos=0,
+                status='uploading'
+            )
+        
+        raw_photos = [
+            RawPhotoUpload(
                 batch=batch,
                 original_filename=filename,
                 file_size=file_size,
-                s3_key=s3_key,
+                s3_key=generate_s3_key(batch, filename),
                 is_processed=False
             )
+            for filename, content_type, file_size in accepted
+        ]
+        
+        # Duplicates keep their place in the batch (a repeated QR photo still starts its
+        # card's sequence) but are never uploaded: rows for files the project already has
+        # point at the stored original, repeats within the manifest share the key of the
+        # first copy and arrive, and are decoded, with it
+        duplicate_photos = []
+        for filename, file_size, original, index in repeated:
+            raw_photo = RawPhotoUpload(batch=batch, original_filename=filename, file_size=file_size, is_processed=False)
+            if original is not None:
+                raw_photo.image = original.image.name
+                raw_photo.duplicate_of = original
+                copy_decode_result(raw_photo, original)
+            else:
+                raw_photo.s3_key = raw_photos[index].s3_key
+            duplicate_photos.append(raw_photo)
+        
+        try:
+            # Sign locally with a cached signing key; one botocore call per request
+            # instead of one per file
+            presigner = PutPresigner(settings.AWS_STORAGE_BUCKET_NAME, expires_in=3600)
             
-            try:
-                # Generate presigned URL for upload (expires in 1 hour)
-                presigned_url = s3_client.generate_presigned_url(
-                    'put_object',
-                    Params={
-                        'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
-                        'Key': s3_key,
-                        'ContentType': content_type
-                    },
-                    ExpiresIn=3600  # 1 hour
+            # S3 round-trips stay outside the transaction, so no locks are held while they run
+            for raw_photo, (_, content_type, file_size) in zip(raw_photos, accepted):
+                if file_size >= multipart_threshold:
+                    raw_photo.multipart_upload_id = get_s3_client().create_multipart_upload(
+                        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                        Key=raw_photo.s3_key,
+                        ContentType=content_type
+                    )['UploadId']
+            
+            with transaction.atomic():
+                PhotoUploadBatch.objects.filter(id=batch.id).update(
+                    total_photos=F('total_photos') + len(raw_photos) + len(duplicate_photos),
+                    updated_at=timezone.now()
                 )
-                
-                upload_urls.append({
-                    'photo_id': raw_photo.id,
-                    'filename': filename,
-                    'upload_url': presigned_url,
-                    's3_key': s3_key,
-                    'content_type': content_type
-                })
-                
-            except ClientError as e:
+                RawPhotoUpload.objects.bulk_create(raw_photos, batch_size=1000)
+                for raw_photo, (_, _, _, index) in zip(duplicate_photos, repeated):
+                    if index is not None:
+                        raw_photo.duplicate_of = raw_photos[index]
+                RawPhotoUpload.objects.bulk_create(duplicate_photos, batch_size=1000)
+        except Exception as e:
+            # Nothing refers to the multipart uploads started so far; have S3 drop them
+            abort_multipart_uploads(settings.AWS_STORAGE_BUCKET_NAME, [
+                (raw_photo.s3_key, raw_photo.multipart_upload_id)
+                for raw_photo in raw_photos if raw_photo.multipart_upload_id
+            ])
+            if new_batch:
+                batch.delete()
+            if isinstance(e, ClientError):
                 return Response({'error': f'Failed to generate upload URL: {str(e)}'}, 
                               status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            raise
+        
+        upload_urls = []
+        for raw_photo, (_, content_type, _) in zip(raw_photos, accepted):
+            upload = {
+                'photo_id': raw_photo.id,
+                'filename': raw_photo.original_filename,
+                's3_key': raw_photo.s3_key,
+                'content_type': content_type
+            }
+            if raw_photo.multipart_upload_id:
+                upload['multipart'] = multipart_upload_info(raw_photo)
+            else:
+                upload['upload_url'] = presigner.url(raw_photo.s3_key, content_type)
+            upload_urls.append(upload)
+        
+        # Stored originals that weren't decoded yet when this request was made
+        for raw_photo in duplicate_photos:
+            if raw_photo.image and raw_photo.decoded_at is None:
+                decode_raw_photo.delay(raw_photo.id)
+        duplicates = [
+            {'photo_id': raw_photo.id, 'filename': raw_photo.original_filename, 'duplicate_of': raw_photo.duplicate_of_id}
+            for raw_photo in duplicate_photos
+        ]
         
         return Response({
             'batch_id': batch.id,
-            'upload_urls': upload_urls
+            'upload_urls': upload_urls,
+            'duplicates': duplicates
+        }, status=status.HTTP_200_OK)
+    
+    def get_multipart_photo(self, request):
+        """Returns (raw_photo, error_response) for the multipart upload named by photo_id"""
+        photo_id = request.data.get('photo_id')
+        if not photo_id:
+            return None, Response({'error': 'photo_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            raw_photo = RawPhotoUpload.objects.get(id=photo_id, batch__project__user=request.user)
+        except RawPhotoUpload.DoesNotExist:
+            return None, Response({'error': 'Photo not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if not raw_photo.multipart_upload_id:
+            return None, Response({'error': 'Photo has no multipart upload in progress'}, 
+                                  status=status.HTTP_400_BAD_REQUEST)
+        return raw_photo, None
+    
+    @action(detail=False, methods=['post'])
+    def multipart_status(self, request):
+        """List the parts S3 already has and presign URLs for the rest, to resume an upload"""
+        raw_photo, error = self.get_multipart_photo(request)
+        if error:
+            return error
+        
+        try:
+            uploaded_parts = list_uploaded_parts(
+                settings.AWS_STORAGE_BUCKET_NAME, raw_photo.s3_key, raw_photo.multipart_upload_id
+            )
+            part_size = multipart_part_size(raw_photo.file_size)
+            uploaded = {part['part_number'] for part in uploaded_parts}
+            missing = [
+                number for number in range(1, multipart_part_count(raw_photo.file_size, part_size) + 1)
+                if number not in uploaded
+            ]
+            info = multipart_upload_info(raw_photo, missing)
+        except ClientError as e:
+            return Response({'error': f'Failed to read multipart upload: {str(e)}'}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return Response({
+            'photo_id': raw_photo.id,
+            'uploaded_parts': uploaded_parts,
+            **info
         }, status=status.HTTP_200_OK)
     
+    @action(detail=False, methods=['post'])
+    def complete_multipart(self, request):
+        """Assemble an uploaded multipart file; confirm_uploads then picks it up as usual"""
+        raw_photo, error = self.get_multipart_photo(request)
+        if error:
+            return error
+        
+        bucket = settings.AWS_STORAGE_BUCKET_NAME
+        s3_client = get_s3_client()
+        try:
+            # S3's own part list is authoritative; clients don't have to track ETags
+            parts = list_uploaded_parts(bucket, raw_photo.s3_key, raw_photo.multipart_upload_id)
+            expected = multipart_part_count(raw_photo.file_size, multipart_part_size(raw_photo.file_size))
+            uploaded = {part['part_number'] for part in parts}
+            missing = [number for number in range(1, expected + 1) if number not in uploaded]
+            if missing:
+                return Response({
+                    'error': 'Not all parts have been uploaded',
+                    'missing_parts': missing
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            s3_client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=raw_photo.s3_key,
+                UploadId=raw_photo.multipart_upload_id,
+                MultipartUpload={'Parts': [
+                    {'PartNumber': part['part_number'], 'ETag': part['etag']} for part in parts
+                ]}
+            )
+        except ClientError as e:
+            return Response({'error': f'Failed to complete multipart upload: {str(e)}'}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        raw_photo.multipart_upload_id = None
+        raw_photo.save(update_fields=['multipart_upload_id', 'updated_at'])
+        
+        return Response({
+            'photo_id': raw_photo.id,
+            's3_key': raw_photo.s3_key,
+            'completed': True
+        }, status=status.HTTP_200_OK)
+    
+    @action(detail=False, methods=['post'])
+    def abort_multipart(self, request):
+        """Abort a multipart upload so S3 discards its parts"""
+        raw_photo, error = self.get_multipart_photo(request)
+        if error:
+            return error
+        
+        try:
+            get_s3_client().abort_multipart_upload(
+                Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                Key=raw_photo.s3_key,
+                UploadId=raw_photo.multipart_upload_id
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                return Response({'error': f'Failed to abort multipart upload: {str(e)}'}, 
+                              status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        raw_photo.multipart_upload_id = None
+        raw_photo.processing_error = 'Upload aborted'
+        raw_photo.save(update_fields=['multipart_upload_id', 'processing_error', 'updated_at'])
+        
+        return Response({'photo_id': raw_photo.id, 'aborted': True}, status=status.HTTP_200_OK)
+    
     @action(detail=False, methods=['post'])
     def confirm_uploads(self, request):
         """Confirm completed uploads and start QR code analysis"""
@@ -146,80 +397,146 @@ class PhotoUploadSignedURLViewSet(viewsets.ViewSet):
             return Response({'error': 'Batch not found'}, status=status.HTTP_404_NOT_FOUND)
         
         # Update raw photo records for completed uploads
-        s3_client = get_s3_client()
-        successful_uploads = 0
+        raw_photos = list(
+            RawPhotoUpload.objects.filter(batch=batch, id__in=completed_uploads, s3_key__isnull=False)
+            .only('id', 's3_key', 'file_size')
+        )
         
-        for photo_id in completed_uploads:
-            try:
-                raw_photo = RawPhotoUpload.objects.get(id=photo_id, batch=batch)
-                
-                # Verify file exists in S3
-                try:
-                    s3_client.head_object(
-                        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-                        Key=raw_photo.s3_key
-                    )
-                    
-                    # Update the image field with S3 URL
-                    raw_photo.image.name = raw_photo.s3_key
-                    raw_photo.is_processed = False  # Will be processed by Celery task
-                    raw_photo.save()
-                    successful_uploads += 1
-                    
-                except ClientError:
-                    # File not found in S3, mark as failed
-                    raw_photo.processing_error = "File not found in S3 after upload"
-                    raw_photo.save()
-                    
-            except RawPhotoUpload.DoesNotExist:
-                continue
+        # Verify files exist in S3: one listing of the batch prefix per 1,000
+        # objects rather than a HEAD per photo
+        try:
+            uploaded = find_uploaded_objects(
+                settings.AWS_STORAGE_BUCKET_NAME,
+                [raw_photo.s3_key for raw_photo in raw_photos],
+                prefix=batch_s3_prefix(batch)
+            )
+        except ClientError as e:
+            return Response({'error': f'Failed to verify uploads: {str(e)}'}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        # Update batch status
-        batch.total_photos = successful_uploads
-        if successful_uploads > 0:
-            batch.status = 'analyzing'
-            batch.save()
-            
-            # Start QR code analysis
-            task = analyze_photo_batch_for_qr_codes.delay(batch.id)
-            
-            return Response({
-                'batch_id': batch.id,
-                'successful_uploads': successful_uploads,
-                'analysis_started': True,
-                'task_id': task.id
-            }, status=status.HTTP_200_OK)
-        else:
-            batch.status = 'failed'
-            batch.error_message = 'No files were successfully uploaded'
-            batch.save()
-            
+        confirmed_ids = [raw_photo.id for raw_photo in raw_photos if raw_photo.s3_key in uploaded]
+        # Duplicates within a manifest share their first copy's key (see generate_upload_urls)
+        confirmed_keys = {raw_photo.s3_key for raw_photo in raw_photos if raw_photo.s3_key in uploaded}
+        missing_keys = {raw_photo.s3_key for raw_photo in raw_photos if raw_photo.s3_key not in uploaded}
+        # Only sizes differ per row; bulk_update just the rows where the client's size was wrong
+        resized = []
+        for raw_photo in raw_photos:
+            size = uploaded.get(raw_photo.s3_key)
+            if size is not None and size != raw_photo.file_size:
+                raw_photo.file_size = size
+                resized.append(raw_photo)
+        
+        with transaction.atomic():
+            # Claimed like a storage event (qr.storage_events): only rows not marked arrived
+            # yet, locked so a concurrent event can't claim and decode them as well
+            now = timezone.now()
+            claimed = list(
+                RawPhotoUpload.objects.select_for_update()
+                .filter(batch=batch, s3_key__in=confirmed_keys, image='').values_list('id', flat=True)
+            )
+            RawPhotoUpload.objects.filter(id__in=claimed).update(
+                image=F('s3_key'), multipart_upload_id=None, processing_error=None, updated_at=now
+            )
+            # File not found in S3, mark as failed
+            RawPhotoUpload.objects.filter(batch=batch, s3_key__in=missing_keys).update(
+                processing_error="File not found in S3 after upload", updated_at=now
+            )
+            RawPhotoUpload.objects.bulk_update(resized, ['file_size'], batch_size=1000)
+            # The client is done with the batch: uploads it didn't confirm and that
+            # never arrived would otherwise hold the analysis until the sweeper runs
+            unconfirmed = RawPhotoUpload.objects.filter(
+                batch=batch, image='', processing_error__isnull=True
+            ).exclude(s3_key__in=confirmed_keys)
+            multipart_uploads = list(
+                unconfirmed.filter(multipart_upload_id__isnull=False).values_list('s3_key', 'multipart_upload_id')
+            )
+            unconfirmed.update(processing_error='Upload not confirmed', multipart_upload_id=None, updated_at=now)
+        if multipart_uploads:
+            abort_multipart_uploads(settings.AWS_STORAGE_BUCKET_NAME, multipart_uploads)
+        successful_uploads = len(confirmed_ids)
+        
+        # A batch of nothing but duplicates has no uploads but is ready all the same
+        if successful_uploads == 0 and not RawPhotoUpload.objects.filter(batch=batch).exclude(image='').exists():
+            PhotoUploadBatch.objects.filter(id=batch.id, status='uploading').update(
+                status='failed', error_message='No files were successfully uploaded', updated_at=timezone.now()
+            )
             return Response({
                 'error': 'No files were successfully uploaded',
                 'batch_id': batch.id
             }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Same path as storage events: decode each arrived photo, and the last
+        # decode (or this call, when nothing is left) starts the analysis
+        for raw_photo_id in claimed:
+            decode_raw_photo.delay(raw_photo_id)
+        analysis_started = start_analysis_when_uploaded(batch.id)
+        
+        return Response({
+            'batch_id': batch.id,
+            'successful_uploads': successful_uploads,
+            'decoding': len(claimed),
+            'analysis_started': analysis_started
+        }, status=status.HTTP_200_OK)
+
+class StorageEventViewSet(viewsets.ViewSet):
+    """
+    Webhook for S3/MinIO bucket notifications (see qr.storage_events).
+    The sender authenticates with STORAGE_WEBHOOK_TOKEN, either as the
+    Authorization header (MinIO auth_token) or a ?token= query parameter (SNS).
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    
+    def create(self, request):
+        expected = getattr(settings, 'STORAGE_WEBHOOK_TOKEN', '')
+        if not expected:
+            return Response({'error': 'Storage webhook is not configured'}, status=status.HTTP_403_FORBIDDEN)
+        
+        token = request.META.get('HTTP_AUTHORIZATION', '') or request.query_params.get('token', '')
+        if token.startswith('Bearer '):
+            token = token[len('Bearer '):]
+        if not hmac.compare_digest(token.encode(), expected.encode()):
+            return Response({'error': 'Invalid token'}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            # SNS posts JSON as text/plain, so parse the raw body rather than request.data
+            result = ingest_storage_event(request.body)
+        except (ValueError, AttributeError) as e:
+            return Response({'error': f'Invalid event payload: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(result, status=status.HTTP_200_OK)
 
 class QRCardBatchViewSet(viewsets.ModelViewSet):
     serializer_class = QRCardBatchSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         queryset = QRCardBatch.objects.filter(project__user=self.request.user)
         project_id = self.request.query_params.get('project')
         if project_id:
             queryset = queryset.filter(project_id=project_id)
-        return queryset.order_by('-created_at')
+        return queryset.order_by('-created_at', 'id')
 
 class QRCardViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return QRCardDetailSerializer
+        if self.action == 'list':
+            return QRCardListSerializer
         return QRCardSerializer
 
     def get_queryset(self):
-        queryset = QRCard.objects.filter(project__user=self.request.user).select_related('batch', 'project').prefetch_related('photos')
+        queryset = QRCard.objects.filter(project__user=self.request.user)
+        if self.action == 'list':
+            queryset = queryset.only(*QRCardListSerializer.model_fields)
+            if 'photos' in query_param_set(self.request, 'expand'):
+                queryset = queryset.prefetch_related('photos')
+        elif self.action != 'export':
+            queryset = queryset.select_related('batch', 'project').prefetch_related('photos')
         
         # Filter by project
         project_id = self.request.query_params.get('project')
@@ -234,50 +551,68 @@ class QRCardViewSet(viewsets.ModelViewSet):
         # Search functionality
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(code__icontains=search) |
-                Q(client_email__icontains=search) |
-                Q(client_name__icontains=search) |
-                Q(location_name__icontains=search) |
-                Q(session_notes__icontains=search)
-            )
+            queryset = search_qr_cards(queryset, search)
         
         # Filter by status
         status_filter = self.request.query_params.get('status')
         if status_filter:
             queryset = queryset.filter(status=status_filter)
         
-        return queryset.order_by('-created_at')
+        return queryset.order_by('-created_at', 'id')
 
     @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def upload_photos(self, request, pk=None):
         """Upload photos for a specific QR card"""
+        # Checked before the body is read, since streamed photos are stored while it is parsed
         qr_card = self.get_object()
         
-        if 'photos' not in request.FILES:
+        # Photos go straight to storage while the body is read (see qr.upload_handlers)
+        handler = use_streaming_upload(request, QRCardPhoto._meta.get_field('image'))
+        try:
+            files = request.FILES
+        except Exception:
+            handler.discard()
+            raise
+        
+        if 'photos' not in files:
             return Response({'error': 'No photos provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        photos = request.FILES.getlist('photos')
-        uploaded_photos = []
+        # Validate file type
+        photos = [photo for photo in files.getlist('photos') if photo.content_type.startswith('image/')]
         
-        for photo in photos:
-            # Validate file type
-            if not photo.content_type.startswith('image/'):
-                continue
-            
-            photo_obj = QRCardPhoto.objects.create(
-                qr_card=qr_card,
-                image=photo,
-                original_filename=photo.name,
-                file_size=photo.size
-            )
-            uploaded_photos.append(photo_obj)
+        # Write all files to storage concurrently, then insert the rows in one go
+        try:
+            stored_names = save_uploads(photos, QRCardPhoto._meta.get_field('image'))
+        except Exception as e:
+            return Response({'error': f'Failed to store photos: {str(e)}'}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        try:
+            uploaded_photos = QRCardPhoto.objects.bulk_create([
+                QRCardPhoto(
+                    qr_card=qr_card,
+                    image=stored_name,
+                    original_filename=photo.name,
+                    file_size=photo.size
+                )
+                for photo, stored_name in zip(photos, stored_names)
+            ])
+        except Exception:
+            for stored_name in stored_names:
+                QRCardPhoto._meta.get_field('image').storage.delete(stored_name)
+            raise
+        for photo_obj in uploaded_photos:
+            generate_photo_derivatives.delay(photo_obj.id)
+        # bulk_create sends no post_save
+        invalidate_client_cards([qr_card.code])
+        counters.photos_added(qr_card.id, len(uploaded_photos))
         
         # Update QR card status and timestamp
-        if uploaded_photos and qr_card.status in ['distributed', 'scanned', 'info_provided']:
-            qr_card.status = 'photos_uploaded'
-            qr_card.photos_uploaded_at = timezone.now()
-            qr_card.save()
+        if uploaded_photos:
+            counters.change_card_status(
+                qr_card, 'photos_uploaded', ['distributed', 'scanned', 'info_provided'],
+                photos_uploaded_at=timezone.now()
+            )
         
         serializer = QRCardPhotoSerializer(uploaded_photos, many=True)
         return Response({
@@ -300,21 +635,37 @@ class QRCardViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(qr_card)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the cards matching the list filters as CSV or NDJSON
+        (?file_format=csv|ndjson); ?has_client_info=true keeps only cards with a client email
+        """
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"file_format must be one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        queryset = self.get_queryset()
+        if request.query_params.get('has_client_info') in ('1', 'true'):
+            queryset = queryset.exclude(client_email__isnull=True).exclude(client_email='')
+        
+        filename = f"qr-cards-{timezone.localdate().isoformat()}"
+        return export_cards(request, queryset, file_format, filename)
+
     @action(detail=True, methods=['post'])
     def mark_completed(self, request, pk=None):
         """Mark QR card as completed (photos delivered)"""
         qr_card = self.get_object()
         
-        if qr_card.status != 'photos_uploaded':
+        if not counters.change_card_status(qr_card, 'completed', ['photos_uploaded'], completed_at=timezone.now()):
             return Response(
                 {'error': 'QR card must have photos uploaded before marking as completed'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        qr_card.status = 'completed'
-        qr_card.completed_at = timezone.now()
-        qr_card.save()
-        
         serializer = self.get_serializer(qr_card)
         return Response(serializer.data)
 
@@ -380,19 +731,57 @@ class QRCardClientViewSet(viewsets.ReadOnlyModelViewSet):
         if not pin:
             return Response({'error': 'PIN is required'}, status=status.HTTP_400_BAD_REQUEST)
         
+        entry = get_client_card(code, pin)
+        if entry is None:
+            entry = self.load_client_card(code, pin)
+            if entry is None:
+                return Response({'error': 'Invalid QR code or PIN'}, status=status.HTTP_404_NOT_FOUND)
+        
+        response = not_modified(request, entry['etag'], entry['cached_at'])
+        if response is None:
+            response = set_validators(Response(entry['data']), entry['etag'], entry['cached_at'])
+        return response
+    
+    def load_client_card(self, code, pin):
+        """Serialize a card from the database (recording its first scan) and cache it"""
         try:
-            qr_card = QRCard.objects.get(code=code, access_pin=pin)
+            qr_card = QRCard.objects.select_related('project').prefetch_related('photos').get(code=code, access_pin=pin)
         except QRCard.DoesNotExist:
-            return Response({'error': 'Invalid QR code or PIN'}, status=status.HTTP_404_NOT_FOUND)
+            return None
         
-        # Update status if first scan
+        # Update status if first scan; conditional so concurrent first views write once
         if qr_card.status == 'distributed':
-            qr_card.status = 'scanned'
-            qr_card.scanned_at = timezone.now()
-            qr_card.save()
+            counters.change_card_status(qr_card, 'scanned', ['distributed'], scanned_at=timezone.now())
         
         serializer = self.get_serializer(qr_card)
-        return Response(serializer.data)
+        return set_client_card(qr_card, serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Stream a ZIP of all original photos for the card"""
+        code = pk
+        pin = request.query_params.get('pin')
+        
+        if not pin:
+            return Response({'error': 'PIN is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            qr_card = QRCard.objects.get(code=code, access_pin=pin)
+        except QRCard.DoesNotExist:
+            return Response({'error': 'Invalid QR code or PIN'}, status=status.HTTP_404_NOT_FOUND)
+        
+        photos = qr_card.photos.only(
+            'image', 'original_filename', 'taken_at', 'uploaded_at', 'file_size'
+        ).order_by('taken_at', 'uploaded_at', 'id')
+        if not photos.exists():
+            return Response({'error': 'No photos available yet'}, status=status.HTTP_404_NOT_FOUND)
+        
+        response = StreamingHttpResponse(
+            streaming_content(request, stream_photos_zip(photos.iterator(chunk_size=100))),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = f'attachment; filename="photos-{qr_card.short_code}.zip"'
+        return response
     
     @action(detail=True, methods=['post'])
     def provide_info(self, request, pk=None):
@@ -412,12 +801,11 @@ class QRCardClientViewSet(viewsets.ReadOnlyModelViewSet):
         qr_card.client_email = request.data.get('email')
         qr_card.client_name = request.data.get('name')
         qr_card.client_phone = request.data.get('phone', '')
+        qr_card.save(update_fields=['client_email', 'client_name', 'client_phone'])
         
-        if qr_card.status in ['distributed', 'scanned']:
-            qr_card.status = 'info_provided'
-            qr_card.info_provided_at = timezone.now()
-        
-        qr_card.save()
+        counters.change_card_status(
+            qr_card, 'info_provided', ['distributed', 'scanned'], info_provided_at=timezone.now()
+        )
         
         serializer = self.get_serializer(qr_card)
         return Response(serializer.data)
@@ -425,6 +813,7 @@ class QRCardClientViewSet(viewsets.ReadOnlyModelViewSet):
 class PhotoUploadBatchViewSet(viewsets.ModelViewSet):
     serializer_class = PhotoUploadBatchSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
     parser_classes = [MultiPartParser, FormParser]
 
     def get_queryset(self):
@@ -432,66 +821,125 @@ class PhotoUploadBatchViewSet(viewsets.ModelViewSet):
         project_id = self.request.query_params.get('project')
         if project_id:
             queryset = queryset.filter(project_id=project_id)
-        return queryset.order_by('-created_at')
+        return queryset.order_by('-created_at', 'id')
 
     @action(detail=False, methods=['post'])
     def upload_photos(self, request):
         """Upload photos for QR code analysis"""
-        project_id = request.data.get('project')
-        batch_name = request.data.get('name', 'Photo Batch')
+        # The project is checked before the body is read: streamed photos are stored
+        # while it is parsed. A `project` form field still works, but then the photos
+        # are spooled by the default handlers and only stored after the check.
+        project_id = request.query_params.get('project')
+        streamed = bool(project_id)
+        if not streamed:
+            project_id = request.data.get('project')
         
         if not project_id:
             return Response({'error': 'Project ID is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             project = Project.objects.get(id=project_id, user=request.user)
-        except Project.DoesNotExist:
+        except (Project.DoesNotExist, ValueError):
             return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        if 'photos' not in request.FILES:
-            return Response({'error': 'No photos provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if streamed:
+            # Photos go straight to storage while the body is read (see qr.upload_handlers)
+            handler = use_streaming_upload(request, RawPhotoUpload._meta.get_field('image'))
+            try:
+                photos = request.FILES.getlist('photos')
+            except Exception:
+                handler.discard()
+                raise
+        else:
+            photos = request.FILES.getlist('photos')
+        batch_name = request.data.get('name', 'Photo Batch')
         
-        photos = request.FILES.getlist('photos')
         if not photos:
             return Response({'error': 'No photos provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create batch
-        batch = PhotoUploadBatch.objects.create(
-            project=project,
-            name=batch_name,
-            total_photos=len(photos)
-        )
-        
         uploaded_photos = []
+        duplicates = []
+        # Content hash -> raw photo stored by this request
+        seen_hashes = {}
+        # Files the default handlers' uploads were saved as by RawPhotoUpload.objects.create()
+        saved_names = []
         
-        for photo in photos:
-            # Validate file type
-            if not photo.content_type.startswith('image/'):
-                continue
-            
-            # Create raw photo upload
-            raw_photo = RawPhotoUpload.objects.create(
-                batch=batch,
-                image=photo,
-                original_filename=photo.name,
-                file_size=photo.size
-            )
-            
-            # Try to extract EXIF datetime
-            try:
-                from .tasks import extract_exif_datetime
-                taken_at = extract_exif_datetime(raw_photo.image)
-                if taken_at:
-                    raw_photo.taken_at = taken_at
-                    raw_photo.save()
-            except:
-                pass
-            
-            uploaded_photos.append(raw_photo)
-        
-        # Update batch with actual count
-        batch.total_photos = len(uploaded_photos)
-        batch.save()
+        try:
+            with transaction.atomic():
+                # Create batch
+                batch = PhotoUploadBatch.objects.create(
+                    project=project,
+                    name=batch_name,
+                    total_photos=len(photos)
+                )
+                
+                for photo in photos:
+                    # Validate file type
+                    if not photo.content_type.startswith('image/'):
+                        continue
+                    
+                    if isinstance(photo, StoredUploadedFile):
+                        # Hashed while streaming; the perceptual hash is left to the analysis worker
+                        content_hash, perceptual_hash = photo.sha256, ''
+                    else:
+                        content_hash, perceptual_hash = fingerprint_file(photo)
+                    
+                    # Files this project already has keep their place in the batch (a repeated
+                    # QR photo still starts its card's sequence) but point at the stored original
+                    original = seen_hashes.get(content_hash)
+                    if original is None:
+                        original_id = find_exact_duplicate(project, content_hash)
+                        original = RawPhotoUpload.objects.filter(id=original_id).first() if original_id else None
+                    if original is not None:
+                        discard_upload(photo)
+                        raw_photo = RawPhotoUpload(
+                            batch=batch,
+                            image=original.image.name,
+                            original_filename=photo.name,
+                            file_size=photo.size,
+                            duplicate_of=original
+                        )
+                        copy_decode_result(raw_photo, original)
+                        raw_photo.save()
+                        duplicates.append({
+                            'photo_id': raw_photo.id, 'filename': raw_photo.original_filename, 'duplicate_of': original.id
+                        })
+                        uploaded_photos.append(raw_photo)
+                        continue
+                    
+                    # EXIF from the captured header, without reading the stored file back
+                    taken_at = read_exif_datetime(
+                        io.BytesIO(photo.head) if isinstance(photo, StoredUploadedFile) else photo
+                    )
+                    
+                    # Create raw photo upload
+                    raw_photo = RawPhotoUpload.objects.create(
+                        batch=batch,
+                        image=stored_file(photo),
+                        original_filename=photo.name,
+                        file_size=photo.size,
+                        taken_at=taken_at,
+                        content_hash=content_hash,
+                        perceptual_hash=perceptual_hash
+                    )
+                    if not isinstance(photo, StoredUploadedFile):
+                        saved_names.append(raw_photo.image.name)
+                    if register_fingerprint(raw_photo, project, content_hash, perceptual_hash):
+                        # Lost a race with a concurrent upload of the same file
+                        raw_photo.save(update_fields=['duplicate_of', 'updated_at'])
+                    seen_hashes[content_hash] = raw_photo
+                    
+                    uploaded_photos.append(raw_photo)
+                
+                # Update batch with actual count
+                batch.total_photos = len(uploaded_photos)
+                batch.save()
+        except Exception:
+            # The rows were rolled back, so nothing refers to the files stored so far
+            discard_uploads(photos)
+            for name in saved_names:
+                RawPhotoUpload._meta.get_field('image').storage.delete(name)
+            raise
         
         # Start QR code analysis
         task = analyze_photo_batch_for_qr_codes.delay(batch.id)
@@ -499,16 +947,38 @@ class PhotoUploadBatchViewSet(viewsets.ModelViewSet):
         return Response({
             'batch_id': batch.id,
             'photos_uploaded': len(uploaded_photos),
+            'duplicates': duplicates,
             'analysis_started': True,
             'task_id': task.id
         }, status=status.HTTP_201_CREATED)
     
+    def batch_version(self, pk, with_photos=False):
+        """(etag, last_modified) of a batch, optionally including its photos, in one query; None if not found"""
+        queryset = self.get_queryset().filter(pk=pk)
+        if with_photos:
+            queryset = queryset.annotate(
+                photos_updated_at=Max('raw_photos__updated_at'), photos_total=Count('raw_photos')
+            )
+            row = queryset.values_list('updated_at', 'photos_updated_at', 'photos_total').first()
+        else:
+            row = queryset.values_list('updated_at').first()
+        if row is None:
+            return None
+        last_modified = max(value for value in row[:2] if value is not None)
+        return make_etag(pk, *row), last_modified
+    
     @action(detail=True, methods=['get'])
     def progress(self, request, pk=None):
         """Get upload batch progress"""
+        version = self.batch_version(pk)
+        if version is not None:
+            response = not_modified(request, *version)
+            if response is not None:
+                return response
+        
         batch = self.get_object()
         
-        return Response({
+        return set_validators(Response({
             'id': batch.id,
             'name': batch.name,
             'status': batch.status,
@@ -519,14 +989,27 @@ class PhotoUploadBatchViewSet(viewsets.ModelViewSet):
             'error_message': batch.error_message,
             'created_at': batch.created_at,
             'completed_at': batch.completed_at
-        })
+        }), make_etag(pk, batch.updated_at), batch.updated_at)
     
     @action(detail=True, methods=['get'])
     def photos(self, request, pk=None):
-        """Get photos in the batch with their assignments"""
+        """Get photos in the batch with their assignments; ?unprocessed=true for those not analysed yet"""
+        version = self.batch_version(pk, with_photos=True)
+        if version is not None:
+            # The page depends on the cursor and filters as well as the data
+            etag, last_modified = make_etag(request.get_full_path(), version[0]), version[1]
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
+        
         batch = self.get_object()
         
-        raw_photos = batch.raw_photos.select_related('assigned_qr_card').order_by('taken_at', 'uploaded_at')
+        raw_photos = batch.raw_photos.select_related('assigned_qr_card')
+        if request.query_params.get('unprocessed') in ('1', 'true'):
+            raw_photos = raw_photos.filter(is_processed=False)
+        
+        paginator = PhotoKeysetPagination()
+        raw_photos = paginator.paginate_queryset(raw_photos, request)
         
         photos_data = []
         for photo in raw_photos:
@@ -544,15 +1027,52 @@ class PhotoUploadBatchViewSet(viewsets.ModelViewSet):
                     'access_pin': photo.assigned_qr_card.access_pin
                 } if photo.assigned_qr_card else None,
                 'is_processed': photo.is_processed,
-                'processing_error': photo.processing_error
+                'processing_error': photo.processing_error,
+                'duplicate_of': photo.duplicate_of_id,
+                'near_duplicate_of': photo.near_duplicate_of_id
             })
         
-        return Response({
+        response = Response({
             'batch': {
                 'id': batch.id,
                 'name': batch.name,
                 'status': batch.status,
                 'progress_percentage': batch.progress_percentage
             },
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
             'photos': photos_data
         })
+        if version is not None:
+            set_validators(response, etag, last_modified)
+        return response
+
+
+@require_GET
+async def batch_events(request, pk):
+    """
+    Server-Sent Events stream of a photo batch's progress and photo
+    assignments (see qr.progress_events). Plain async view rather than a
+    viewset action so it holds no worker thread while idle; served by the
+    ASGI `events` process.
+    """
+    try:
+        authenticated = await sync_to_async(CookieJWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'error': str(e.detail)}, status=401)
+    if authenticated is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided.'}, status=401)
+    
+    batch = await PhotoUploadBatch.objects.filter(pk=pk, project__user=authenticated[0]).afirst()
+    if batch is None:
+        return JsonResponse({'error': 'Batch not found'}, status=404)
+    
+    async def load_snapshot():
+        await batch.arefresh_from_db()
+        return batch_progress(batch)
+    
+    response = StreamingHttpResponse(batch_event_stream(batch.id, load_snapshot), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx and similar proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
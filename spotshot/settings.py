@@ -22,6 +22,7 @@ if is_production:
     # Production settings - inline to avoid import issues
     from pathlib import Path
     from datetime import timedelta
+    from celery.schedules import crontab
     
     # Build paths inside the project like this: BASE_DIR / 'subdir'.
     BASE_DIR = Path(__file__).resolve().parent.parent
@@ -205,6 +206,40 @@ if is_production:
     CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
     CELERY_RESULT_BACKEND = CELERY_BROKER_URL
     
+    # Periodic tasks (celery beat)
+    FUNNEL_REFRESH_INTERVAL = int(os.environ.get('FUNNEL_REFRESH_INTERVAL', 900))
+    UPLOAD_SWEEP_INTERVAL = int(os.environ.get('UPLOAD_SWEEP_INTERVAL', 900))
+    CELERY_BEAT_SCHEDULE = {
+        'refresh-project-funnels': {
+            'task': 'qr.tasks.refresh_project_funnels',
+            'schedule': FUNNEL_REFRESH_INTERVAL,
+        },
+        # Every day from scratch, for cards deleted after their days left the refresh window
+        'rebuild-project-funnels': {
+            'task': 'qr.tasks.refresh_project_funnels',
+            'schedule': crontab(hour=3, minute=0),
+            'kwargs': {'full': True},
+        },
+        # Direct uploads that never arrived (see qr.tasks.expire_stale_uploads)
+        'expire-stale-uploads': {
+            'task': 'qr.tasks.expire_stale_uploads',
+            'schedule': UPLOAD_SWEEP_INTERVAL,
+        },
+    }
+    
+    # Cache (client card payloads, see qr.client_cache)
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_CACHE_URL', CELERY_BROKER_URL),
+            'KEY_PREFIX': 'spotshot',
+            # A slow or unreachable cache should cost a miss, not a hung request
+            'OPTIONS': {'socket_connect_timeout': 1, 'socket_timeout': 1},
+        }
+    }
+    CLIENT_CARD_CACHE_TIMEOUT = int(os.environ.get('CLIENT_CARD_CACHE_TIMEOUT', 300))
+    USER_STATS_CACHE_TIMEOUT = int(os.environ.get('USER_STATS_CACHE_TIMEOUT', 60))
+    
     # S3 Storage settings (Bucketeer support)
     USE_S3 = get_env('USE_S3', default=False, cast=bool)
     
@@ -277,6 +312,8 @@ if is_production:
     
     # SpotShoot Configuration
     FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
+    # Shared secret for bucket notification webhooks (/api/storage-events/)
+    STORAGE_WEBHOOK_TOKEN = os.environ.get('STORAGE_WEBHOOK_TOKEN', '')
     
     # Logging configuration for production
     LOGGING = {
@@ -320,6 +357,7 @@ else:
         # Fallback to basic development settings if config module fails
         from pathlib import Path
         from datetime import timedelta
+        from celery.schedules import crontab
         
         BASE_DIR = Path(__file__).resolve().parent.parent
         
@@ -421,4 +459,40 @@ else:
         
         CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
         CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+        
+        # Periodic tasks (celery beat)
+        FUNNEL_REFRESH_INTERVAL = int(os.environ.get('FUNNEL_REFRESH_INTERVAL', 900))
+        UPLOAD_SWEEP_INTERVAL = int(os.environ.get('UPLOAD_SWEEP_INTERVAL', 900))
+        CELERY_BEAT_SCHEDULE = {
+            'refresh-project-funnels': {
+                'task': 'qr.tasks.refresh_project_funnels',
+                'schedule': FUNNEL_REFRESH_INTERVAL,
+            },
+            # Every day from scratch, for cards deleted after their days left the refresh window
+            'rebuild-project-funnels': {
+                'task': 'qr.tasks.refresh_project_funnels',
+                'schedule': crontab(hour=3, minute=0),
+                'kwargs': {'full': True},
+            },
+            # Direct uploads that never arrived (see qr.tasks.expire_stale_uploads)
+            'expire-stale-uploads': {
+                'task': 'qr.tasks.expire_stale_uploads',
+                'schedule': UPLOAD_SWEEP_INTERVAL,
+            },
+        }
+        
+        # Cache (client card payloads, see qr.client_cache)
+        CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCATION': os.environ.get('REDIS_CACHE_URL', CELERY_BROKER_URL),
+                'KEY_PREFIX': 'spotshot',
+                # A slow or unreachable cache should cost a miss, not a hung request
+                'OPTIONS': {'socket_connect_timeout': 1, 'socket_timeout': 1},
+            }
+        }
+        CLIENT_CARD_CACHE_TIMEOUT = int(os.environ.get('CLIENT_CARD_CACHE_TIMEOUT', 300))
+        USER_STATS_CACHE_TIMEOUT = int(os.environ.get('USER_STATS_CACHE_TIMEOUT', 60))
+        
         FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
+        STORAGE_WEBHOOK_TOKEN = os.environ.get('STORAGE_WEBHOOK_TOKEN', '')
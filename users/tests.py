@@ -1,3 +1,48 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from projects.models import Project
+from qr.models import PhotoUploadBatch, QRCard, QRCardBatch, QRCardPhoto
+
+
+class UserStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='photographer', password='x')
+        Project.objects.create(user=self.user, name='Beach day')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_project(self, cards):
+        project = Project.objects.create(user=self.user, name=f'Project {Project.objects.count()}')
+        qr_batch = QRCardBatch.objects.create(project=project, amount=cards)
+        PhotoUploadBatch.objects.create(project=project)
+        for i in range(cards):
+            card = QRCard.objects.create(project=project, batch=qr_batch, code=f'{project.id}-{i}', access_pin='1234')
+            QRCardPhoto.objects.create(qr_card=card, image=f'qr_photos/{card.id}.jpg', original_filename='a.jpg', file_size=1)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_query_count_does_not_depend_on_rows(self):
+        self.add_project(2)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get('/api/auth/user/stats/').status_code, 200)
+        self.add_project(10)
+        with self.assertNumQueries(len(small)):
+            stats = self.client.get('/api/auth/user/stats/').data
+
+        self.assertEqual(stats['total_projects'], 3)
+        self.assertEqual(stats['total_qr_cards'], 12)
+        self.assertEqual(stats['total_photos'], 12)
+        self.assertEqual(stats['qr_cards_by_status']['distributed'], 12)
+        self.assertEqual(stats['photo_batches_by_status']['uploading'], 2)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached(self):
+        cache.clear()
+        self.assertEqual(self.client.get('/api/auth/user/stats/').data['total_projects'], 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/auth/user/stats/').data['total_projects'], 1)
@@ -7,7 +7,14 @@ from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.db.models import Count
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
@@ -92,36 +99,72 @@ def change_password(request):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def user_stats(request):
-    """Get user statistics."""
-    user = request.user
-    
+    """
+    Get user statistics.
+
+    A fixed number of aggregate queries however many projects and cards the
+    user has, cached per user for USER_STATS_CACHE_TIMEOUT seconds.
+    """
+    cache_key = f'users:stats:{request.user.pk}'
+    try:
+        stats = cache.get(cache_key)
+    except Exception as e:
+        logger.warning(f"User stats cache read failed: {str(e)}")
+        stats = None
+
+    if stats is None:
+        stats = compute_user_stats(request.user)
+        try:
+            cache.set(cache_key, stats, getattr(settings, 'USER_STATS_CACHE_TIMEOUT', 60))
+        except Exception as e:
+            logger.warning(f"User stats cache write failed: {str(e)}")
+
+    return Response(stats)
+
+
+def compute_user_stats(user):
     # Import here to avoid circular imports
     from projects.models import Project
-    from qr.models import QRCard
-    
-    # Get user's projects and related stats
-    projects = Project.objects.filter(user=user)
-    total_projects = projects.count()
-    
-    # Get QR cards for user's projects
-    qr_cards = QRCard.objects.filter(project__user=user)
-    total_qr_cards = qr_cards.count()
-    
-    # Count total photos across all user's QR cards
-    total_photos = sum(qr_card.photo_count for qr_card in qr_cards)
-    
-    # Count projects created this month
-    from django.utils import timezone
-    from datetime import datetime
+    from qr.models import PhotoUploadBatch, QRCard
+
+    # Count projects created this month; card totals come from the project counters (qr.counters)
     current_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    this_month_projects = projects.filter(created_at__gte=current_month).count()
-    
-    return Response({
-        'total_projects': total_projects,
-        'total_qr_cards': total_qr_cards,
-        'total_photos': total_photos,
-        'this_month_projects': this_month_projects,
-    })
+    statuses = [value for value, _ in QRCard.STATUS_CHOICES]
+    projects = Project.objects.filter(user=user).aggregate(
+        total=Count('id'),
+        this_month=Count('id', filter=Q(created_at__gte=current_month)),
+        qr_cards=Coalesce(Sum('card_total'), 0),
+        photos=Coalesce(Sum('photo_total'), 0),
+        **{status: Coalesce(Sum(f'cards_{status}'), 0) for status in statuses},
+    )
+    qr_cards_by_status = {status: projects[status] for status in statuses}
+
+    # Photos per card status from the per-card counters, without joining the photos
+    photos_by_status = {status: 0 for status in statuses}
+    card_rows = (
+        QRCard.objects.filter(project__user=user).order_by().values('status')
+        .annotate(photos=Sum('photo_total'))
+    )
+    for row in card_rows:
+        photos_by_status[row['status']] = row['photos']
+
+    photo_batches_by_status = {value: 0 for value, _ in PhotoUploadBatch.STATUS_CHOICES}
+    batch_rows = (
+        PhotoUploadBatch.objects.filter(project__user=user).order_by().values('status')
+        .annotate(batches=Count('id'))
+    )
+    for row in batch_rows:
+        photo_batches_by_status[row['status']] = row['batches']
+
+    return {
+        'total_projects': projects['total'],
+        'total_qr_cards': projects['qr_cards'],
+        'total_photos': projects['photos'],
+        'this_month_projects': projects['this_month'],
+        'qr_cards_by_status': qr_cards_by_status,
+        'photos_by_status': photos_by_status,
+        'photo_batches_by_status': photo_batches_by_status,
+    }
 
 
 @api_view(['POST'])